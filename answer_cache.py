@@ -0,0 +1,324 @@
+# this file holds the final-answer cache for near-duplicate questions
+# users often ask the same question again, typed a little differently ("Which
+# AI-powered SOC startups raised capital?" / "which ai powered SOC startups
+# raised capital"). the graph's entry node looks the question up here, and on
+# a hit returns the stored ReviseAnswer (answer + references) straight away,
+# skipping the whole draft -> search -> revise loop.
+# a wrong hit is a wrong answer, so the cache is off unless ANSWER_CACHE=1, and
+# the match is strict:
+# 1. similarity: TF-IDF cosine over character trigrams of the whole normalized
+#    question (across word boundaries) plus its content word bigrams,
+#    >= threshold (0.8). the bigrams make it order-aware: "did microsoft
+#    acquire nuance" and "did nuance acquire microsoft" share every word but
+#    no bigram, and score about 0.35
+# 2. the content words (everything but stopwords, plurals folded) may differ
+#    by one added or dropped word ("... raised capital recently?"), but a
+#    replaced word is a miss: trigrams alone find "group homology" and
+#    "group cohomology" 0.95 similar
+# 3. numbers and negations must match exactly, so "... in 2023" never answers
+#    "... in 2024", nor "did ... fail" "did ... not fail"
+# 4. freshness: entries older than max_age_seconds are ignored
+# 5. bypass: config={"configurable": {"bypass_answer_cache": True}} (main.py --fresh)
+#    skips the lookup; the fresh answer replaces the stored one
+# answers are stored when a run ends, in SQLite (.cache/answer_cache.sqlite).
+
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Dict, FrozenSet, List, Optional, Set
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+
+from search_cache import open_db
+from search_index import tokenize
+
+DEFAULT_ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", ".cache/answer_cache.sqlite")
+DEFAULT_THRESHOLD = 0.8
+MAX_WORD_CHANGES = 1  # content words added or dropped (not replaced) in a hit
+BIGRAM_WEIGHT = 3  # a word bigram counts as this many trigrams
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10_000
+BYPASS_KEY = "bypass_answer_cache"
+
+_NON_WORD = re.compile(r"[^\w]+")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+NEGATIONS = frozenset(
+    "no not never none nor neither without cannot fail failed fails failing "
+    "didn doesn don isn wasn weren aren won wouldn shouldn couldn hasn haven hadn".split()
+)
+
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return " ".join(_NON_WORD.sub(" ", text).split())
+
+
+def numbers(normalized: str) -> FrozenSet[str]:
+    return frozenset(_NUMBER.findall(normalized))
+
+
+def negations(normalized: str) -> FrozenSet[str]:
+    return frozenset(word for word in normalized.split() if word in NEGATIONS)
+
+
+def _singular(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def content_words(normalized: str) -> FrozenSet[str]:
+    """The words that carry the meaning: no stopwords, numbers or negations, plurals folded."""
+    return frozenset(
+        _singular(word)
+        for word in tokenize(normalized)
+        if not _NUMBER.fullmatch(word) and word not in NEGATIONS
+    )
+
+
+def features(normalized: str) -> Counter:
+    """Character trigrams across word boundaries, plus content word bigrams ("a|b")."""
+    padded = f" {normalized} "
+    grams = Counter(padded[i : i + 3] for i in range(len(padded) - 2))
+    words = [_singular(word) for word in tokenize(normalized)]
+    for a, b in zip(words, words[1:]):
+        grams[f"{a}|{b}"] += BIGRAM_WEIGHT  # "|" is never in a trigram
+    return grams
+
+
+@dataclass
+class Entry:
+    id: int
+    question: str
+    grams: Counter
+    numbers: FrozenSet[str]
+    negations: FrozenSet[str]
+    words: FrozenSet[str]  # content_words()
+    answer: dict  # the ReviseAnswer tool call arguments
+    created_at: float
+    weights: Dict[str, float] = field(default_factory=dict)  # TF-IDF of the features
+    norm: float = 1.0
+
+
+class AnswerCache:
+    """Finished answers, looked up by near-duplicate question."""
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_ANSWER_CACHE_PATH,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.max_age_seconds = max_age_seconds
+        self.max_entries = max_entries
+        self._entries: Dict[int, Entry] = {}
+        self._by_question: Dict[str, int] = {}  # normalized question -> entry id
+        self._postings: Dict[str, Set[int]] = {}  # feature -> entry ids
+        self._next_id = 1
+        self._weighted_size = 0  # entries when every entry was last re-weighted
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        # path=None keeps the cache in memory only
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = open_db(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS answers ("
+                "question TEXT PRIMARY KEY, answer TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "DELETE FROM answers WHERE created_at < ?",
+                (time.time() - self.max_age_seconds,),
+            )
+            self._db.commit()
+            for question, answer, created_at in self._db.execute(
+                "SELECT question, answer, created_at FROM answers ORDER BY created_at"
+            ):
+                self._add(question, json.loads(answer), created_at)
+
+    def _add(self, question: str, answer: dict, created_at: float) -> None:
+        normalized = normalize_question(question)
+        old = self._by_question.pop(normalized, None)
+        if old is not None:
+            self._remove(old)
+        entry = Entry(
+            self._next_id,
+            question,
+            features(normalized),
+            numbers(normalized),
+            negations(normalized),
+            content_words(normalized),
+            answer,
+            created_at,
+        )
+        self._next_id += 1
+        self._entries[entry.id] = entry
+        self._by_question[normalized] = entry.id
+        for gram in entry.grams:
+            self._postings.setdefault(gram, set()).add(entry.id)
+        self._weigh(entry)
+        if len(self._entries) >= 2 * self._weighted_size:
+            # the IDF drifts as the cache grows: re-weight everything whenever
+            # it has doubled, so lookups never have to
+            for other in self._entries.values():
+                self._weigh(other)
+            self._weighted_size = len(self._entries)
+
+    def _weigh(self, entry: Entry) -> None:
+        entry.weights = self._weights(entry.grams)
+        entry.norm = math.sqrt(sum(w * w for w in entry.weights.values())) or 1.0
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        for gram in entry.grams:
+            ids = self._postings[gram]
+            ids.discard(entry_id)
+            if not ids:
+                del self._postings[gram]
+
+    def _idf(self, gram: str) -> float:
+        return math.log((len(self._entries) + 1) / (len(self._postings.get(gram, ())) + 1)) + 1
+
+    def _weights(self, grams: Counter) -> Dict[str, float]:
+        return {gram: count * self._idf(gram) for gram, count in grams.items()}
+
+    def lookup(self, question: str) -> Optional[dict]:
+        """The stored answer of the most similar fresh question, or None."""
+        normalized = normalize_question(question)
+        grams = features(normalized)
+        wanted_numbers = numbers(normalized)
+        wanted_negations = negations(normalized)
+        wanted_words = content_words(normalized)
+        oldest = time.time() - self.max_age_seconds
+        with self._lock:  # the IDF reads the postings, which store() changes
+            query = self._weights(grams)
+            query_norm = math.sqrt(sum(w * w for w in query.values())) or 1.0
+            candidates = set()
+            for gram in query:
+                candidates |= self._postings.get(gram, set())
+            best, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if (
+                    entry.created_at < oldest
+                    or entry.numbers != wanted_numbers
+                    or entry.negations != wanted_negations
+                    or len(entry.words ^ wanted_words) > MAX_WORD_CHANGES
+                ):
+                    continue
+                score = sum(w * entry.weights.get(gram, 0.0) for gram, w in query.items())
+                score /= query_norm * entry.norm
+                if score > best_score:
+                    best, best_score = entry, score
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return {
+                "answer": best.answer,
+                "question": best.question,
+                "similarity": round(best_score, 4),
+                "created_at": best.created_at,
+            }
+
+    def store(self, question: str, answer: dict) -> None:
+        created_at = time.time()
+        with self._lock:
+            self._add(question, answer, created_at)
+            while len(self._entries) > self.max_entries:
+                oldest = min(self._entries.values(), key=lambda entry: entry.created_at)
+                self._by_question.pop(normalize_question(oldest.question), None)
+                self._remove(oldest.id)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO answers (question, answer, created_at) "
+                    "VALUES (?, ?, ?)",
+                    (question, json.dumps(answer), created_at),
+                )
+                self._db.execute(
+                    "DELETE FROM answers WHERE question NOT IN ("
+                    "SELECT question FROM answers ORDER BY created_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    # ── graph hooks ────────────────────────────────────────────────────────
+    def lookup_node(self, messages: List[BaseMessage], config: RunnableConfig) -> List[BaseMessage]:
+        """Entry node: the stored answer as a ReviseAnswer tool call, or nothing."""
+        if (config.get("configurable") or {}).get(BYPASS_KEY):
+            self.bypassed += 1
+            return []
+        question = _question(messages)
+        hit = self.lookup(question) if question else None
+        if hit is None:
+            return []
+        return [
+            AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": "ReviseAnswer", "args": hit.pop("answer"), "id": "answer_cache"}
+                ],
+                response_metadata={"answer_cache": hit},
+            )
+        ]
+
+    def remember(self, messages: List[BaseMessage]) -> None:
+        """Store the final answer of a finished run."""
+        question = _question(messages)
+        final = next(
+            (
+                message
+                for message in reversed(messages)
+                if isinstance(message, AIMessage) and message.tool_calls
+            ),
+            None,
+        )
+        if question and final is not None and final.tool_calls[0]["name"] == "ReviseAnswer":
+            self.store(question, final.tool_calls[0]["args"])
+
+
+def is_cached_answer(messages: List[BaseMessage]) -> bool:
+    return isinstance(messages[-1], AIMessage) and "answer_cache" in messages[-1].response_metadata
+
+
+def _question(messages: List[BaseMessage]) -> Optional[str]:
+    return next(
+        (message.content for message in messages if isinstance(message, HumanMessage)), None
+    )
+
+
+# opt-in: ANSWER_CACHE=1 turns it on, ANSWER_CACHE_THRESHOLD /
+# ANSWER_CACHE_MAX_AGE (seconds) tune the similarity threshold and the
+# freshness window
+@cache
+def get_answer_cache() -> Optional[AnswerCache]:
+    load_dotenv()
+    if os.getenv("ANSWER_CACHE", "0") != "1":
+        return None
+    return AnswerCache(
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", DEFAULT_THRESHOLD)),
+        max_age_seconds=float(os.getenv("ANSWER_CACHE_MAX_AGE", DEFAULT_MAX_AGE_SECONDS)),
+    )
@@ -0,0 +1,173 @@
+# batch entry point: run a JSONL file of questions through the graph
+#
+# input:  one JSON object per line, {"id": "...", "question": "..."}
+#         ("id" is optional, a hash of the question is used instead)
+# output: one JSON object per finished question, appended as soon as it's done
+#         {"id", "question", "answer", "references", "iterations"} or {"id", "question", "error"}
+#
+# the job can be interrupted at any point and simply re-run with the same
+# arguments: questions already in the output file are skipped, and every
+# graph step is checkpointed to SQLite (thread_id = question id), so a
+# question that crashed halfway resumes from its last finished node instead
+# of redoing the draft and the searches/revisions it already paid for.
+#
+# usage: python batch.py questions.jsonl answers.jsonl [--concurrency 8] [--checkpoints .cache/checkpoints.sqlite]
+# the SQLite checkpointer (langgraph-checkpoint-sqlite, aiosqlite) is a project dependency
+
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+from pathlib import Path
+from typing import Iterator, List, Optional, Set
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from rich.console import Console
+
+from main import MAX_CONCURRENCY, build_graph
+
+DEFAULT_CHECKPOINT_PATH = ".cache/checkpoints.sqlite"
+
+console = Console(stderr=True)
+
+
+def question_id(question: str) -> str:
+    return hashlib.sha1(question.encode()).hexdigest()[:16]
+
+
+def read_questions(path: str) -> Iterator[dict]:
+    """Stream {"id", "question"} records from a JSONL file, one line at a time."""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"question": record}
+            if not record.get("question"):
+                raise ValueError(f"{path}:{line_number}: missing 'question'")
+            record.setdefault("id", question_id(record["question"]))
+            yield {"id": str(record["id"]), "question": record["question"]}
+
+
+def finished_ids(path: str) -> Set[str]:
+    """Ids that already have a successful answer in the output file."""
+    done: Set[str] = set()
+    if not Path(path).exists():
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by the crash, redo that question
+            if "answer" in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def final_answer(messages: List[BaseMessage]) -> dict:
+    last = next(
+        message
+        for message in reversed(messages)
+        if isinstance(message, AIMessage) and message.tool_calls
+    )
+    args = last.tool_calls[0]["args"]
+    return {
+        "answer": args.get("answer", ""),
+        "references": args.get("reference", []),
+        "iterations": sum(isinstance(message, ToolMessage) for message in messages),
+    }
+
+
+async def run_one(graph, record: dict) -> dict:
+    config = {"configurable": {"thread_id": record["id"]}}
+    snapshot = await graph.aget_state(config)
+    if snapshot.next:
+        # crashed halfway: None resumes from the last checkpoint
+        messages = await graph.ainvoke(None, config)
+    elif snapshot.values:
+        messages = snapshot.values  # finished, but the output line got lost
+    else:
+        messages = await graph.ainvoke(record["question"], config)
+    return {**record, **final_answer(messages)}
+
+
+async def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = MAX_CONCURRENCY,
+    checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+    graph_kwargs: Optional[dict] = None,
+) -> dict:
+    try:
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+    except ImportError:
+        raise SystemExit(
+            "batch.py needs the SQLite checkpointer, install the project dependencies: "
+            "uv sync (or pip install -e .)"
+        )
+
+    Path(checkpoint_path).parent.mkdir(parents=True, exist_ok=True)
+    done = finished_ids(output_path)
+    counts = {"skipped": 0, "answered": 0, "failed": 0}
+
+    async with AsyncSqliteSaver.from_conn_string(checkpoint_path) as checkpointer:
+        graph = build_graph(checkpointer=checkpointer, **(graph_kwargs or {}))
+        # at most `concurrency` questions in flight; the input is read lazily,
+        # a new line is only pulled once a slot is free
+        slots = asyncio.Semaphore(concurrency)
+        tasks: Set[asyncio.Task] = set()
+
+        with open(output_path, "a", encoding="utf-8") as out:
+
+            async def worker(record: dict) -> None:
+                try:
+                    result = await run_one(graph, record)
+                    counts["answered"] += 1
+                except Exception as error:  # keep going, the error is recorded
+                    result = {**record, "error": repr(error)}
+                    counts["failed"] += 1
+                finally:
+                    slots.release()
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()  # every finished answer survives a crash
+                console.log(
+                    f"{'✔' if 'answer' in result else '✘'} {record['id']} "
+                    f"({counts['answered']} answered, {counts['failed']} failed)"
+                )
+
+            for record in read_questions(input_path):
+                if record["id"] in done:
+                    counts["skipped"] += 1
+                    continue
+                done.add(record["id"])  # duplicates in the input run once
+                await slots.acquire()
+                task = asyncio.create_task(worker(record))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+
+    return counts
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions")
+    parser.add_argument("input", help="JSONL file, one {'id', 'question'} per line")
+    parser.add_argument("output", help="JSONL file the answers are appended to")
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument("--checkpoints", default=DEFAULT_CHECKPOINT_PATH)
+    args = parser.parse_args()
+
+    counts = asyncio.run(
+        run_batch(args.input, args.output, args.concurrency, args.checkpoints)
+    )
+    console.print(counts)
+    return 1 if counts["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+# offline benchmark of the draft -> execute_tools -> reviser loop.
+# the graph runs against the local stubs from stubs.py (no OpenAI / Tavily
+# calls), so the numbers measure our own code and langgraph's overhead
+# plus a known, configurable amount of simulated I/O latency.
+#
+# for every MAX_ITERATIONS setting it records:
+# 1. per-node latency (draft / execute_tools / reviser), from the debug stream
+# 2. graph overhead: wall time not spent inside any node
+# 3. state size (messages + serialized bytes) after every reviser pass
+# 4. end-to-end throughput (questions/s) at each concurrency setting
+# and writes everything as JSON, so runs can be diffed to catch regressions.
+#
+# usage: python benchmarks/graph_bench.py --iterations 1 2 3 --concurrency 1 4 16
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from importlib.metadata import version
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from main import arun_questions, build_graph  # noqa: E402
+from rate_limit import Scheduler  # noqa: E402
+from search_cache import SearchCache  # noqa: E402
+from search_index import SearchIndex  # noqa: E402
+from stopping import MaxIterations  # noqa: E402
+from stubs import StubChatModel, StubSearch  # noqa: E402
+
+
+def percentiles(samples: list[float]) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+    return {
+        "count": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "max": ordered[-1],
+    }
+
+
+def state_bytes(state) -> int:
+    return len(json.dumps([message.model_dump() for message in state], default=str))
+
+
+def make_graph(args, max_iterations: int):
+    llm = StubChatModel(latency=args.llm_latency, answer_words=args.answer_words)
+    search_tool = StubSearch(
+        latency=args.search_latency, content_words=args.content_words
+    )
+    # a fresh in-memory cache and index per setting, so runs don't warm each other up
+    graph = build_graph(
+        llm=llm,
+        search_tool=search_tool,
+        stopping_policy=MaxIterations(max_iterations),
+        search_cache=SearchCache(path=None),
+        search_index=SearchIndex(path=None),
+        # no provider limits to respect, but the same scheduling overhead
+        llm_scheduler=Scheduler("stub_llm"),
+        search_scheduler=Scheduler("stub_search"),
+        answer_cache=False,  # every iteration has to run the full loop
+    )
+    return graph, search_tool
+
+
+def profile_run(graph, question: str) -> dict:
+    """One sequential run: node latencies, overhead and state growth."""
+    node_latency: dict[str, list[float]] = {}
+    started: dict[str, datetime] = {}
+    state_growth = []
+    start = time.perf_counter()
+    for mode, chunk in graph.stream(question, stream_mode=["debug", "values"]):
+        if mode == "debug":
+            payload = chunk["payload"]
+            timestamp = datetime.fromisoformat(chunk["timestamp"])
+            if chunk["type"] == "task":
+                started[payload["id"]] = timestamp
+            elif chunk["type"] == "task_result" and payload["id"] in started:
+                elapsed = (timestamp - started.pop(payload["id"])).total_seconds()
+                node_latency.setdefault(payload["name"], []).append(elapsed)
+        elif mode == "values" and isinstance(chunk[-1], AIMessage):
+            state_growth.append(
+                {
+                    "iteration": sum(m.type == "tool" for m in chunk),
+                    "messages": len(chunk),
+                    "bytes": state_bytes(chunk),
+                }
+            )
+    wall = time.perf_counter() - start
+    in_nodes = sum(sum(samples) for samples in node_latency.values())
+    return {
+        "wall": wall,
+        "node_latency": node_latency,
+        "graph_overhead": max(0.0, wall - in_nodes),
+        "state_growth": state_growth,
+    }
+
+
+def bench_iterations(args, max_iterations: int) -> dict:
+    graph, search_tool = make_graph(args, max_iterations)
+    runs = [
+        profile_run(graph, f"Benchmark question {i}: {args.question}")
+        for i in range(args.profile_runs)
+    ]
+    node_names = sorted({name for run in runs for name in run["node_latency"]})
+    result = {
+        "max_iterations": max_iterations,
+        "wall": percentiles([run["wall"] for run in runs]),
+        "graph_overhead": percentiles([run["graph_overhead"] for run in runs]),
+        "node_latency": {
+            name: percentiles(
+                [sample for run in runs for sample in run["node_latency"].get(name, [])]
+            )
+            for name in node_names
+        },
+        "state_growth": runs[0]["state_growth"],
+        "searches_per_run": search_tool.calls / len(runs),
+        "throughput": [],
+    }
+
+    for concurrency in args.concurrency:
+        graph, _ = make_graph(args, max_iterations)
+        questions = [
+            f"Throughput question {i}: {args.question}" for i in range(args.questions)
+        ]
+        start = time.perf_counter()
+        outputs = asyncio.run(arun_questions(questions, concurrency, graph=graph))
+        elapsed = time.perf_counter() - start
+        result["throughput"].append(
+            {
+                "concurrency": concurrency,
+                "questions": len(questions),
+                "errors": sum(isinstance(output, Exception) for output in outputs),
+                "seconds": elapsed,
+                "questions_per_second": len(questions) / elapsed,
+            }
+        )
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline reflexion graph benchmark")
+    parser.add_argument("--iterations", type=int, nargs="+", default=[1, 2, 3])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--questions", type=int, default=16, help="per throughput run")
+    parser.add_argument("--profile-runs", type=int, default=5)
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds")
+    parser.add_argument("--search-latency", type=float, default=0.02, help="seconds")
+    parser.add_argument("--answer-words", type=int, default=250)
+    parser.add_argument("--content-words", type=int, default=120)
+    parser.add_argument(
+        "--question",
+        default="Write about AI-Powered SOC / autonomous problem domain.",
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "langgraph": version("langgraph"),
+            "langchain_core": version("langchain-core"),
+            "config": vars(args),
+        },
+        "results": [bench_iterations(args, n) for n in args.iterations],
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2))
+
+    for result in report["results"]:
+        best = max(result["throughput"], key=lambda t: t["questions_per_second"])
+        print(
+            f"MAX_ITERATIONS={result['max_iterations']}: "
+            f"p50 wall {result['wall']['p50']:.3f}s, "
+            f"overhead {result['graph_overhead']['p50'] * 1000:.1f}ms, "
+            f"final state {result['state_growth'][-1]['bytes']} bytes, "
+            f"best {best['questions_per_second']:.1f} q/s @ {best['concurrency']}"
+        )
+    print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
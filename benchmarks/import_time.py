@@ -0,0 +1,91 @@
+# cold-start guard: importing the agent must stay cheap and offline.
+# every measurement runs in a fresh interpreter (so nothing is already in
+# sys.modules) and we take the median over a few runs. the script exits with
+# status 1 when a budget is exceeded or a heavy module leaks into the import.
+#
+# usage: python benchmarks/import_time.py [--runs 5] [--import-budget 1.0] [--build-budget 4.0]
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# importing main must not pull these in, they are only needed to build the graph
+HEAVY_MODULES = ["langgraph.graph", "langgraph.prebuilt", "langchain_openai", "langchain_tavily"]
+
+IMPORT_SNIPPET = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "leaked": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+# build the graph (constructs the clients, but makes no network call)
+BUILD_SNIPPET = """
+import json, time
+import main
+start = time.perf_counter()
+main.get_graph()
+print(json.dumps({"seconds": time.perf_counter() - start, "leaked": []}))
+"""
+
+
+def measure(snippet: str, runs: int) -> dict:
+    env = {
+        **os.environ,
+        # the clients want *some* key at construction time, the value is never used
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+        "TAVILY_API_KEY": os.environ.get("TAVILY_API_KEY", "tvly-benchmark"),
+    }
+    samples, leaked = [], set()
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", snippet],
+            cwd=REPO_ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["seconds"])
+        leaked.update(result["leaked"])
+    return {"median": statistics.median(samples), "max": max(samples), "leaked": sorted(leaked)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cold-start budget check")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget", type=float, default=1.0, help="seconds")
+    parser.add_argument("--build-budget", type=float, default=4.0, help="seconds")
+    args = parser.parse_args()
+
+    imported = measure(IMPORT_SNIPPET, args.runs)
+    built = measure(BUILD_SNIPPET, args.runs)
+    report = {
+        "import_main": {**imported, "budget": args.import_budget},
+        "build_graph": {**built, "budget": args.build_budget},
+    }
+    print(json.dumps(report, indent=2))
+
+    failed = False
+    if imported["leaked"]:
+        print(f"FAIL: `import main` imported {imported['leaked']}", file=sys.stderr)
+        failed = True
+    if imported["median"] > args.import_budget:
+        print(f"FAIL: `import main` took {imported['median']:.3f}s", file=sys.stderr)
+        failed = True
+    if built["median"] > args.build_budget:
+        print(f"FAIL: get_graph() took {built['median']:.3f}s", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# load test for server.py against the local stub backends (no API keys needed)
+# starts `python server.py --stub` on a free port, submits --requests
+# questions drawn from --distinct different ones (so duplicates get coalesced),
+# polls every job until it's done and reports latency / throughput as JSON.
+#
+# usage: python benchmarks/load_test.py --requests 200 --distinct 50 --clients 32
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(client: httpx.AsyncClient, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("server did not come up")
+
+
+async def one_request(client: httpx.AsyncClient, question: str, poll: float) -> dict:
+    start = time.perf_counter()
+    submitted = (await client.post("/questions", json={"question": question})).json()
+    while True:
+        job = (await client.get(f"/questions/{submitted['id']}")).json()
+        if job["status"] in ("done", "failed"):
+            break
+        await asyncio.sleep(poll)
+    return {
+        "latency": time.perf_counter() - start,
+        "coalesced": submitted["coalesced"],
+        "ok": job["status"] == "done",
+    }
+
+
+async def run(args) -> dict:
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "server.py",
+            "--stub",
+            "--port",
+            str(port),
+            "--concurrency",
+            str(args.concurrency),
+            "--stub-latency",
+            str(args.stub_latency),
+        ],
+        cwd=REPO_ROOT,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        limits = httpx.Limits(max_connections=args.clients)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60
+        ) as client:
+            await wait_until_up(client)
+            rng = random.Random(0)
+            questions = [
+                f"Load test question {rng.randrange(args.distinct)}"
+                for _ in range(args.requests)
+            ]
+            clients = asyncio.Semaphore(args.clients)
+
+            async def limited(question):
+                async with clients:
+                    return await one_request(client, question, args.poll)
+
+            start = time.perf_counter()
+            results = await asyncio.gather(*(limited(q) for q in questions))
+            elapsed = time.perf_counter() - start
+            health = (await client.get("/health")).json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(result["latency"] for result in results)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]  # noqa: E731
+    return {
+        "config": vars(args),
+        "seconds": elapsed,
+        "requests_per_second": len(results) / elapsed,
+        "ok": sum(result["ok"] for result in results),
+        "coalesced": sum(result["coalesced"] for result in results),
+        "latency": {
+            "mean": statistics.fmean(latencies),
+            "p50": pick(0.50),
+            "p95": pick(0.95),
+            "p99": pick(0.99),
+        },
+        "server": health,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Load test server.py with stub backends")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent callers")
+    parser.add_argument("--concurrency", type=int, default=16, help="server graph runs")
+    parser.add_argument("--stub-latency", type=float, default=0.05)
+    parser.add_argument("--poll", type=float, default=0.05)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text)
+    print(text)
+    return 0 if report["ok"] == args.requests else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
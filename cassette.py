@@ -0,0 +1,439 @@
+# this file holds the record / replay ("cassette") mode of the graph
+# a run talks to OpenAI (draft / reviser calls, the section planner) and to
+# Tavily (run_queries). to profile our own code, reproduce an incident or
+# benchmark a change against real payloads, that I/O is taped once and played
+# back as often as needed:
+# 1. record: CassetteChatModel wraps the real chat model of every route and
+#    CassetteSearch the real Tavily tool; every exchange (the response message,
+#    or the search payload) is appended to the cassette with its latency
+# 2. replay: the same classes answer from the cassette, with no network and
+#    no API key, after the recorded latency times latency_scale (1.0 =
+#    original, 0.0 = zero)
+# the cassette is gzipped JSON lines, written as the run goes (a crashed run
+# keeps what it recorded). LLM exchanges are looked up by a hash of the prompt
+# (ids, usage and the {time} partial left out) and the bound tool; a prompt
+# that changed since the recording (e.g. a new prompt template) falls back to
+# the next unplayed exchange of the same question and tool. searches are
+# looked up by normalized query; an unknown query gets an empty result.
+# both fallbacks are counted in stats(), strict=True raises instead.
+#
+# usage: python main.py --record run.cassette.gz "question"
+#        python main.py --replay run.cassette.gz --replay-latency zero "question"
+
+import asyncio
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    message_chunk_to_message,
+    message_to_dict,
+    messages_from_dict,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+from pydantic import PrivateAttr
+
+from llm_cache import _TIMESTAMP, _strip_volatile
+from search_cache import normalize_query
+from stubs import tool_call_chunks
+
+FORMAT_VERSION = 1
+# the real model runs inside the cassette model's call: without this, it would
+# inherit its callbacks and every token would reach the handlers twice
+_UNTRACED = {"callbacks": []}
+
+
+def _question(messages: List[BaseMessage]) -> str:
+    return next((str(m.content) for m in messages if m.type == "human"), "")
+
+
+def prompt_key(messages: List[BaseMessage], tool_name: Optional[str]) -> str:
+    """Hash of the prompt without ids, usage and timestamps, plus the bound tool."""
+    canonical = json.dumps(
+        _strip_volatile([message_to_dict(message) for message in messages]),
+        sort_keys=True,
+        default=str,
+    )
+    digest = hashlib.sha256(_TIMESTAMP.sub("", canonical).encode())
+    digest.update(b"\0" + str(tool_name).encode())
+    return digest.hexdigest()
+
+
+class Cassette:
+    """LLM exchanges and search payloads of recorded runs, in one gzipped file."""
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "replay",
+        latency_scale: float = 1.0,
+        strict: bool = False,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError("mode must be 'record' or 'replay'")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self.counters = {
+            "llm_recorded": 0,
+            "llm_replayed": 0,
+            "llm_fallbacks": 0,  # played back by question + tool, the prompt had changed
+            "search_recorded": 0,
+            "search_replayed": 0,
+            "search_misses": 0,  # queries the cassette has no payload for
+        }
+        self._file = None
+        # replay queues: the same prompt / query can legitimately come back
+        # (escalation, hedged searches), so every key holds its records in order
+        self._llm: Dict[str, Deque[dict]] = {}
+        self._llm_by_question: Dict[Tuple[str, str], Deque[dict]] = {}
+        self._search: Dict[str, Deque[dict]] = {}
+        if mode == "record":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+            self._write({"kind": "header", "version": FORMAT_VERSION, "created_at": time.time()})
+        else:
+            self._load()
+
+    # ── recording ─────────────────────────────────────────────────────────
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            if self._file is None:
+                return  # closed: a speculative search that finished after the run
+            self._file.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+            self._file.flush()  # a sync flush: the file is readable up to here
+
+    def record_llm(
+        self,
+        messages: List[BaseMessage],
+        tool_name: Optional[str],
+        message: AIMessage,
+        latency: float,
+    ) -> None:
+        self._write(
+            {
+                "kind": "llm",
+                "key": prompt_key(messages, tool_name),
+                "tool": tool_name,
+                "question": _question(messages),
+                "latency": round(latency, 4),
+                "message": message_to_dict(message),
+            }
+        )
+        self.counters["llm_recorded"] += 1
+
+    def record_search(
+        self, query: str, result: Any, latency: float, error: Optional[str] = None
+    ) -> None:
+        record = {"kind": "search", "query": query, "latency": round(latency, 4), "result": result}
+        if error is not None:
+            record["error"] = error
+        self._write(record)
+        self.counters["search_recorded"] += 1
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    # ── replaying ─────────────────────────────────────────────────────────
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as file:
+            for line in file:
+                record = json.loads(line)
+                if record["kind"] == "header":
+                    if record["version"] != FORMAT_VERSION:
+                        raise ValueError(
+                            f"{self.path}: unsupported cassette version {record['version']}"
+                        )
+                elif record["kind"] == "llm":
+                    self._llm.setdefault(record["key"], deque()).append(record)
+                    queue = (record["question"], str(record["tool"]))
+                    self._llm_by_question.setdefault(queue, deque()).append(record)
+                elif record["kind"] == "search":
+                    key = normalize_query(record["query"])
+                    self._search.setdefault(key, deque()).append(record)
+
+    def _next_llm(self, messages: List[BaseMessage], tool_name: Optional[str]) -> dict:
+        key = prompt_key(messages, tool_name)
+        by_question = self._llm_by_question.get((_question(messages), str(tool_name)), deque())
+        with self._lock:
+            if self._llm.get(key):
+                record = self._llm[key].popleft()
+                by_question.remove(record)
+                self.counters["llm_replayed"] += 1
+                return record
+            if by_question and not self.strict:
+                record = by_question.popleft()
+                self._llm[record["key"]].remove(record)
+                self.counters["llm_replayed"] += 1
+                self.counters["llm_fallbacks"] += 1
+                return record
+        raise LookupError(
+            f"{self.path}: no recorded {tool_name} call for question {_question(messages)!r}"
+        )
+
+    def replay_llm(
+        self, messages: List[BaseMessage], tool_name: Optional[str]
+    ) -> Tuple[AIMessage, float]:
+        """The recorded response to this prompt and how long to take for it."""
+        record = self._next_llm(messages, tool_name)
+        message = messages_from_dict([record["message"]])[0]
+        return message, record["latency"] * self.latency_scale
+
+    def replay_search(self, query: str) -> Tuple[Any, Optional[str], float]:
+        """(payload, error, latency) of the recorded search."""
+        with self._lock:
+            queue = self._search.get(normalize_query(query))
+            if queue:
+                record = queue.popleft() if len(queue) > 1 else queue[0]
+                self.counters["search_replayed"] += 1
+                return record["result"], record.get("error"), record["latency"] * self.latency_scale
+            self.counters["search_misses"] += 1
+        if self.strict:
+            raise LookupError(f"{self.path}: no recorded search for {query!r}")
+        return {"query": query, "results": []}, None, 0.0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+class CassetteChatModel(BaseChatModel):
+    """Records the responses of `llm` to the cassette, or (llm=None) replays them."""
+
+    cassette: Any
+    llm: Any = None  # the real chat model, only when recording
+    chunk_size: int = 16  # characters of tool-call arguments per replayed chunk
+    model_name: str = "cassette"
+    _bound: Dict[str, Any] = PrivateAttr(default_factory=dict)
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        # like StubChatModel: the bound tool's name goes into every call, and
+        # when recording the real model is bound the same way
+        tool = tools[0]
+        name = getattr(tool, "__name__", None) or tool.get("name")
+        # the speculative schemas share the tool name (schemas.py), so the
+        # real binding is kept per schema; the cassette matches on the name
+        key = f"{name}:{id(tool)}"
+        if self.llm is not None:
+            self._bound[key] = self.llm.bind_tools(tools, tool_choice=tool_choice, **kwargs)
+        return self.bind(tool_name=name, tool_key=key)
+
+    def _real(self, tool_key: Optional[str]) -> Tuple[Any, dict]:
+        # (model, bound kwargs): a RunnableBinding would merge the callbacks of
+        # the surrounding run back into _UNTRACED, so the model is called directly
+        bound = self._bound.get(tool_key, self.llm)
+        return getattr(bound, "bound", bound), getattr(bound, "kwargs", {})
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: Optional[str] = None,
+        tool_key: Optional[str] = None,
+        **kwargs,
+    ) -> ChatResult:
+        if self.llm is None:
+            message, latency = self.cassette.replay_llm(messages, tool_name)
+            time.sleep(latency)
+        else:
+            real, bound = self._real(tool_key)
+            start = time.perf_counter()
+            message = real.invoke(messages, _UNTRACED, stop=stop, **bound)
+            self.cassette.record_llm(messages, tool_name, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: Optional[str] = None,
+        tool_key: Optional[str] = None,
+        **kwargs,
+    ) -> ChatResult:
+        if self.llm is None:
+            message, latency = self.cassette.replay_llm(messages, tool_name)
+            await asyncio.sleep(latency)
+        else:
+            real, bound = self._real(tool_key)
+            start = time.perf_counter()
+            message = await real.ainvoke(messages, _UNTRACED, stop=stop, **bound)
+            self.cassette.record_llm(messages, tool_name, message, time.perf_counter() - start)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: Optional[str] = None,
+        tool_key: Optional[str] = None,
+        **kwargs,
+    ) -> Iterator[ChatGenerationChunk]:
+        if self.llm is None:
+            message, latency = self.cassette.replay_llm(messages, tool_name)
+            chunks = tool_call_chunks(message, self.chunk_size)
+            for chunk in chunks:
+                time.sleep(latency / len(chunks))
+                if run_manager:
+                    run_manager.on_llm_new_token("", chunk=chunk)
+                yield chunk
+            return
+        real, bound = self._real(tool_key)
+        start, received = time.perf_counter(), []
+        for message_chunk in real.stream(messages, _UNTRACED, stop=stop, **bound):
+            chunk = ChatGenerationChunk(message=message_chunk)
+            received.append(message_chunk)
+            if run_manager:
+                run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+        self._record_stream(messages, tool_name, received, time.perf_counter() - start)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: Optional[str] = None,
+        tool_key: Optional[str] = None,
+        **kwargs,
+    ):
+        if self.llm is None:
+            message, latency = self.cassette.replay_llm(messages, tool_name)
+            chunks = tool_call_chunks(message, self.chunk_size)
+            for chunk in chunks:
+                await asyncio.sleep(latency / len(chunks))
+                if run_manager:
+                    await run_manager.on_llm_new_token("", chunk=chunk)
+                yield chunk
+            return
+        real, bound = self._real(tool_key)
+        start, received = time.perf_counter(), []
+        async for message_chunk in real.astream(messages, _UNTRACED, stop=stop, **bound):
+            chunk = ChatGenerationChunk(message=message_chunk)
+            received.append(message_chunk)
+            if run_manager:
+                await run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+        self._record_stream(messages, tool_name, received, time.perf_counter() - start)
+
+    def _record_stream(
+        self, messages, tool_name, received: List[AIMessageChunk], latency: float
+    ) -> None:
+        if not received:
+            return
+        full = received[0]
+        for message_chunk in received[1:]:
+            full += message_chunk
+        self.cassette.record_llm(messages, tool_name, message_chunk_to_message(full), latency)
+
+
+class CassetteSearch(BaseTool):
+    """Tavily results recorded from `tool`, or (tool=None) replayed from the cassette.
+
+    Named like TavilySearch, so it drops into build_execute_tools like StubSearch.
+    """
+
+    name: str = "tavily_search"
+    description: str = "Tavily search, recorded to / replayed from a cassette."
+    cassette: Any
+    tool: Any = None  # the real search tool, only when recording
+
+    def _run(self, query: str, **kwargs) -> Any:
+        if self.tool is None:
+            result, error, latency = self.cassette.replay_search(query)
+            time.sleep(latency)
+            return self._replayed(result, error)
+        start = time.perf_counter()
+        try:
+            result = self.tool.invoke({"query": query})
+        except Exception as error:
+            self.cassette.record_search(query, None, time.perf_counter() - start, repr(error))
+            raise
+        self.cassette.record_search(query, result, time.perf_counter() - start)
+        return result
+
+    async def _arun(self, query: str, **kwargs) -> Any:
+        if self.tool is None:
+            result, error, latency = self.cassette.replay_search(query)
+            await asyncio.sleep(latency)
+            return self._replayed(result, error)
+        start = time.perf_counter()
+        try:
+            result = await self.tool.ainvoke({"query": query})
+        except Exception as error:
+            self.cassette.record_search(query, None, time.perf_counter() - start, repr(error))
+            raise
+        self.cassette.record_search(query, result, time.perf_counter() - start)
+        return result
+
+    @staticmethod
+    def _replayed(result: Any, error: Optional[str]) -> Any:
+        if error is not None:
+            raise RuntimeError(f"recorded search error: {error}")
+        return result
+
+
+# the keyword arguments of main.build_graph / sections.build_sectioned_graph
+# that route all of a graph's I/O through the cassette. when recording, `llm`
+# and `search_tool` are what gets taped (default: the chat model of every
+# route and Tavily; e.g. the stubs for an offline cassette). the search cache
+# and local index are in-memory and empty, and the answer cache is off, so the
+# recorded run and every replay take the same path through the graph (a hit
+# in the persistent caches would hide a search from the cassette). replays
+# run without rate limits: there is no provider to protect.
+def graph_kwargs(cassette: Cassette, max_iterations: int = 3, llm=None, search_tool=None) -> dict:
+    from rate_limit import Scheduler
+    from routing import ModelRouter, _openai_llm
+    from search_cache import SearchCache
+    from search_index import SearchIndex
+
+    recording = cassette.mode == "record"
+
+    def taped(real=None) -> CassetteChatModel:
+        return CassetteChatModel(cassette=cassette, llm=real if recording else None)
+
+    def llm_factory(route) -> CassetteChatModel:
+        return taped((llm or _openai_llm(route)) if recording else None)
+
+    kwargs = {
+        "router": ModelRouter(llm_factory=llm_factory, max_iterations=max_iterations),
+        "search_cache": SearchCache(path=None),
+        "search_index": SearchIndex(path=None),
+        "answer_cache": False,
+    }
+    if recording:
+        from chains import get_llm
+        from tool_executor import get_tavily_tool
+
+        # llm is only used by the section planner (sections.py)
+        kwargs["llm"] = taped(llm or get_llm())
+        kwargs["search_tool"] = CassetteSearch(
+            cassette=cassette, tool=search_tool or get_tavily_tool()
+        )
+    else:
+        kwargs["llm"] = taped()
+        kwargs["search_tool"] = CassetteSearch(cassette=cassette)
+        kwargs["llm_scheduler"] = Scheduler("replay_llm")
+        kwargs["search_scheduler"] = Scheduler("replay_search")
+    return kwargs
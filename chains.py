@@ -1,32 +1,64 @@
 import datetime
+import os
+from functools import cache
 
 from dotenv import load_dotenv
-
-load_dotenv()
-
-
-from langchain_core.messages import HumanMessage
-from langchain_core.output_parsers.openai_tools import (
-    JsonOutputToolsParser,
-    PydanticToolsParser,
-)
 from langchain_core.prompts import (  # hold history of agent iterations
     ChatPromptTemplate,
     MessagesPlaceholder,
 )
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableLambda
+
+from compaction import MessageCompactor, count_messages_tokens
+from llm_cache import ResponseCache
+from rate_limit import get_scheduler, scheduled
+from routing import ModelRouter, get_router
+from schemas import (
+    AnswerQuestion,
+    ReviseAnswer,
+    SectionPlan,
+    SpeculativeAnswerQuestion,
+    SpeculativeReviseAnswer,
+)
+
+MODEL = "gpt-4.1-mini"
 
-from schemas import AnswerQuestion, ReviseAnswer
 
-llm = ChatOpenAI(model="gpt-4.1-mini")
+# nothing in this module talks to the network or builds a client at import
+# time: the LLM and the chains are created on first use (get_llm(),
+# get_first_responder(), get_reviser()), so importing is cheap and works offline.
+# `chains.llm`, `chains.first_responder` and `chains.reviser` still work, they
+# go through the module __getattr__ at the bottom of this file.
+# one client per (model, max_tokens, temperature): the stages of the graph
+# can run on different models, see routing.py
+@cache
+def get_llm(model: str = MODEL, max_tokens=None, temperature=None):
+    load_dotenv()  # read OPENAI_API_KEY from .env only when we really need it
+    from langchain_openai import ChatOpenAI  # heavy import, keep it off the startup path
 
-# create 2 output parsers
-parser = JsonOutputToolsParser(
-    return_id=True
-)  # return function call from LLM and transform into a dict
-parser_pydantic = PydanticToolsParser(
-    tools=[AnswerQuestion]
-)  # take response from LLM, then transform it into AnswerQuestion object
+    options = {}
+    if max_tokens is not None:
+        options["max_tokens"] = max_tokens
+    if temperature is not None:
+        options["temperature"] = temperature
+    # retries are left to the shared scheduler (see below), which spaces them
+    # out across every caller instead of each request retrying on its own
+    return ChatOpenAI(model=model, cache=get_response_cache(), max_retries=0, **options)
+
+
+# identical prompts (batch reruns, retries) are answered from a local cache
+# instead of paying for a new generation. the key is a hash of the rendered
+# prompt + model + bound tools/tool_choice; the volatile {time} partial only
+# enters the key at LLM_CACHE_TIME_GRANULARITY (day by default, or "exclude").
+# set LLM_CACHE=0 to always call the model.
+@cache
+def get_response_cache():
+    load_dotenv()
+    if os.getenv("LLM_CACHE", "1") == "0":
+        return None
+    return ResponseCache(
+        time_granularity=os.getenv("LLM_CACHE_TIME_GRANULARITY", "day")
+    )
 
 
 # RECALL:
@@ -41,19 +73,30 @@ parser_pydantic = PydanticToolsParser(
 # main prompt of Actor (agent)
 # this prompt template is also used by "Reviser" agent/node,
 # which takes all the information to rewrite the article.
+# the layout keeps the prompt prefix stable for the provider's prompt cache
+# (OpenAI reuses the longest previously seen prefix, 1024+ tokens, and bills it
+# at a discount): the bound tool schema, the fixed instructions and the
+# append-only message history come first, the volatile {time} comes last.
+# with the time at the top, no two calls ever shared more than a few tokens;
+# now every revision of a question re-reads the previous one's prompt from the
+# cache (until compaction.py shrinks old messages). routing.py reports the
+# cached tokens per stage
 actor_prompt_template = ChatPromptTemplate.from_messages(
     [
         (
             "system",
             """You are an expert researcher.
-Current time: {time}
 
 1. {first_instruction}
 2. Reflect and critique your answer. Be severe to maximize improvement.
 3. Recommend search queries to search information and improve your answer.""",
         ),
         MessagesPlaceholder(variable_name="messages"),  # placeholder for human_message
-        ("system", "Answer the user's question above using the required format."),
+        (
+            "system",
+            """Answer the user's question above using the required format.
+Current time: {time}""",
+        ),
     ]
 ).partial(  # populate some already known placeholders, in this case: {time}
     time=lambda: datetime.datetime.now().isoformat(),  # date with ISO format
@@ -62,7 +105,7 @@ Current time: {time}
 # prompt = [
 #     ("system", "you are an..."),
 #     ("messages", "history chat"),
-#     ("system", "Answer the user's question..."),
+#     ("system", "Answer the user's question... Current time: ..."),
 # ]
 
 
@@ -72,15 +115,42 @@ first_responder_prompt_template = actor_prompt_template.partial(
 )
 
 
+# every model call goes through the process-wide OpenAI scheduler
+# (rate_limit.py): requests/tokens per minute, adaptive concurrency, backoff.
+# the token cost is estimated from the rendered prompt plus a completion
+# allowance, and corrected from the real usage once the call returns
+COMPLETION_TOKEN_ESTIMATE = 1_000
+
+
+def estimate_tokens(prompt_value) -> int:
+    return count_messages_tokens(prompt_value.to_messages()) + COMPLETION_TOKEN_ESTIMATE
+
+
+def _schedule(bound_llm, scheduler=None, kind: str = ""):
+    return scheduled(
+        bound_llm, scheduler or get_scheduler("openai"), cost=estimate_tokens, kind=kind
+    )
+
+
+# the draft and reviser calls go through a routing.ModelRouter, which picks the
+# model of the stage (draft / revision / final revision) and escalates answers
+# that fail validation. an explicit llm (e.g. a stub) answers every stage
+def _routed(schema, llm=None, scheduler=None, router=None):
+    if router is None:
+        router = ModelRouter(llm_factory=lambda route: llm) if llm else get_router()
+    return router.runnable(schema, scheduler or get_scheduler("openai"), estimate_tokens)
+
+
 # create "first_responder" chain
 # bind LLM with AnswerQuestion object as a tool for tool calling
 # tool_choice="AnswerQuestion" forces LLM to always use AnswerQuestion tool,
 # thus grounding the response to the object that we want to receive
 # also pipe first_responder_prompt_template into LLM
-first_responder = first_responder_prompt_template | llm.bind_tools(
-    tools=[AnswerQuestion],
-    tool_choice={"type": "function", "function": {"name": "AnswerQuestion"}},
-)
+# queries_first=True binds the schema with search_queries first, for
+# speculative search (see schemas.py)
+def build_first_responder(llm=None, scheduler=None, router=None, queries_first=False):
+    schema = SpeculativeAnswerQuestion if queries_first else AnswerQuestion
+    return first_responder_prompt_template | _routed(schema, llm, scheduler, router)
 
 
 # main prompt for Reviser Agent
@@ -95,16 +165,95 @@ revise_instructions = """Revise your previous answer using the new information.
 """
 
 
+# the reviser sees the whole message history (every draft + every raw search
+# payload), so it is compacted to a token budget before the prompt is rendered:
+# the latest answer/reflection and its search results stay verbatim,
+# older drafts and tool outputs get shrunk. compactor.reports holds the savings.
+COMPACTION_TOKEN_BUDGET = 6_000
+compactor = MessageCompactor(token_budget=COMPACTION_TOKEN_BUDGET)
+
+
 # populate field {first_instruction} and create reviser chain
-reviser = actor_prompt_template.partial(
-    first_instruction=revise_instructions
-) | llm.bind_tools(
-    tools=[ReviseAnswer],
-    tool_choice={"type": "function", "function": {"name": "ReviseAnswer"}},
-)
+# note: both chains are plain LCEL runnables, so besides invoke() they also
+# come with ainvoke()/abatch() for free, which the async graph path relies on
+def build_reviser(llm=None, scheduler=None, router=None, queries_first=False):
+    schema = SpeculativeReviseAnswer if queries_first else ReviseAnswer
+    return (
+        RunnableLambda(compactor.compact, name="compact_messages")
+        | actor_prompt_template.partial(first_instruction=revise_instructions)
+        | _routed(schema, llm, scheduler, router)
+    )
+
+
+# prompt of the planner in the sectioned research mode (sections.py):
+# one cheap call that splits a broad question into independent sections,
+# which then run through the draft -> search -> revise loop in parallel
+planner_prompt_template = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert research editor.
+
+Split the user's question into at most {max_sections} sections for a long-form answer.
+Each section must be researchable on its own and must not overlap with the others.""",
+        ),
+        MessagesPlaceholder(variable_name="messages"),
+        # the volatile time last, like in actor_prompt_template
+        ("system", "Plan the sections using the required format.\nCurrent time: {time}"),
+    ]
+).partial(time=lambda: datetime.datetime.now().isoformat())
+
+
+def build_planner(llm=None, scheduler=None):
+    llm = llm or get_llm()
+    return planner_prompt_template | _schedule(
+        llm.bind_tools(
+            tools=[SectionPlan],
+            tool_choice={"type": "function", "function": {"name": "SectionPlan"}},
+        ),
+        scheduler,
+        kind="SectionPlan",
+    )
+
+
+@cache
+def get_first_responder():
+    return build_first_responder()
+
+
+@cache
+def get_reviser():
+    return build_reviser()
+
+
+_LAZY_ATTRIBUTES = {
+    "llm": get_llm,
+    "first_responder": get_first_responder,
+    "reviser": get_reviser,
+}
+
+
+def __getattr__(name):
+    # PEP 562: build the client / chains the first time someone asks for them
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
+    from langchain_core.messages import HumanMessage
+    from langchain_core.output_parsers.openai_tools import (
+        JsonOutputToolsParser,
+        PydanticToolsParser,
+    )
+
+    # create 2 output parsers
+    parser = JsonOutputToolsParser(
+        return_id=True
+    )  # return function call from LLM and transform into a dict
+    parser_pydantic = PydanticToolsParser(
+        tools=[AnswerQuestion]
+    )  # take response from LLM, then transform it into AnswerQuestion object
 
     # create a chain
     human_message = HumanMessage(
@@ -113,7 +262,7 @@ if __name__ == "__main__":
     )
     chain = (
         first_responder_prompt_template
-        | llm.bind_tools(
+        | get_llm().bind_tools(
             tools=[AnswerQuestion],
             tool_choice={"type": "function", "function": {"name": "AnswerQuestion"}},
         )
@@ -0,0 +1,365 @@
+# this file holds the compact-state version of the Reflexion graph
+# main.build_graph is a MessageGraph: its state is the list of every draft,
+# every revision and every ToolMessage of the run, so each iteration makes the
+# state, every checkpoint and the stopping scan bigger. here the graph is a
+# StateGraph over a small typed state (CompactState) that only holds what the
+# next step needs:
+# 1. the question, the current answer and references, the latest reflection
+#    (plus the previous answer / critique, for the stopping policies)
+# 2. the pending search queries, and the normalized ones already searched
+# 3. the evidence: search passages deduplicated by normalized URL and content,
+#    capped at EVIDENCE_TOKEN_BUDGET (the oldest rounds are dropped first)
+# 4. counters: search rounds, tokens, the start time
+# the prompts still get messages: prompt_view() derives the question / last
+# answer / evidence messages from the state when a node needs them, they are
+# never stored. the state (and a checkpoint of it) stays about the same size
+# however many iterations run.
+#
+# usage: python main.py --compact "Write about Group Cohomology"
+
+import json
+import time
+import uuid
+from functools import cache
+from typing import Any, Dict, List, Optional, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.constants import END
+
+from compaction import count_tokens
+from dedup import content_hash, normalize_url
+from search_cache import normalize_query
+from stopping import IterationState
+
+EVIDENCE_TOKEN_BUDGET = 3_000
+EVIDENCE_TOOL_CALL_ID = "evidence"
+
+
+class CompactState(TypedDict, total=False):
+    run_id: str  # the id of the prompt's question message, keys speculation / dedup
+    question: str
+    answer: str
+    previous_answer: str
+    reflection: Dict[str, str]  # {"missing", "superfluous"} of the latest answer
+    previous_missing: str
+    references: List[str]
+    queries: List[str]  # asked for by the latest answer, searched next
+    queries_new: bool  # did the latest answer ask for any query not searched yet?
+    searched: List[str]  # normalized queries already searched
+    evidence: List[dict]  # {"url", "title", "content", "query", "round"}
+    iterations: int  # search rounds so far
+    total_tokens: int
+    started_at: float  # time.time() of the first step
+    stop_reason: str  # set once the run is over (or answered from the answer cache)
+
+
+def _evidence_payloads(evidence: List[dict]) -> List[dict]:
+    # Tavily-shaped ({"query", "results"}), so the reviser reads it like a
+    # ToolMessage of the MessageGraph and cites by URL
+    payloads: Dict[str, dict] = {}
+    for item in evidence:
+        payload = payloads.setdefault(item["query"], {"query": item["query"], "results": []})
+        payload["results"].append(
+            {"url": item["url"], "title": item.get("title", ""), "content": item["content"]}
+        )
+    return list(payloads.values())
+
+
+def prompt_view(state: CompactState) -> List[BaseMessage]:
+    """The messages the draft / reviser prompt gets, derived from the state."""
+    question = HumanMessage(state["question"], id=state["run_id"])
+    if not state.get("answer"):
+        return [question]
+    args: Dict[str, Any] = {
+        "search_queries": state.get("queries", []),
+        "answer": state["answer"],
+        "reflection": state.get("reflection", {}),
+    }
+    name = "AnswerQuestion"
+    if state.get("iterations", 0) > 1:
+        name = "ReviseAnswer"
+        args["reference"] = state.get("references", [])
+    return [
+        question,
+        AIMessage(
+            content="", tool_calls=[{"name": name, "args": args, "id": EVIDENCE_TOOL_CALL_ID}]
+        ),
+        ToolMessage(
+            content=json.dumps(_evidence_payloads(state.get("evidence", []))),
+            tool_call_id=EVIDENCE_TOOL_CALL_ID,
+        ),
+    ]
+
+
+def merge_evidence(
+    evidence: List[dict], results: List[Any], round_number: int, token_budget: int
+) -> List[dict]:
+    """Add the extracted results of a search round, deduplicated and under token_budget.
+
+    A page that comes back replaces its older passage (the new one was picked
+    for the current critique); content seen under another URL is skipped.
+    """
+    fresh: List[dict] = []
+    urls, hashes = set(), set()
+    for payload in results:
+        if not (isinstance(payload, dict) and isinstance(payload.get("results"), list)):
+            continue  # errors / timeouts carry no evidence
+        for item in payload["results"]:
+            content = str(item.get("content") or "")
+            url, digest = normalize_url(str(item.get("url") or "")), content_hash(content)
+            if not content or url in urls or digest in hashes:
+                continue
+            urls.add(url)
+            hashes.add(digest)
+            fresh.append(
+                {
+                    "url": item.get("url"),
+                    "title": item.get("title", ""),
+                    "content": content,
+                    "query": payload.get("query", ""),
+                    "round": round_number,
+                }
+            )
+    kept = [
+        item
+        for item in evidence
+        if normalize_url(str(item["url"] or "")) not in urls
+        and content_hash(item["content"]) not in hashes
+    ] + fresh
+    tokens = sum(count_tokens(item["content"]) for item in kept)
+    # oldest rounds go first, the round just searched always stays
+    while tokens > token_budget and kept and kept[0]["round"] < round_number:
+        tokens -= count_tokens(kept.pop(0)["content"])
+    return kept
+
+
+def iteration_state(state: CompactState) -> IterationState:
+    """The state in the shape of stopping.IterationState, for the stopping policies."""
+    answers = [a for a in (state.get("previous_answer"), state.get("answer")) if a is not None]
+    missing = [m for m in (state.get("previous_missing"),) if m is not None]
+    missing.append(str((state.get("reflection") or {}).get("missing", "")))
+    elapsed = time.time() - state.get("started_at", time.time())
+    return IterationState(
+        started_at=time.monotonic() - elapsed,
+        iterations=state.get("iterations", 0),
+        answers=answers,
+        missing=missing,
+        last_queries=[normalize_query(q) for q in state.get("queries", [])],
+        last_queries_new=state.get("queries_new", True),
+        seen_queries=set(state.get("searched", [])),
+        total_tokens=state.get("total_tokens", 0),
+    )
+
+
+def _answer_update(state: CompactState, message: AIMessage) -> CompactState:
+    """The state update of a draft / revision: the new answer replaces the old one."""
+    args = message.tool_calls[0]["args"] if message.tool_calls else {}
+    queries = list(args.get("search_queries") or [])
+    searched = set(state.get("searched", []))
+    reflection = args.get("reflection") or {}
+    usage = message.usage_metadata or {}
+    update: CompactState = {
+        "answer": str(args.get("answer", "")),
+        "reflection": reflection if isinstance(reflection, dict) else {},
+        "queries": queries,
+        "queries_new": any(normalize_query(q) not in searched for q in queries),
+        "total_tokens": state.get("total_tokens", 0) + usage.get("total_tokens", 0),
+    }
+    if state.get("answer"):
+        update["previous_answer"] = state["answer"]
+        update["previous_missing"] = str((state.get("reflection") or {}).get("missing", ""))
+    if "reference" in args:
+        update["references"] = list(args.get("reference") or [])
+    return update
+
+
+# takes the same keyword arguments as main.build_graph (llm, search_tool,
+# stopping_policy, search_cache, checkpointer, schedulers, search_index,
+# answer_cache, speculator, router). the input is {"question": ...}, the
+# output the final CompactState (as_messages() turns it into the MessageGraph
+# shape). evidence_token_budget caps the evidence kept in the state.
+def build_compact_graph(
+    llm=None,
+    search_tool=None,
+    stopping_policy=None,
+    search_cache=None,
+    checkpointer=None,
+    llm_scheduler=None,
+    search_scheduler=None,
+    search_index=None,
+    answer_cache=None,
+    speculator=None,
+    router=None,
+    extractor=None,
+    evidence_token_budget: int = EVIDENCE_TOKEN_BUDGET,
+):
+    from langgraph.graph import StateGraph  # heavy import, keep it off the startup path
+
+    from answer_cache import BYPASS_KEY, get_answer_cache
+    from chains import build_first_responder, build_reviser
+    from main import MAX_ITERATIONS, default_stopping_policy
+    from routing import STAGE_KEY, ModelRouter, get_router
+    from speculation import default_speculator, speculative
+    from tool_executor import _missing, build_search_step, passage_extractor
+
+    if answer_cache is None:
+        answer_cache = get_answer_cache()
+    if speculator is None:
+        speculator = default_speculator()
+    if router is None:
+        router = (
+            ModelRouter(llm_factory=lambda route: llm, max_iterations=MAX_ITERATIONS)
+            if llm
+            else get_router(MAX_ITERATIONS)
+        )
+    policy = stopping_policy or default_stopping_policy()
+    extractor = extractor or passage_extractor
+    draft_chain = build_first_responder(llm, llm_scheduler, router, queries_first=bool(speculator))
+    # the revision after which the loop ends anyway isn't speculated on, and
+    # keeps the default field order
+    final_reviser_chain = reviser_chain = build_reviser(llm, llm_scheduler, router)
+    if speculator:
+        draft_chain = speculative(draft_chain, speculator)
+        reviser_chain = speculative(
+            build_reviser(llm, llm_scheduler, router, queries_first=True), speculator
+        )
+    run_search, arun_search = build_search_step(
+        search_tool,
+        search_cache,
+        search_scheduler,
+        search_index,
+        speculator=speculator or None,
+    )
+
+    def started(state: CompactState) -> CompactState:
+        update: CompactState = {}
+        if not state.get("run_id"):
+            update["run_id"] = str(uuid.uuid4())
+        if not state.get("started_at"):
+            update["started_at"] = time.time()
+        return update
+
+    def cached(state: CompactState, config: RunnableConfig) -> Optional[CompactState]:
+        if not answer_cache:
+            return None
+        if (config.get("configurable") or {}).get(BYPASS_KEY):
+            answer_cache.bypassed += 1
+            return None
+        hit = answer_cache.lookup(state["question"])
+        if hit is None:
+            return None
+        return {
+            "answer": str(hit["answer"].get("answer", "")),
+            "reflection": hit["answer"].get("reflection") or {},
+            "references": list(hit["answer"].get("reference") or []),
+            "stop_reason": "answer cache",
+        }
+
+    def stopped(state: CompactState, update: CompactState) -> CompactState:
+        # the stopping policy looks at the state after this revision
+        reason = policy.should_stop(iteration_state({**state, **update}))
+        if reason:
+            update["stop_reason"] = reason
+            if answer_cache:
+                answer_cache.remember(as_messages({**state, **update}))
+        return update
+
+    def revision_config(state: CompactState, config: RunnableConfig) -> RunnableConfig:
+        # the view has one ToolMessage, so routing can't count the rounds itself
+        final = state.get("iterations", 0) > router.max_iterations
+        stage = "final_revision" if final else "revision"
+        return {**config, "configurable": {**(config.get("configurable") or {}), STAGE_KEY: stage}}
+
+    def draft(state: CompactState, config: RunnableConfig) -> CompactState:
+        update = started(state)
+        state = {**state, **update}
+        hit = cached(state, config)
+        if hit is not None:
+            return {**update, **hit}
+        message = draft_chain.invoke(prompt_view(state), config)
+        return {**update, **_answer_update(state, message)}
+
+    async def adraft(state: CompactState, config: RunnableConfig) -> CompactState:
+        update = started(state)
+        state = {**state, **update}
+        hit = cached(state, config)
+        if hit is not None:
+            return {**update, **hit}
+        message = await draft_chain.ainvoke(prompt_view(state), config)
+        return {**update, **_answer_update(state, message)}
+
+    def revision_chain(state: CompactState):
+        # iterations, time and tokens only grow: if the policy already stops
+        # on them, it will stop after this revision too
+        return final_reviser_chain if policy.should_stop(iteration_state(state)) else reviser_chain
+
+    def revise(state: CompactState, config: RunnableConfig) -> CompactState:
+        chain = revision_chain(state)
+        message = chain.invoke(prompt_view(state), revision_config(state, config))
+        return stopped(state, _answer_update(state, message))
+
+    async def arevise(state: CompactState, config: RunnableConfig) -> CompactState:
+        chain = revision_chain(state)
+        message = await chain.ainvoke(prompt_view(state), revision_config(state, config))
+        return stopped(state, _answer_update(state, message))
+
+    def search_update(state: CompactState, results: List[Any]) -> CompactState:
+        queries = state.get("queries", [])
+        extracted = extractor.extract(results, queries, _missing(state.get("reflection")))
+        round_number = state.get("iterations", 0) + 1
+        searched = list(state.get("searched", []))
+        searched += [q for q in map(normalize_query, queries) if q not in searched]
+        return {
+            "evidence": merge_evidence(
+                state.get("evidence", []), extracted, round_number, evidence_token_budget
+            ),
+            "searched": searched,
+            "iterations": round_number,
+        }
+
+    def execute_tools(state: CompactState) -> CompactState:
+        # the question message carries the run id, like the MessageGraph state
+        messages = prompt_view(state)[:1]
+        return search_update(state, run_search(state.get("queries", []), messages))
+
+    async def aexecute_tools(state: CompactState) -> CompactState:
+        messages = prompt_view(state)[:1]
+        return search_update(state, await arun_search(state.get("queries", []), messages))
+
+    def next_step(state: CompactState) -> str:
+        return END if state.get("stop_reason") else "execute_tools"
+
+    builder = StateGraph(CompactState)
+    builder.add_node("draft", RunnableLambda(draft, afunc=adraft, name="draft"))
+    builder.add_node(
+        "execute_tools",
+        RunnableLambda(execute_tools, afunc=aexecute_tools, name="execute_tools"),
+    )
+    builder.add_node("reviser", RunnableLambda(revise, afunc=arevise, name="reviser"))
+    builder.add_edge("execute_tools", "reviser")
+    for node in ("draft", "reviser"):
+        builder.add_conditional_edges(
+            node, next_step, {END: END, "execute_tools": "execute_tools"}
+        )
+    builder.set_entry_point("draft")
+    return builder.compile(checkpointer=checkpointer)
+
+
+def as_messages(state: CompactState) -> List[BaseMessage]:
+    """The final state as [question, ReviseAnswer tool call], like a MessageGraph result."""
+    args = {
+        "answer": state.get("answer", ""),
+        "reflection": state.get("reflection", {}),
+        "search_queries": state.get("queries", []),
+        "reference": state.get("references", []),
+    }
+    return [
+        HumanMessage(state.get("question", ""), id=state.get("run_id")),
+        AIMessage(content="", tool_calls=[{"name": "ReviseAnswer", "args": args, "id": "compact"}]),
+    ]
+
+
+@cache
+def get_compact_graph():
+    return build_compact_graph()
@@ -0,0 +1,178 @@
+# this file holds the compaction stage that runs in front of the reviser prompt
+# the MessageGraph state keeps every draft and every raw Tavily payload, and
+# the MessagesPlaceholder would send all of it back to the model on each pass.
+# the compactor keeps what the reviser actually needs verbatim:
+# 1. the user's question
+# 2. the latest answer + reflection (the last AIMessage with a tool call)
+# 3. the search results that answer was asking for (the ToolMessages after it)
+# and shrinks everything older, oldest first, until the prompt fits the budget.
+
+import json
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, List, Sequence
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 6_000
+MAX_REPORTS = 1_000  # CompactionReports kept in memory
+OLD_ANSWER_CHARS = 600  # how much of an older draft we keep
+OLD_RESULT_CHARS = 200  # how much of each older search result we keep
+
+
+def count_tokens(text: str) -> int:
+    """Cheap token estimate (~4 chars per token for English), no tokenizer download."""
+    return (len(text) + 3) // 4
+
+
+def count_message_tokens(message: BaseMessage) -> int:
+    content = message.content
+    if not isinstance(content, str):
+        content = json.dumps(content, default=str)
+    tokens = count_tokens(content)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(json.dumps(tool_call["args"], default=str))
+    return tokens
+
+
+def count_messages_tokens(messages: Sequence[BaseMessage]) -> int:
+    return sum(count_message_tokens(message) for message in messages)
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit].rstrip() + " …"
+
+
+def shrink_draft(message: AIMessage) -> AIMessage:
+    """Keep only a truncated answer of an older draft."""
+    # the tool calls must stay in place (with the same ids), otherwise the
+    # ToolMessages that follow would reference a call that no longer exists
+    tool_calls = [
+        {
+            **tool_call,
+            "args": {
+                "answer": _truncate(
+                    str(tool_call["args"].get("answer", "")), OLD_ANSWER_CHARS
+                )
+            },
+        }
+        for tool_call in message.tool_calls
+    ]
+    return message.model_copy(update={"tool_calls": tool_calls})
+
+
+def _shrink_result(result: Any) -> Any:
+    # a Tavily payload is {"query": ..., "results": [{"url", "title", "content", ...}]}
+    if isinstance(result, dict) and isinstance(result.get("results"), list):
+        return {
+            "query": result.get("query"),
+            "results": [
+                {
+                    "url": item.get("url"),
+                    "content": _truncate(str(item.get("content", "")), OLD_RESULT_CHARS),
+                }
+                for item in result["results"]
+                if isinstance(item, dict)
+            ],
+        }
+    return result
+
+
+def shrink_tool_output(message: ToolMessage) -> ToolMessage:
+    """Keep only the URL and a short snippet of each older search result."""
+    content = message.content
+    try:
+        payload = json.loads(content) if isinstance(content, str) else content
+    except json.JSONDecodeError:
+        return message.model_copy(
+            update={"content": _truncate(content, OLD_RESULT_CHARS)}
+        )
+    if isinstance(payload, list):
+        payload = [_shrink_result(result) for result in payload]
+    else:
+        payload = _shrink_result(payload)
+    return message.model_copy(update={"content": json.dumps(payload)})
+
+
+@dataclass
+class CompactionReport:
+    tokens_before: int
+    tokens_after: int
+    messages_compacted: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+class MessageCompactor:
+    """Shrink older drafts and tool outputs until the history fits token_budget."""
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, max_reports: int = MAX_REPORTS):
+        self.token_budget = token_budget
+        # the latest passes only: the compactor lives as long as the process
+        # (server.py, workers.py), stats() has the totals since start
+        self.reports: Deque[CompactionReport] = deque(maxlen=max_reports)
+        self._totals = {"passes": 0, "messages_compacted": 0, "tokens_saved": 0}
+        self._lock = threading.Lock()
+
+    def compact(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        messages = list(messages)
+        tokens_before = count_messages_tokens(messages)
+        compacted = 0
+
+        if tokens_before > self.token_budget:
+            # everything from the latest answer onwards is kept verbatim
+            latest = max(
+                (
+                    i
+                    for i, message in enumerate(messages)
+                    if isinstance(message, AIMessage) and message.tool_calls
+                ),
+                default=len(messages),
+            )
+            tokens = tokens_before
+            # oldest first: older context is the least useful to the reviser
+            for i in range(1, latest):
+                if tokens <= self.token_budget:
+                    break
+                message = messages[i]
+                if isinstance(message, ToolMessage):
+                    shrunk = shrink_tool_output(message)
+                elif isinstance(message, AIMessage) and message.tool_calls:
+                    shrunk = shrink_draft(message)
+                else:
+                    continue
+                tokens -= count_message_tokens(message) - count_message_tokens(shrunk)
+                messages[i] = shrunk
+                compacted += 1
+
+        report = CompactionReport(
+            tokens_before=tokens_before,
+            tokens_after=count_messages_tokens(messages),
+            messages_compacted=compacted,
+        )
+        with self._lock:
+            self.reports.append(report)
+            self._totals["passes"] += 1
+            self._totals["messages_compacted"] += report.messages_compacted
+            self._totals["tokens_saved"] += report.tokens_saved
+        logger.info(
+            "compacted %d messages: %d -> %d tokens (saved %d)",
+            report.messages_compacted,
+            report.tokens_before,
+            report.tokens_after,
+            report.tokens_saved,
+        )
+        return messages
+
+    def __call__(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        return self.compact(messages)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._totals)
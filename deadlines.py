@@ -0,0 +1,193 @@
+# this file holds the per-query deadlines of the search executor
+# the queries of one step used to go out as a single batch, so the slowest one
+# held up execute_tools and, with it, the reviser. here every query runs on its
+# own clock:
+# 1. a query still running after `hedge_after` seconds gets a duplicate
+#    (hedged) request, whichever answers first wins
+# 2. a query still running after `timeout` seconds is given up on: the step
+#    goes on with partial results, and the query's payload is marked
+#    {"query", "error": "timed out ...", "timed_out": true} in the ToolMessage
+# requests that finish after their deadline are handed to `on_late`, so
+# the result can still warm the cache for the next iteration. a query whose
+# every attempt failed gets {"query", "error": "search failed: ..."}, so
+# the other queries of the step still get through.
+# the clock starts before rate limiting (rate_limit.py), so time spent
+# waiting for budget counts towards the deadline too.
+
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from functools import cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+
+@dataclass
+class Deadlines:
+    timeout: Optional[float] = 10.0  # seconds per query, None = wait forever
+    hedge_after: Optional[float] = None  # seconds, None = never send a hedge
+
+
+@cache
+def get_search_deadlines() -> Deadlines:
+    # a hedge is a second paid request, so it's off unless SEARCH_HEDGE_AFTER is set
+    load_dotenv()
+    timeout = float(os.getenv("SEARCH_TIMEOUT", "10")) or None
+    hedge_after = float(os.getenv("SEARCH_HEDGE_AFTER", "0")) or None
+    return Deadlines(timeout=timeout, hedge_after=hedge_after)
+
+
+def timed_out(query: str, timeout: float) -> dict:
+    return {"query": query, "error": f"timed out after {timeout:g}s", "timed_out": True}
+
+
+def search_failed(query: str, error: BaseException) -> dict:
+    return {"query": query, "error": f"search failed: {error!r}"}
+
+
+def _submit(executor: ThreadPoolExecutor, call: Callable, item: Any) -> Future:
+    # copy the context, so callbacks (tracing) and the graph config follow the call
+    return executor.submit(contextvars.copy_context().run, call, item)
+
+
+def run_with_deadlines(
+    call: Callable[[Any], Any],
+    items: List[Any],
+    queries: List[str],
+    deadlines: Deadlines,
+    on_late: Optional[Callable[[int, Any], None]] = None,
+) -> List[Any]:
+    # a pool per call, one thread per attempt: an attempt we stop waiting for
+    # keeps its thread until the search returns, and must not hold up the
+    # hedges or the queries of the next steps behind it
+    attempts_per_query = 1 if deadlines.hedge_after is None else 2
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, len(items) * attempts_per_query), thread_name_prefix="search"
+    )
+    try:
+        return _run_with_deadlines(executor, call, items, queries, deadlines, on_late)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def _run_with_deadlines(executor, call, items, queries, deadlines, on_late) -> List[Any]:
+    start = time.monotonic()
+    attempts: Dict[int, List[Future]] = {
+        i: [_submit(executor, call, item)] for i, item in enumerate(items)
+    }
+    results: List[Any] = [None] * len(items)
+    pending = set(attempts)
+    hedged = deadlines.hedge_after is None
+
+    while pending:
+        now = time.monotonic() - start
+        events = [t for t in (deadlines.timeout, None if hedged else deadlines.hedge_after) if t]
+        running = [f for i in pending for f in attempts[i] if not f.done()]
+        if running:
+            wait(
+                running,
+                timeout=max(0.0, min(events) - now) if events else None,
+                return_when=FIRST_COMPLETED,
+            )
+        for i in list(pending):
+            finished = [f for f in attempts[i] if f.done()]
+            succeeded = [f for f in finished if not f.cancelled() and f.exception() is None]
+            if succeeded:
+                results[i] = succeeded[0].result()
+                pending.discard(i)
+                for future in attempts[i]:
+                    future.cancel()  # only stops a hedge that hasn't started yet
+            elif len(finished) == len(attempts[i]):
+                # every attempt failed (after retries): only this query is lost
+                results[i] = search_failed(queries[i], finished[0].exception())
+                pending.discard(i)
+        now = time.monotonic() - start
+        if not hedged and now >= deadlines.hedge_after:
+            for i in pending:
+                attempts[i].append(_submit(executor, call, items[i]))
+            hedged = True
+        if deadlines.timeout and now >= deadlines.timeout:
+            break
+
+    for i in pending:
+        results[i] = timed_out(queries[i], deadlines.timeout)
+        if on_late is not None:
+            for future in attempts[i]:
+                future.add_done_callback(_late_callback(on_late, i))
+    return results
+
+
+def _late_callback(on_late, index):
+    def callback(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            on_late(index, future.result())
+
+    return callback
+
+
+async def arun_with_deadlines(
+    call: Callable[[Any], Awaitable[Any]],
+    items: List[Any],
+    queries: List[str],
+    deadlines: Deadlines,
+    on_late: Optional[Callable[[int, Any], None]] = None,
+) -> List[Any]:
+    start = time.monotonic()
+    attempts: Dict[int, List[asyncio.Task]] = {
+        i: [asyncio.ensure_future(call(item))] for i, item in enumerate(items)
+    }
+    results: List[Any] = [None] * len(items)
+    pending = set(attempts)
+    hedged = deadlines.hedge_after is None
+    losers: List[asyncio.Task] = []
+
+    while pending:
+        now = time.monotonic() - start
+        events = [t for t in (deadlines.timeout, None if hedged else deadlines.hedge_after) if t]
+        running = [t for i in pending for t in attempts[i] if not t.done()]
+        if running:
+            await asyncio.wait(
+                running,
+                timeout=max(0.0, min(events) - now) if events else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        for i in list(pending):
+            finished = [t for t in attempts[i] if t.done()]
+            succeeded = [t for t in finished if not t.cancelled() and t.exception() is None]
+            if succeeded:
+                results[i] = succeeded[0].result()
+                pending.discard(i)
+                for task in attempts[i]:
+                    if not task.done():
+                        task.cancel()  # the losing hedge, nobody needs its answer
+                        losers.append(task)
+            elif len(finished) == len(attempts[i]):
+                # every attempt failed (after retries): only this query is lost
+                error = next(
+                    (t.exception() for t in finished if not t.cancelled()),
+                    asyncio.CancelledError(),
+                )
+                results[i] = search_failed(queries[i], error)
+                pending.discard(i)
+        now = time.monotonic() - start
+        if not hedged and now >= deadlines.hedge_after:
+            for i in pending:
+                attempts[i].append(asyncio.ensure_future(call(items[i])))
+            hedged = True
+        if deadlines.timeout and now >= deadlines.timeout:
+            break
+
+    # let the cancelled hedges unwind before returning, so the scheduler slots
+    # they hold are released now and not whenever the loop gets to them
+    await asyncio.gather(*losers, return_exceptions=True)
+    for i in pending:
+        results[i] = timed_out(queries[i], deadlines.timeout)
+        for task in attempts[i]:
+            # keep it running in the background, a late answer still fills the cache
+            if on_late is not None:
+                task.add_done_callback(_late_callback(on_late, i))
+    return results
@@ -0,0 +1,286 @@
+# this file holds the per-run registry that deduplicates search results
+# the 1-3 search queries of a step often return the same pages, and every
+# ReviseAnswer iteration fetches many of them again; each copy used to end up
+# in the message state (and in the reviser prompt) as part of a new ToolMessage.
+# the registry remembers, per graph run, every document it already let through:
+# 1. by normalized URL (scheme, "www.", trailing "/", fragments and utm_* ignored)
+# 2. by exact content hash (normalized whitespace / case)
+# 3. by near-duplicate content: MinHash over word shingles, estimated
+#    Jaccard similarity >= NEAR_DUPLICATE_THRESHOLD
+# a document seen before is replaced by a compact reference to the ToolMessage
+# (tool_call_id + query) that first carried it. a URL seen before is the
+# exception: passage extraction only let through the passages that matched the
+# earlier query, so the page is collapsed only when those already cover the
+# best passages for the new query; otherwise it goes through again and the
+# extraction picks the passages for this query. duplicates are taken out before
+# passage extraction (so they don't use up its budget), and only documents that
+# made it into a ToolMessage are remembered. every run counts the bytes and
+# estimated tokens saved.
+
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+from compaction import count_tokens
+from passages import SEPARATOR, top_passages
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_WORDS = 3
+NUM_PERMUTATIONS = 64
+# search snippets are short: a couple of edited words already drop the 3-word
+# shingle Jaccard to ~0.6, while unrelated snippets share next to nothing
+NEAR_DUPLICATE_THRESHOLD = 0.5
+# a seen URL is only collapsed when its emitted passages contain the new
+# query's best COVERED_PASSAGES passages of the page
+COVERED_PASSAGES = 2
+_MERSENNE_PRIME = (1 << 61) - 1
+# fixed (a, b) pairs, so signatures are comparable across processes and resumes
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.sha256(f"a{i}".encode()).digest()[:8], "big") % _MERSENNE_PRIME | 1,
+        int.from_bytes(hashlib.sha256(f"b{i}".encode()).digest()[:8], "big") % _MERSENNE_PRIME,
+    )
+    for i in range(NUM_PERMUTATIONS)
+]
+_WORD = re.compile(r"\w+")
+
+
+def normalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    host = parts.netloc.casefold().removeprefix("www.")
+    query = urlencode(
+        [(k, v) for k, v in parse_qsl(parts.query) if not k.startswith("utm_")]
+    )
+    return f"{host}{parts.path.rstrip('/')}" + (f"?{query}" if query else "")
+
+
+def _words(text: str) -> List[str]:
+    return _WORD.findall(text.casefold())
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(" ".join(_words(text)).encode()).hexdigest()
+
+
+def minhash(text: str) -> Optional[Tuple[int, ...]]:
+    """MinHash signature of the word shingles, None if the text is too short."""
+    words = _words(text)
+    if len(words) < SHINGLE_WORDS:
+        return None
+    shingles = {
+        int.from_bytes(
+            hashlib.blake2b(" ".join(words[i : i + SHINGLE_WORDS]).encode(), digest_size=8).digest(),
+            "big",
+        )
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+    return tuple(
+        min((a * shingle + b) % _MERSENNE_PRIME for shingle in shingles)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+@dataclass
+class RunDedup:
+    """What one graph run has already seen, and what deduplication saved it."""
+
+    urls: Dict[str, dict] = field(default_factory=dict)  # normalized url -> reference
+    emitted: Dict[str, str] = field(default_factory=dict)  # normalized url -> text sent
+    hashes: Dict[str, dict] = field(default_factory=dict)  # content hash -> reference
+    signatures: List[Tuple[Tuple[int, ...], dict]] = field(default_factory=list)
+    counters: Dict[str, int] = field(
+        default_factory=lambda: {
+            "url_duplicates": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "bytes_saved": 0,
+            "tokens_saved": 0,
+        }
+    )
+
+    def find(self, item: dict, query: Optional[str] = None) -> Tuple[Optional[str], Optional[dict]]:
+        """(kind of duplicate, reference to the first copy), or (None, None)."""
+        url = normalize_url(str(item.get("url") or ""))
+        if url and url in self.urls:
+            if self.covers(url, item, query):
+                return "url_duplicates", self.urls[url]
+            return None, None  # same page, but this query needs other passages of it
+        content = str(item.get("content") or "")
+        reference = self.hashes.get(content_hash(content))
+        if reference is not None:
+            return "exact_duplicates", reference
+        signature = minhash(content)
+        if signature is not None:
+            for seen, reference in self.signatures:
+                if similarity(signature, seen) >= NEAR_DUPLICATE_THRESHOLD:
+                    return "near_duplicates", reference
+        return None, None
+
+    def covers(self, url: str, item: dict, query: Optional[str]) -> bool:
+        """Whether the text already sent for `url` has the passages `query` would pick."""
+        emitted = self.emitted.get(url, "")
+        content = str(item.get("content") or "")
+        return all(
+            passage in emitted
+            for passage in top_passages(content, query or "", COVERED_PASSAGES)
+        )
+
+    def add(self, item: dict, reference: dict, emitted: Optional[str] = None) -> None:
+        """Remember a document; `emitted` is the part of it that was sent (default: all)."""
+        url = normalize_url(str(item.get("url") or ""))
+        content = str(item.get("content") or "")
+        if url:
+            self.urls.setdefault(url, reference)
+            sent = content if emitted is None else emitted
+            self.emitted[url] = (
+                f"{self.emitted[url]}{SEPARATOR}{sent}" if url in self.emitted else sent
+            )
+        self.hashes.setdefault(content_hash(content), reference)
+        signature = minhash(content)
+        if signature is not None:
+            self.signatures.append((signature, reference))
+
+    def split(self, results: List[Any], tool_call_id: Optional[str]):
+        """Split results into fresh documents and compact references to seen ones.
+
+        Documents that repeat within `results` (across its queries) are
+        references to this same tool call.
+        """
+        batch = RunDedup()  # the documents of earlier queries in this call
+        fresh, references = [], []
+        for payload in results:
+            if not _is_payload(payload):
+                fresh.append(payload)
+                references.append([])
+                continue
+            items, compacts = [], []
+            query = payload.get("query")
+            for item in payload["results"]:
+                kind, reference = self.find(item, query)
+                if kind is None:
+                    kind, reference = batch.find(item, query)
+                if kind is None:
+                    # nothing of it has been extracted yet: a page that comes
+                    # back for another query of this call goes through again
+                    # unless that query wouldn't pick anything from it
+                    batch.add(item, {"tool_call_id": tool_call_id, "query": query}, emitted="")
+                    items.append(item)
+                    continue
+                compact = {"url": item.get("url"), "duplicate_of": reference}
+                # measured against the raw result that would have been stored
+                saved = json.dumps(item, default=str)
+                kept = json.dumps(compact, default=str)
+                self.counters[kind] += 1
+                self.counters["bytes_saved"] += max(0, len(saved.encode()) - len(kept.encode()))
+                self.counters["tokens_saved"] += max(0, count_tokens(saved) - count_tokens(kept))
+                compacts.append(compact)
+            fresh.append({**payload, "results": items})
+            references.append(compacts)
+        return fresh, references
+
+    def merge(
+        self,
+        fresh: List[Any],
+        output: List[Any],
+        references: List[List[dict]],
+        tool_call_id: Optional[str],
+    ) -> List[Any]:
+        """Register the documents that made it into `output`, append the references."""
+        merged = []
+        for raw, payload, compacts in zip(fresh, output, references):
+            if not _is_payload(payload):
+                merged.append(payload)
+                continue
+            emitted = {item.get("url"): item.get("content") for item in payload["results"]}
+            for item in raw["results"] if _is_payload(raw) else []:
+                if item.get("url") in emitted:
+                    reference = {"tool_call_id": tool_call_id, "query": payload.get("query")}
+                    self.add(item, reference, emitted=str(emitted[item.get("url")] or ""))
+            merged.append({**payload, "results": payload["results"] + compacts})
+        return merged
+
+
+def _is_payload(result: Any) -> bool:
+    return isinstance(result, dict) and isinstance(result.get("results"), list)
+
+
+class DedupRegistry:
+    """One RunDedup per graph run, keyed like stopping.ConvergenceTracker."""
+
+    def __init__(self, max_runs: int = 1024):
+        self.max_runs = max_runs
+        self._runs: "OrderedDict[str, RunDedup]" = OrderedDict()
+        self._lock = threading.Lock()  # ToolNode runs tool calls in a thread pool
+
+    def for_run(self, messages: Sequence[BaseMessage]) -> RunDedup:
+        key = messages[0].id if messages and messages[0].id else str(id(messages))
+        with self._lock:
+            run = self._runs.get(key)
+            if run is None:
+                # a run we don't know yet (new, or resumed from a checkpoint):
+                # what it has already seen is in its earlier ToolMessages
+                run = self._runs[key] = RunDedup()
+                for message in messages:
+                    if isinstance(message, ToolMessage):
+                        _seed(run, message)
+                while len(self._runs) > self.max_runs:
+                    self._runs.popitem(last=False)
+            self._runs.move_to_end(key)
+            return run
+
+    def process(
+        self,
+        messages: Sequence[BaseMessage],
+        results: List[Any],
+        tool_call_id: Optional[str],
+        transform: Callable[[List[Any]], List[Any]] = lambda results: results,
+    ) -> List[Any]:
+        """Collapse seen documents, run `transform` (e.g. passage extraction)
+        on the fresh ones only, then remember what it kept."""
+        run = self.for_run(messages)
+        with self._lock:
+            fresh, references = run.split(results, tool_call_id)
+        output = transform(fresh)
+        with self._lock:
+            merged = run.merge(fresh, output, references, tool_call_id)
+        logger.info("search dedup for this run: %s", run.counters)
+        return merged
+
+    def stats(self, messages: Optional[Sequence[BaseMessage]] = None) -> Dict[str, int]:
+        """Counters of one run, or summed over every run still in the registry."""
+        with self._lock:
+            if messages:
+                run = self._runs.get(messages[0].id)
+                return dict(run.counters) if run else {}
+            totals: Dict[str, int] = {}
+            for run in self._runs.values():
+                for name, value in run.counters.items():
+                    totals[name] = totals.get(name, 0) + value
+            return totals
+
+
+def _seed(run: RunDedup, message: ToolMessage) -> None:
+    try:
+        results = json.loads(message.content) if isinstance(message.content, str) else []
+    except json.JSONDecodeError:
+        return
+    for payload in results if isinstance(results, list) else []:
+        if not isinstance(payload, dict):
+            continue
+        for item in payload.get("results") or []:  # references are skipped
+            if isinstance(item, dict) and "duplicate_of" not in item:
+                run.add(item, {"tool_call_id": message.tool_call_id, "query": payload.get("query")})
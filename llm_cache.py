@@ -0,0 +1,128 @@
+# this file holds the response cache for the first_responder / reviser LLM calls
+# it plugs into langchain's own cache hook (ChatOpenAI(cache=...)), which hands
+# us the rendered prompt and an "llm string" describing the model, its params
+# and the bound kwargs (tools + tool_choice). we hash both into a canonical key:
+# 1. message ids / response metadata are dropped, they differ on every run
+# 2. the {time} partial (an ISO timestamp in the system prompt) is coarsened,
+#    e.g. to the day, or excluded altogether, otherwise nothing would ever hit
+# storage is the same LRU + SQLite TieredCache the search cache uses.
+
+import hashlib
+import json
+import os
+import re
+from typing import Any, Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+
+from search_cache import DEFAULT_MAX_DISK_ENTRIES, DEFAULT_MAX_MEMORY_ENTRIES, TieredCache
+
+DEFAULT_LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".cache/llm_cache.sqlite")
+DEFAULT_LLM_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# how much of the {time} partial goes into the key
+TIME_GRANULARITIES = {
+    "exact": None,  # keep the full timestamp (practically disables hits)
+    "minute": 16,  # 2025-01-31T12:34
+    "hour": 13,  # 2025-01-31T12
+    "day": 10,  # 2025-01-31
+    "exclude": 0,  # drop it from the key
+}
+_TIMESTAMP = re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:[+-]\d{2}:\d{2})?")
+_VOLATILE_KEYS = {"id", "tool_call_id", "response_metadata", "usage_metadata", "lc_run_id"}
+
+
+def _strip_volatile(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: _strip_volatile(item)
+            for key, item in value.items()
+            if key not in _VOLATILE_KEYS
+        }
+    if isinstance(value, list):
+        return [_strip_volatile(item) for item in value]
+    return value
+
+
+class _ResponseStore(TieredCache):
+    table = "llm_cache"
+
+
+class ResponseCache(BaseCache):
+    """Prompt-keyed cache of chat generations (memory LRU + SQLite, with TTL)."""
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_LLM_CACHE_PATH,
+        ttl_seconds: float = DEFAULT_LLM_TTL_SECONDS,
+        max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+        max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES,
+        time_granularity: str = "day",
+    ):
+        if time_granularity not in TIME_GRANULARITIES:
+            raise ValueError(
+                f"time_granularity must be one of {sorted(TIME_GRANULARITIES)}"
+            )
+        self.time_granularity = time_granularity
+        self._store = _ResponseStore(
+            path,
+            ttl_seconds=ttl_seconds,
+            max_memory_entries=max_memory_entries,
+            max_disk_entries=max_disk_entries,
+        )
+
+    def _coarsen_time(self, text: str) -> str:
+        keep = TIME_GRANULARITIES[self.time_granularity]
+        if keep is None:
+            return text
+        return _TIMESTAMP.sub(lambda match: match.group(0)[:keep], text)
+
+    def make_key(self, prompt: str, llm_string: str) -> str:
+        """Canonical hash of rendered prompt + model + bound tools/tool_choice."""
+        try:
+            canonical = json.dumps(_strip_volatile(json.loads(prompt)), sort_keys=True)
+        except json.JSONDecodeError:
+            canonical = prompt
+        canonical = self._coarsen_time(canonical)
+        digest = hashlib.sha256()
+        digest.update(canonical.encode())
+        digest.update(b"\0")
+        digest.update(llm_string.encode())
+        return digest.hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        stored = self._store.lookup(self.make_key(prompt, llm_string))
+        if stored is None:
+            return None
+        return [
+            ChatGeneration(message=message, generation_info=info)
+            for message, info in zip(
+                messages_from_dict([item["message"] for item in stored]),
+                (item.get("generation_info") for item in stored),
+            )
+        ]
+
+    def update(
+        self, prompt: str, llm_string: str, return_val: Sequence[Generation]
+    ) -> None:
+        if not all(isinstance(generation, ChatGeneration) for generation in return_val):
+            return  # only chat models go through this cache
+        stored = []
+        for generation in return_val:
+            # a fresh message id is assigned on every hit, never reuse the stored one
+            message = generation.message.model_copy(update={"id": None})
+            stored.append(
+                {
+                    "message": message_to_dict(message),
+                    "generation_info": generation.generation_info,
+                }
+            )
+        self._store.store(self.make_key(prompt, llm_string), stored)
+
+    def clear(self, **kwargs: Any) -> None:
+        self._store.clear()
+
+    def stats(self) -> dict:
+        return self._store.stats()
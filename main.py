@@ -1,79 +1,385 @@
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
+import argparse
+import asyncio
+import atexit
+import sys
+from functools import cache
 from typing import List
+
+from langchain_core.messages import BaseMessage
+from langgraph.constants import END
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.panel import Panel
+from rich.table import Table
 
-from langchain_core.messages import BaseMessage, ToolMessage
-from langgraph.graph import END, MessageGraph
-
-from chains import first_responder, reviser
-from tool_executor import execute_tools
+from answer_cache import BYPASS_KEY
+from stopping import (
+    AnswerConverged,
+    AnyOf,
+    ConvergenceTracker,
+    CritiqueExhausted,
+    MaxIterations,
+    QueriesExhausted,
+    StoppingPolicy,
+)
+from streaming import render_live, stream_events, write_ndjson
+from tracing import AggregateExporter, JsonLinesExporter, Tracer
 
 # these classes are going to populate our state objects in our graph
 
 
 MAX_ITERATIONS = 3
-builder = MessageGraph()
-builder.add_node("draft", first_responder)
-builder.add_node("execute_tools", execute_tools)
-builder.add_node("reviser", reviser)
-builder.add_edge("draft", "execute_tools")
-builder.add_edge("execute_tools", "reviser")
-
-
-# at "reviser" node, this function decides which node we're going to next
-def event_loop(state: List[BaseMessage]) -> str:
-    # execute_tools isn't a vanilla function, but a tool node whose outputs are ToolMessage instances.
-    # the state list of messages you inspect will therefore contain those ToolMessage objects
-    # corresponding to each tool invocation
-    count_tool_visits = sum(isinstance(item, ToolMessage) for item in state)
-    num_iterations = count_tool_visits
-    if num_iterations > MAX_ITERATIONS:
-        return END  # go to END node
-    return "execute_tools"  # go to "execute_tools" node
-
-
-# conditional edge at the "reviser" node
-builder.add_conditional_edges(
-    "reviser", event_loop, {END: END, "execute_tools": "execute_tools"}
-)
+MAX_CONCURRENCY = 4  # how many questions may run through the graph at once
+DIAGRAM_PATH = "reflexion_agent.png"
+
+
+# the loop ends at MAX_ITERATIONS or as soon as the answer has converged
+# (see stopping.py for the signals, TimeBudget/TokenBudget can be added too)
+def default_stopping_policy() -> StoppingPolicy:
+    return AnyOf(
+        MaxIterations(MAX_ITERATIONS),
+        AnswerConverged(min_similarity=0.97),
+        CritiqueExhausted(),
+        QueriesExhausted(),
+    )
+
+
+# importing this module doesn't build anything: the graph (and the OpenAI /
+# Tavily clients behind it) are created by build_graph() / get_graph() on
+# first use. llm, search_tool, search_cache and search_index can be swapped, e.g. for the
+# local stubs in stubs.py; a checkpointer persists every step (see batch.py).
+# llm_scheduler / search_scheduler default to the process-wide rate limiters
+# of OpenAI and Tavily (rate_limit.get_scheduler). answer_cache defaults to
+# answer_cache.get_answer_cache(); pass False to build the graph without it.
+# speculator (speculation.SpeculativeSearch) starts searches while the draft /
+# reviser tool call streams, a new one per graph by default; False turns it off.
+# router (routing.ModelRouter) picks the model of each stage and escalates weak
+# answers; the default is the process-wide one (routing.get_router), or one
+# that sends every stage to `llm` when an llm is given.
+def build_graph(
+    llm=None,
+    search_tool=None,
+    stopping_policy=None,
+    search_cache=None,
+    checkpointer=None,
+    llm_scheduler=None,
+    search_scheduler=None,
+    search_index=None,
+    answer_cache=None,
+    speculator=None,
+    router=None,
+):
+    from langgraph.graph import MessageGraph  # heavy import, keep it off the startup path
+
+    from answer_cache import get_answer_cache, is_cached_answer
+    from chains import build_first_responder, build_reviser
+    from routing import ModelRouter, get_router
+    from speculation import default_speculator, speculative
+    from tool_executor import build_execute_tools
+
+    if answer_cache is None:
+        answer_cache = get_answer_cache()
+    if speculator is None:
+        speculator = default_speculator()
 
-# define the graph's entry point
-builder.set_entry_point("draft")
+    if router is None:
+        router = (
+            ModelRouter(llm_factory=lambda route: llm, max_iterations=MAX_ITERATIONS)
+            if llm
+            else get_router(MAX_ITERATIONS)
+        )
+    # at "reviser" node, this function decides which node we're going to next.
+    # instead of recounting ToolMessages over the whole state on every step, the
+    # tracker keeps per-run iteration state and only looks at the new messages
+    event_loop = ConvergenceTracker(stopping_policy or default_stopping_policy())
+
+    # with a speculator the schemas put search_queries first (schemas.py)
+    draft = build_first_responder(llm, llm_scheduler, router, queries_first=bool(speculator))
+    reviser = build_reviser(llm, llm_scheduler, router, queries_first=bool(speculator))
+    if speculator:
+        # the queries start searching while the tool call is still streaming,
+        # except in a revision after which the loop ends anyway
+        draft = speculative(draft, speculator)
+        reviser = speculative(reviser, speculator, final=event_loop.will_stop)
+
+    builder = MessageGraph()
+    builder.add_node("draft", draft)
+    builder.add_node(
+        "execute_tools",
+        build_execute_tools(
+            search_tool,
+            search_cache,
+            search_scheduler,
+            search_index,
+            speculator=speculator or None,
+        ),
+    )
+    builder.add_node("reviser", reviser)
+    builder.add_edge("draft", "execute_tools")
+    builder.add_edge("execute_tools", "reviser")
+
+    after_reviser = event_loop
+
+    # a near-duplicate of an answered question skips the loop: the entry node
+    # returns the stored ReviseAnswer, and every finished run is remembered
+    if answer_cache:
+
+        def after_reviser(state: List[BaseMessage]) -> str:
+            decision = event_loop(state)
+            if decision == END:
+                answer_cache.remember(state)
+            return decision
+
+        builder.add_node("answer_cache", answer_cache.lookup_node)
+        builder.add_conditional_edges(
+            "answer_cache",
+            lambda state: END if is_cached_answer(state) else "draft",
+            {END: END, "draft": "draft"},
+        )
+
+    # conditional edge at the "reviser" node
+    builder.add_conditional_edges(
+        "reviser", after_reviser, {END: END, "execute_tools": "execute_tools"}
+    )
+
+    # define the graph's entry point
+    builder.set_entry_point("answer_cache" if answer_cache else "draft")
+
+    # compile to get a runnable graph
+    return builder.compile(checkpointer=checkpointer)
+
+
+@cache
+def get_graph():
+    return build_graph()
 
-# compile to get a runnable graph
-graph = builder.compile()
 
 # export mermaid graph in .png
-graph.get_graph().draw_mermaid_png(output_file_path="reflexion_agent.png")
+# opt-in only (python main.py --export-diagram): draw_mermaid_png() renders
+# through a remote service, which nobody should pay for just by importing
+def export_diagram(graph=None, path: str = DIAGRAM_PATH) -> None:
+    (graph or get_graph()).get_graph().draw_mermaid_png(output_file_path=path)
+
+
+def __getattr__(name):
+    # PEP 562: `main.graph` still works, it builds the graph on first access
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 console = Console()
 
 
-if __name__ == "__main__":
-    print("Hello Reflexion Agent!")
+# nearly all of a run is spent waiting on OpenAI / Tavily, so instead of
+# invoking the graph once per question we run many of them concurrently.
+# the chains and the ToolNode all have async implementations, so ainvoke()
+# never blocks the event loop; max_concurrency bounds how many runs are in flight
+async def arun_questions(
+    questions: List[str | dict],
+    max_concurrency: int = MAX_CONCURRENCY,
+    graph=None,
+    callbacks=None,
+    fresh: bool = False,
+) -> List[List[BaseMessage] | Exception]:
+    """Run every question through the graph, at most max_concurrency at a time.
 
-    # invoke the graph
-    res = graph.invoke(
-        "Write about AI-Powered SOC / autonomous problem domain, "
-        "list startups that do that and successfully raised capital."
+    fresh=True skips the answer cache lookup (the new answers are still stored).
+    """
+    graph = graph or get_graph()
+    # return_exceptions=True: one failing question shouldn't cancel the others
+    return await graph.abatch(
+        questions,
+        config={
+            "max_concurrency": max_concurrency,
+            "callbacks": callbacks,
+            "configurable": {BYPASS_KEY: fresh},
+        },
+        return_exceptions=True,
     )
-    res = graph.invoke("Write about Group Cohomology, list recent researches about it.")
 
-    # print(res[-1].tool_calls[0]["args"]["answer"])
+
+def print_answer(question: str, res: List[BaseMessage]) -> None:
     # Pretty‑print the answer with Rich 🎨
     answer = res[-1].tool_calls[0]["args"]["answer"]
     console.print(
         Panel(
             Markdown(answer),
-            title="💡 Final Answer",
+            title=f"💡 Final Answer: {question}",
             border_style="green",
             expand=True,
         )
     )
+
+
+def print_trace_summary(aggregate: AggregateExporter) -> None:
+    table = Table(title="⏱️  Trace summary")
+    for column in ("span", "count", "p50 (s)", "p95 (s)", "p99 (s)", "tokens in/out", "cached in"):
+        table.add_column(column)
+    for name, row in aggregate.summary().items():
+        table.add_row(
+            name,
+            str(row["count"]),
+            f"{row['p50']:.3f}",
+            f"{row['p95']:.3f}",
+            f"{row['p99']:.3f}",
+            f"{row['prompt_tokens']}/{row['completion_tokens']}",
+            str(row["cached_tokens"]),
+        )
+    console.print(table)
+
+
+def print_stage_report(router) -> None:
+    table = Table(title="🧭 Model routing per stage")
+    columns = ("stage", "model", "calls", "repaired", "re-asked", "escalated")
+    for column in columns + ("p50 (s)", "p95 (s)", "tokens in/out", "cached in", "cost ($)"):
+        table.add_column(column)
+    for stage, models in router.report().items():
+        for model, row in models.items():
+            table.add_row(
+                stage,
+                model,
+                str(row["calls"]),
+                str(row["repaired"]),
+                str(row["reasked"]),
+                str(row["escalated"]),
+                f"{row['p50']:.3f}",
+                f"{row['p95']:.3f}",
+                f"{row['input_tokens']}/{row['output_tokens']}",
+                f"{row['cached_tokens']} ({row['cache_hit_rate']:.0%})",
+                "?" if row["cost_usd"] is None else f"{row['cost_usd']:.4f}",
+            )
+    console.print(table)
+
+
+DEFAULT_QUESTIONS = [
+    "Write about AI-Powered SOC / autonomous problem domain, "
+    "list startups that do that and successfully raised capital.",
+    "Write about Group Cohomology, list recent researches about it.",
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reflexion Agent")
+    parser.add_argument("questions", nargs="*", default=DEFAULT_QUESTIONS)
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument(
+        "--stream", action="store_true", help="render progress + answer live"
+    )
+    output.add_argument(
+        "--ndjson", action="store_true", help="write stream events as NDJSON"
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="write one JSON span per node / LLM call / search to PATH "
+        "and print p50/p95/p99 per span and latency / cost per model stage at the end",
+    )
+    topology = parser.add_mutually_exclusive_group()
+    topology.add_argument(
+        "--sections",
+        action="store_true",
+        help="long-form answer: plan sections and research them in parallel (sections.py)",
+    )
+    topology.add_argument(
+        "--compact",
+        action="store_true",
+        help="run on the compact typed state instead of the message list (compact_graph.py)",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="don't answer from the answer cache (near-duplicate questions)",
+    )
+    cassette_mode = parser.add_mutually_exclusive_group()
+    cassette_mode.add_argument(
+        "--record",
+        metavar="PATH",
+        help="record every LLM exchange and search of the run to a cassette (cassette.py)",
+    )
+    cassette_mode.add_argument(
+        "--replay",
+        metavar="PATH",
+        help="answer every LLM call and search from a recorded cassette, offline",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        choices=("original", "zero"),
+        default="original",
+        help="replay with the recorded latencies or without any",
+    )
+    parser.add_argument(
+        "--export-diagram",
+        action="store_true",
+        help=f"render the graph to {DIAGRAM_PATH} (uses the mermaid.ink service)",
+    )
+    args = parser.parse_args()
+
+    graph_options = {}
+    if args.record or args.replay:
+        from cassette import Cassette, graph_kwargs
+
+        cassette = Cassette(
+            args.record or args.replay,
+            mode="record" if args.record else "replay",
+            latency_scale=1.0 if args.replay_latency == "original" else 0.0,
+        )
+        atexit.register(lambda: console.print(f"📼 cassette: {cassette.stats()}"))
+        atexit.register(cassette.close)
+        graph_options = graph_kwargs(cassette, MAX_ITERATIONS)
+
+    if args.sections:
+        from sections import build_sectioned_graph, get_sectioned_graph
+
+        graph = build_sectioned_graph(**graph_options) if graph_options else get_sectioned_graph()
+    elif args.compact:
+        from compact_graph import build_compact_graph, get_compact_graph
+
+        graph = build_compact_graph(**graph_options) if graph_options else get_compact_graph()
+    else:
+        graph = build_graph(**graph_options) if graph_options else get_graph()
+    if args.export_diagram:
+        export_diagram(graph)
+
+    callbacks = []
+    if args.trace:
+        aggregate = AggregateExporter()
+        callbacks.append(Tracer([JsonLinesExporter(args.trace), aggregate]))
+        atexit.register(print_trace_summary, aggregate)
+        from routing import get_router
+
+        router = graph_options.get("router") or get_router(MAX_ITERATIONS)
+        atexit.register(print_stage_report, router)
+    config = {"callbacks": callbacks, "configurable": {BYPASS_KEY: args.fresh}}
+    # the compact graph takes {"question": ...} and returns its final state
+    inputs = [{"question": q} for q in args.questions] if args.compact else args.questions
+
+    # streaming modes: one question at a time, output as soon as it's generated
+    if args.ndjson:
+        for graph_input in inputs:
+            write_ndjson(stream_events(graph, graph_input, config), sys.stdout)
+        sys.exit(0)
+    if args.stream:
+        for question, graph_input in zip(args.questions, inputs):
+            console.rule(question)
+            render_live(stream_events(graph, graph_input, config), console)
+        sys.exit(0)
+
+    print("Hello Reflexion Agent!")
+
+    # invoke the graph for all questions concurrently
+    results = asyncio.run(
+        arun_questions(inputs, graph=graph, callbacks=callbacks, fresh=args.fresh)
+    )
+
+    for question, res in zip(args.questions, results):
+        if isinstance(res, Exception):
+            console.print(
+                Panel(repr(res), title=f"❌ Failed: {question}", border_style="red")
+            )
+            continue
+        if args.compact:
+            from compact_graph import as_messages
+
+            res = as_messages(res)
+        print_answer(question, res)
@@ -0,0 +1,235 @@
+# this file holds the passage extraction stage of the tool executor
+# a Tavily payload has up to five results per query, each with a long content
+# field, and the reviser prompt used to get all of it. instead:
+# 1. every result is split into short passages (a few sentences each)
+# 2. each passage is scored with BM25 against its query and against the
+#    `missing` part of the latest reflection (the facts the critique asked for)
+# 3. the best passage of every query is kept, then the next best ones overall,
+#    until the token budget is used up
+# the output keeps the Tavily shape ({"query", "results": [{"url", "title", "content"}]}),
+# so the reviser can still cite by URL and compaction.py still understands it.
+
+import logging
+import math
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Sequence
+
+from compaction import MAX_REPORTS, count_tokens
+from search_index import B, K1, tokenize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = 1_200
+PASSAGE_TOKENS = 60  # target size of one passage
+MISSING_WEIGHT = 0.7  # relevance to the critique, relative to the query
+SEPARATOR = " … "  # between non-adjacent passages of the same result
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+
+
+def split_passages(text: str, max_tokens: int = PASSAGE_TOKENS) -> List[str]:
+    """Group consecutive sentences into passages of about max_tokens."""
+    passages: List[str] = []
+    current: List[str] = []
+    size = 0
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if current and size + tokens > max_tokens:
+            passages.append(" ".join(current))
+            current, size = [], 0
+        current.append(sentence)
+        size += tokens
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+def top_passages(text: str, query: str, limit: int) -> List[str]:
+    """The passages of `text` that match `query` best (and at all), best first."""
+    passages = split_passages(text)
+    scores = _bm25([tokenize(passage) for passage in passages], tokenize(query))
+    ranked = sorted(zip(scores, passages), key=lambda pair: pair[0], reverse=True)
+    return [passage for score, passage in ranked[:limit] if score > 0]
+
+
+@dataclass
+class Passage:
+    query_index: int
+    result_index: int
+    position: int  # order inside its result
+    text: str
+    tokens: int
+    relevance: float = 0.0  # BM25 against the query + the critique
+    score: float = 0.0  # relevance + a tie-break towards the lead passages
+
+
+def _bm25(passages: List[List[str]], terms: Sequence[str]) -> List[float]:
+    """BM25 of every passage against `terms`, with statistics from this batch only."""
+    if not passages or not terms:
+        return [0.0] * len(passages)
+    average_length = sum(len(tokens) for tokens in passages) / len(passages) or 1.0
+    frequencies = [{} for _ in passages]
+    document_frequency: Dict[str, int] = {}
+    for counts, tokens in zip(frequencies, passages):
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for token in counts:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    scores = []
+    for counts, tokens in zip(frequencies, passages):
+        length_norm = 1 - B + B * len(tokens) / average_length
+        score = 0.0
+        for term in set(terms):
+            frequency = counts.get(term)
+            if frequency:
+                df = document_frequency[term]
+                idf = math.log(1 + (len(passages) - df + 0.5) / (df + 0.5))
+                score += idf * frequency * (K1 + 1) / (frequency + K1 * length_norm)
+        scores.append(score)
+    return scores
+
+
+@dataclass
+class PassageReport:
+    tokens_before: int
+    tokens_after: int
+    passages_kept: int
+    passages_total: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+
+def _is_payload(result: Any) -> bool:
+    return isinstance(result, dict) and isinstance(result.get("results"), list)
+
+
+class PassageExtractor:
+    """Keep only the search result passages that matter, under token_budget."""
+
+    def __init__(self, token_budget: int = DEFAULT_TOKEN_BUDGET, max_reports: int = MAX_REPORTS):
+        self.token_budget = token_budget
+        # the latest extractions only, like MessageCompactor.reports: the
+        # extractor is module-global in tool_executor.py
+        self.reports: Deque[PassageReport] = deque(maxlen=max_reports)
+        self._totals = {"extractions": 0, "tokens_before": 0, "tokens_after": 0}
+        self._lock = threading.Lock()
+
+    def extract(
+        self, results: List[Any], search_queries: List[str], missing: Optional[str] = None
+    ) -> List[Any]:
+        passages: List[Passage] = []
+        tokens_before = 0
+        for query_index, payload in enumerate(results):
+            if not _is_payload(payload):
+                continue  # errors etc. are passed through untouched
+            for result_index, item in enumerate(payload["results"]):
+                content = str(item.get("content") or "")
+                tokens_before += count_tokens(content)
+                for position, text in enumerate(split_passages(content)):
+                    passages.append(
+                        Passage(query_index, result_index, position, text, count_tokens(text))
+                    )
+        if not passages:
+            return results
+
+        tokenized = [tokenize(passage.text) for passage in passages]
+        missing_scores = _bm25(tokenized, tokenize(missing or ""))
+        for query_index, query in enumerate(search_queries):
+            members = [i for i, p in enumerate(passages) if p.query_index == query_index]
+            query_scores = _bm25([tokenized[i] for i in members], tokenize(query))
+            for i, score in zip(members, query_scores):
+                passage = passages[i]
+                passage.relevance = score + MISSING_WEIGHT * missing_scores[i]
+                # ties (e.g. nothing matches) go to the lead of the result
+                passage.score = passage.relevance + 0.01 / (1 + passage.position)
+
+        selected = self._select(passages)
+        output = self._assemble(results, selected)
+        tokens_after = sum(passage.tokens for passage in selected)
+        report = PassageReport(tokens_before, tokens_after, len(selected), len(passages))
+        with self._lock:
+            self.reports.append(report)
+            self._totals["extractions"] += 1
+            self._totals["tokens_before"] += report.tokens_before
+            self._totals["tokens_after"] += report.tokens_after
+        logger.info(
+            "kept %d/%d search passages: %d -> %d tokens",
+            report.passages_kept,
+            report.passages_total,
+            report.tokens_before,
+            report.tokens_after,
+        )
+        return output
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self._totals)
+        totals["tokens_saved"] = totals["tokens_before"] - totals["tokens_after"]
+        return totals
+
+    def _select(self, passages: List[Passage]) -> List[Passage]:
+        ranked = sorted(passages, key=lambda passage: passage.score, reverse=True)
+        selected: List[Passage] = []
+        seen_texts = set()  # the same snippet often comes back from several URLs
+        used = 0
+
+        def take(passage: Passage) -> None:
+            nonlocal used
+            selected.append(passage)
+            seen_texts.add(passage.text)
+            used += passage.tokens
+
+        # every query keeps at least its best passage, then the best ones overall
+        # (as long as they match the query or the critique at all)
+        best_per_query: Dict[int, Passage] = {}
+        for passage in ranked:
+            best_per_query.setdefault(passage.query_index, passage)
+        for passage in best_per_query.values():
+            if passage.text not in seen_texts:
+                take(passage)
+        for passage in ranked:
+            if passage.text in seen_texts or passage.relevance <= 0:
+                continue  # already taken / a duplicate of one that was / off topic
+            if used + passage.tokens > self.token_budget:
+                continue  # a shorter one further down may still fit
+            take(passage)
+        return selected
+
+    @staticmethod
+    def _assemble(results: List[Any], selected: List[Passage]) -> List[Any]:
+        kept: Dict[tuple, List[Passage]] = {}
+        for passage in selected:
+            kept.setdefault((passage.query_index, passage.result_index), []).append(passage)
+
+        output = []
+        for query_index, payload in enumerate(results):
+            if not _is_payload(payload):
+                output.append(payload)
+                continue
+            scored_items = []
+            for result_index, item in enumerate(payload["results"]):
+                chosen = kept.get((query_index, result_index))
+                if not chosen:
+                    continue
+                chosen.sort(key=lambda passage: passage.position)
+                content = chosen[0].text
+                for previous, passage in zip(chosen, chosen[1:]):
+                    adjacent = passage.position == previous.position + 1
+                    content += (" " if adjacent else SEPARATOR) + passage.text
+                score = max(passage.score for passage in chosen)
+                scored_items.append(
+                    (score, {"url": item.get("url"), "title": item.get("title"), "content": content})
+                )
+            scored_items.sort(key=lambda scored: scored[0], reverse=True)
+            output.append(
+                {"query": payload.get("query"), "results": [item for _, item in scored_items]}
+            )
+        return output
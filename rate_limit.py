@@ -0,0 +1,353 @@
+# this file holds the scheduler every OpenAI / Tavily call goes through
+# under load the search batches and the two LLM chains used to fire with no
+# coordination, hit 429s and then all retried at once. one Scheduler per backend:
+# 1. token buckets for requests per minute and tokens per minute
+# 2. adaptive concurrency (AIMD): the in-flight limit grows by ~1 per window of
+#    successful calls and is halved on a 429, a timeout, a 5xx or a latency spike.
+#    a spike is measured against the usual latency of the same kind of call
+#    (model + schema): a repair re-ask and a full draft take very different times
+# 3. retryable errors are retried with jittered exponential backoff; a
+#    Retry-After header pauses every caller of that backend, not just one
+# the goal is sustained throughput at the provider limit, not the fastest
+# possible single request (a call may wait for budget before it is sent).
+#
+# usage: scheduled(llm, get_scheduler("openai"), cost=estimate_tokens).invoke(prompt)
+
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from functools import cache
+from typing import Any, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from langchain_core.runnables import RunnableLambda
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+POLL_INTERVAL = 0.02  # seconds between checks while every slot is taken
+MIN_LATENCY_SAMPLE = 0.05  # faster than this never reached the provider (cache hit)
+
+
+@dataclass
+class RateLimits:
+    requests_per_minute: Optional[float] = None  # None = unlimited
+    tokens_per_minute: Optional[float] = None
+    # how much unused budget can pile up; providers enforce per-minute limits
+    # over shorter windows, so a full minute's worth at once would get 429s
+    burst_seconds: float = 10.0
+    initial_concurrency: int = 8
+    max_concurrency: int = 64
+    max_retries: int = 6
+    base_delay: float = 0.5  # seconds, doubled on every retry (before jitter)
+    max_delay: float = 60.0
+
+
+class TokenBucket:
+    """`per_minute` units refilled continuously, at most `burst_seconds` worth banked.
+
+    Not thread-safe on its own, the Scheduler holds its lock around it.
+    """
+
+    def __init__(self, per_minute: Optional[float], burst_seconds: float = 10.0):
+        self.per_minute = per_minute
+        self.capacity = max(1.0, (per_minute or 0.0) * burst_seconds / 60)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        elapsed, self.updated = now - self.updated, now
+        self.level = min(self.capacity, self.level + elapsed * self.per_minute / 60)
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.per_minute:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # a huge call waits for a full bucket
+        return max(0.0, (amount - self.level) * 60 / self.per_minute)
+
+    def take(self, amount: float) -> None:
+        if self.per_minute:
+            self.level -= amount
+
+    def adjust(self, delta: float) -> None:
+        """Correct an estimate once the real cost is known (the level may go negative)."""
+        if self.per_minute:
+            self.level = min(self.capacity, self.level - delta)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight calls, driven by latency and throttling."""
+
+    def __init__(
+        self,
+        initial: int = 8,
+        minimum: int = 1,
+        maximum: int = 64,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        # slow moving average of the latency, per kind of call
+        self.baselines: Dict[str, float] = {}
+        self._last_decrease = 0.0
+
+    def on_success(self, latency: float, now: float, kind: str = "") -> None:
+        if latency >= MIN_LATENCY_SAMPLE:
+            baseline = self.baselines.get(kind)
+            if baseline is None:
+                self.baselines[kind] = latency
+            else:
+                self.baselines[kind] = baseline + 0.1 * (latency - baseline)
+                if latency > self.latency_tolerance * baseline:
+                    self.on_congestion(now, kind)  # the provider is queueing us
+                    return
+        # additive increase: about +1 once a whole window of calls succeeded
+        self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def on_congestion(self, now: float, kind: str = "") -> None:
+        # concurrent calls tend to fail together, only back off once per round trip
+        if now - self._last_decrease < self.baselines.get(kind, 1.0):
+            return
+        self._last_decrease = now
+        self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    for source in (error, getattr(error, "response", None)):
+        code = getattr(source, "status_code", None) or getattr(source, "status", None)
+        if isinstance(code, int):
+            return code
+    # langchain_tavily wraps HTTP errors as ValueError("Error 429: ...")
+    match = re.search(r"\bError (\d{3})\b", str(error))
+    return int(match.group(1)) if match else None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds from a Retry-After(-ms) header on the error's response, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        when = parsedate_to_datetime(value)  # the HTTP-date form
+        return max(0.0, when.timestamp() - time.time())
+
+
+def is_retryable(error: BaseException) -> bool:
+    if status_code(error) in RETRYABLE_STATUS:
+        return True
+    name = type(error).__name__
+    return "Timeout" in name or "Connection" in name
+
+
+def _error_of(result: Any, error: Optional[BaseException]) -> Optional[BaseException]:
+    # TavilySearch doesn't raise, it returns {"error": exception}
+    if error is None and isinstance(result, dict):
+        if isinstance(result.get("error"), BaseException):
+            return result["error"]
+    return error
+
+
+def _tokens_used(result: Any) -> Optional[int]:
+    usage = getattr(result, "usage_metadata", None) or {}
+    return usage.get("total_tokens")
+
+
+class Scheduler:
+    """Token buckets + AIMD concurrency + retries for one backend.
+
+    Works from threads (call) and from asyncio (acall) at the same time: the
+    shared state sits behind a lock and waiting is done by sleeping until the
+    budget is expected to be back.
+    """
+
+    def __init__(self, name: str, limits: Optional[RateLimits] = None):
+        self.name = name
+        self.limits = limits or RateLimits()
+        self.requests = TokenBucket(self.limits.requests_per_minute, self.limits.burst_seconds)
+        self.tokens = TokenBucket(self.limits.tokens_per_minute, self.limits.burst_seconds)
+        self.concurrency = AdaptiveConcurrency(
+            initial=self.limits.initial_concurrency, maximum=self.limits.max_concurrency
+        )
+        self.in_flight = 0
+        self.blocked_until = 0.0  # set from Retry-After, pauses every caller
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "throttled": 0, "failed": 0}
+        self.waited_seconds = 0.0
+
+    # ── admission ──────────────────────────────────────────────────────────
+    def _try_acquire(self, cost: float) -> float:
+        """Take a slot and the budget and return 0, or return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(
+                self.blocked_until - now,
+                self.requests.wait_time(1, now),
+                self.tokens.wait_time(cost, now),
+            )
+            if wait <= 0 and self.in_flight >= int(self.concurrency.limit):
+                wait = POLL_INTERVAL
+            if wait > 0:
+                return wait
+            self.requests.take(1)
+            self.tokens.take(cost)
+            self.in_flight += 1
+            return 0.0
+
+    def _release(self) -> None:
+        """Give the slot back without an outcome (the call was cancelled)."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def _settle(
+        self, attempt: int, cost: float, latency: float, result: Any, error, kind: str = ""
+    ) -> Optional[float]:
+        """Release the slot, feed the outcome back; return the retry delay or None."""
+        error = _error_of(result, error)
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if error is None:
+                self.counters["calls"] += 1
+                self.concurrency.on_success(latency, now, kind)
+                used = _tokens_used(result)
+                if used is not None:
+                    self.tokens.adjust(used - cost)
+                return None
+            if not is_retryable(error) or attempt >= self.limits.max_retries:
+                self.counters["failed"] += 1
+                return None
+            self.counters["retries"] += 1
+            self.concurrency.on_congestion(now, kind)
+            delay = random.uniform(0, min(self.limits.max_delay, self.limits.base_delay * 2**attempt))
+            pause = retry_after(error)
+            if status_code(error) == 429:
+                self.counters["throttled"] += 1
+            if pause is not None:
+                self.blocked_until = max(self.blocked_until, now + pause)
+                delay = max(delay, pause)
+            return delay
+
+    # ── running calls ──────────────────────────────────────────────────────
+    # `kind` groups calls with comparable latency (e.g. "gpt-4.1:ReviseAnswer")
+    def call(self, fn: Callable, *args, cost: float = 0, kind: str = "", **kwargs) -> Any:
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(cost)) > 0:
+                self.waited_seconds += wait
+                time.sleep(wait)
+            start = time.perf_counter()
+            result = error = None
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+            except BaseException:
+                # cancelled (or interrupted): release the slot, a cancellation
+                # says nothing about the provider so the window is left as is
+                self._release()
+                raise
+            latency = time.perf_counter() - start
+            delay = self._settle(attempt, cost, latency, result, error, kind)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(
+        self, fn: Callable, *args, cost: float = 0, kind: str = "", **kwargs
+    ) -> Any:
+        attempt = 0
+        while True:
+            while (wait := self._try_acquire(cost)) > 0:
+                self.waited_seconds += wait
+                await asyncio.sleep(wait)
+            start = time.perf_counter()
+            result = error = None
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                error = e
+            except BaseException:
+                # cancelled (or interrupted): release the slot, a cancellation
+                # says nothing about the provider so the window is left as is
+                self._release()
+                raise
+            latency = time.perf_counter() - start
+            delay = self._settle(attempt, cost, latency, result, error, kind)
+            if delay is None:
+                if error is not None:
+                    raise error
+                return result
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "in_flight": self.in_flight,
+                "concurrency_limit": round(self.concurrency.limit, 2),
+                "waited_seconds": round(self.waited_seconds, 3),
+            }
+
+
+def scheduled(
+    runnable,
+    scheduler: Scheduler,
+    cost: Optional[Callable[[Any], float]] = None,
+    kind: str = "",
+):
+    """Wrap a runnable so that every invoke/ainvoke/batch goes through `scheduler`.
+
+    `cost` estimates the tokens an input will use (for the tokens-per-minute
+    bucket); the estimate is corrected from usage_metadata afterwards. `kind`
+    names the latency class of the calls (model + schema), see AdaptiveConcurrency.
+    """
+
+    def call(input, config):
+        return scheduler.call(
+            runnable.invoke, input, config, cost=cost(input) if cost else 0, kind=kind
+        )
+
+    async def acall(input, config):
+        return await scheduler.acall(
+            runnable.ainvoke, input, config, cost=cost(input) if cost else 0, kind=kind
+        )
+
+    return RunnableLambda(call, afunc=acall, name=f"{scheduler.name}_scheduler")
+
+
+# provider limits differ per account tier: override them in .env,
+# "0" means unlimited for that bucket. the provider counts the calls of every
+# process on the account together: RATE_LIMIT_SHARE (0-1) is the part of each
+# limit this process may use, workers.py sets it to 1/N in each of N workers
+DEFAULT_LIMITS = {
+    "openai": {"requests_per_minute": ("OPENAI_RPM", 500), "tokens_per_minute": ("OPENAI_TPM", 200_000)},
+    "tavily": {"requests_per_minute": ("TAVILY_RPM", 100)},
+}
+
+
+@cache
+def get_scheduler(backend: str) -> Scheduler:
+    """The process-wide scheduler of a backend, shared by every chain and graph."""
+    load_dotenv()
+    share = float(os.getenv("RATE_LIMIT_SHARE", 1))
+    limits = {}
+    for field, (variable, default) in DEFAULT_LIMITS.get(backend, {}).items():
+        limits[field] = float(os.getenv(variable, default)) * share or None
+    return Scheduler(backend, RateLimits(**limits))
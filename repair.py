@@ -0,0 +1,358 @@
+# this file holds the local repair of the draft / reviser tool calls
+# the model doesn't always stick to the schema: chains_reviser_print.py shows
+# ReviseAnswer calls with `reference` nested under `reflection`, there are
+# strings where a list belongs, and JSON cut off by max_tokens. the router
+# used to redo every such call on the escalation model, a whole new
+# generation of several seconds. ToolCallRepairer runs first:
+# 1. local repairs, no model call:
+#    - malformed JSON arguments are parsed leniently (unclosed strings / brackets)
+#    - misplaced fields are moved where they belong (reflection.reference ->
+#      reference, a top-level `missing` -> reflection.missing), and
+#      plural / singular names are renamed (references -> reference)
+#    - types are coerced (a query string -> [query], a list answer -> text,
+#      a string reflection -> {"missing": ..., "superfluous": ""})
+#    - over-long answers are cut at a sentence boundary, the References stay
+#    - missing fields get defaults (the references from the URLs in the
+#      answer, an empty critique, no search queries)
+# 2. a targeted re-ask, only if the call is still invalid: the model gets its
+#    repaired call back with the validation errors and fills in just the
+#    fields that are still wrong (a smaller schema, the answer isn't rewritten)
+# whatever is still invalid after that is escalated by the router as before.
+# stats() counts valid / repaired / re-asked calls and every kind of repair.
+# set TOOL_CALL_REPAIR=0 to turn it off, TOOL_CALL_REPAIR=local to never re-ask
+
+import copy
+import json
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple, get_args, get_origin
+
+from dotenv import load_dotenv
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.prompt_values import ChatPromptValue
+from langchain_core.utils.json import parse_partial_json
+from pydantic import BaseModel, ValidationError, create_model
+
+# the prompt asks for ~250 words without the References section; only
+# answers well past that are cut, the router's min_answer_words guards the other end
+MAX_ANSWER_WORDS = 400
+
+_URL = re.compile(r"https?://[^\s)\]>\"'<,]+")
+_REFERENCES = re.compile(r"\n[#*\s]*references\b", re.IGNORECASE)
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+@dataclass
+class Repair:
+    """A tool call after local repair (and maybe a re-ask)."""
+
+    message: Any
+    args: Optional[dict]  # None: there was no tool call to repair
+    actions: List[str] = field(default_factory=list)
+    errors: List[dict] = field(default_factory=list)  # validation errors left, [] = valid
+    reasked: bool = False
+
+    @property
+    def valid(self) -> bool:
+        return self.args is not None and not self.errors
+
+
+def _key(name: str) -> str:
+    # "References", "search-queries", "search_query" -> comparable names
+    return re.sub(r"[\s-]+", "_", name.strip().lower()).rstrip("s")
+
+
+def _model(annotation) -> Optional[type]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    return None
+
+
+def _is_list(annotation) -> bool:
+    return get_origin(annotation) is list or annotation is list
+
+
+def _errors(schema, args: dict) -> List[dict]:
+    try:
+        schema.model_validate(args)
+    except ValidationError as error:
+        return error.errors(include_url=False, include_input=False)
+    return []
+
+
+def _split_answer(answer: str) -> Tuple[str, str]:
+    """(body, References section) of an answer."""
+    match = _REFERENCES.search(answer)
+    return (answer[: match.start()], answer[match.start() :]) if match else (answer, "")
+
+
+def _as_list(value: Any) -> List[str]:
+    if isinstance(value, str):
+        lines = [_BULLET.sub("", line).strip() for line in value.splitlines()]
+        return [line for line in lines if line] or ([value] if value else [])
+    if isinstance(value, dict):
+        value = list(value.values())
+    items = []
+    for item in value if isinstance(value, (list, tuple)) else [value]:
+        if isinstance(item, dict):  # [{"url": ...}] instead of [url]
+            item = item.get("url") or item.get("query") or next(iter(item.values()), "")
+        items.append(str(item))
+    return items
+
+
+class ToolCallRepairer:
+    """Makes draft / reviser tool calls fit their schema, locally where it can."""
+
+    def __init__(self, reask: bool = True, max_answer_words: int = MAX_ANSWER_WORDS):
+        self.reask = reask
+        self.max_answer_words = max_answer_words
+        self.counts: Counter = Counter()  # calls, valid, repaired, reasked, reask_fixed, unrepaired
+        self.actions: Counter = Counter()  # e.g. "moved:reference", "coerced:search_queries"
+        self._fix_schemas: Dict[Tuple[str, Tuple[str, ...]], type] = {}
+        self._lock = threading.Lock()
+
+    # ── local repair ──────────────────────────────────────────────────────
+    def repair(self, message: Any, schema) -> Repair:
+        """Repair the tool call of `message` against `schema` without any model call."""
+        call, actions = self._tool_call(message, schema)
+        if call is None:
+            repair = Repair(message, None, errors=[{"loc": (), "msg": "no tool call"}])
+        else:
+            args = copy.deepcopy(call["args"])
+            self._fix(args, schema, actions)
+            self._truncate(args, actions)
+            repair = Repair(message, args, actions, _errors(schema, args))
+            if actions:
+                repair.message = self._with_args(message, call, args)
+        with self._lock:
+            self.counts["calls"] += 1
+            self.actions.update(repair.actions)
+            if not repair.actions and repair.valid:
+                self.counts["valid"] += 1
+            elif repair.valid:
+                self.counts["repaired"] += 1
+            elif not self.reask:
+                self.counts["unrepaired"] += 1
+        return repair
+
+    def _tool_call(self, message: Any, schema) -> Tuple[Optional[dict], List[str]]:
+        name = schema.__name__
+        calls = getattr(message, "tool_calls", None) or []
+        if calls:
+            call = next((c for c in calls if c["name"] == name), calls[0])
+            return call, [] if isinstance(call["args"], dict) else ["parsed_json"]
+        for call in getattr(message, "invalid_tool_calls", None) or []:
+            # e.g. arguments cut off by max_tokens: close the open strings / brackets
+            try:
+                args = parse_partial_json(call.get("args") or "")
+            except json.JSONDecodeError:
+                continue
+            if isinstance(args, dict):
+                return {"name": name, "args": args, "id": call.get("id")}, ["parsed_json"]
+        content = getattr(message, "content", None)
+        if isinstance(content, str) and content.lstrip().startswith("{"):
+            # the arguments were written as plain text instead of a tool call
+            try:
+                args = parse_partial_json(content)
+            except json.JSONDecodeError:
+                return None, []
+            if isinstance(args, dict):
+                return {"name": name, "args": args, "id": None}, ["parsed_content"]
+        return None, []
+
+    def _fix(self, args: dict, model, actions: List[str], path: str = "") -> None:
+        fields = model.model_fields
+        # renamed: "references" -> "reference", "Search Queries" -> "search_queries"
+        for key in list(args):
+            if key in fields:
+                continue
+            target = next((n for n in fields if n not in args and _key(n) == _key(key)), None)
+            if target:
+                args[target] = args.pop(key)
+                actions.append(f"renamed:{path}{target}")
+        # misplaced, nested too deep: reflection.reference -> reference
+        for name in fields:
+            if name in args:
+                continue
+            for key, value in list(args.items()):
+                if not isinstance(value, dict):
+                    continue
+                inner = _model(fields[key].annotation) if key in fields else None
+                belongs = inner.model_fields if inner else {}
+                match = next(
+                    (k for k in value if _key(k) == _key(name) and k not in belongs), None
+                )
+                if match is not None:
+                    args[name] = value.pop(match)
+                    actions.append(f"moved:{path}{name}")
+                    break
+        # misplaced, not nested: a top-level `missing` -> reflection.missing
+        for name, info in fields.items():
+            inner = _model(info.annotation)
+            if inner is None or not isinstance(args.get(name, {}), dict):
+                continue
+            loose = [
+                key
+                for key in args
+                if key not in fields and any(_key(key) == _key(n) for n in inner.model_fields)
+            ]
+            if loose:
+                target = args.setdefault(name, {})
+                for key in loose:
+                    target[key] = args.pop(key)
+                actions.append(f"moved:{path}{name}")
+        # types, then defaults for what's still missing
+        for name, info in fields.items():
+            if name in args:
+                args[name] = self._coerce(args[name], info.annotation, actions, f"{path}{name}")
+            elif not info.is_required():
+                continue
+            else:
+                default = self._default(name, info.annotation, args, path)
+                if default is not None:
+                    args[name] = default
+                    actions.append(f"default:{path}{name}")
+
+    def _coerce(self, value: Any, annotation, actions: List[str], path: str) -> Any:
+        inner = _model(annotation)
+        if inner is not None:
+            if isinstance(value, str):  # the whole critique in one string
+                names = list(inner.model_fields)
+                value = {names[0]: value}
+                actions.append(f"coerced:{path}")
+            if isinstance(value, dict):
+                self._fix(value, inner, actions, f"{path}.")
+            return value
+        if _is_list(annotation):
+            item = (get_args(annotation) or (str,))[0]
+            if item is str and not (
+                isinstance(value, list) and all(isinstance(v, str) for v in value)
+            ):
+                actions.append(f"coerced:{path}")
+                return _as_list(value)
+            return value
+        if annotation is str and not isinstance(value, str):
+            actions.append(f"coerced:{path}")
+            if isinstance(value, (list, tuple)):
+                return "\n".join(map(str, value))
+            return json.dumps(value) if isinstance(value, dict) else str(value)
+        return value
+
+    def _default(self, name: str, annotation, args: dict, path: str) -> Any:
+        inner = _model(annotation)
+        if inner is not None:
+            value: dict = {}
+            self._fix(value, inner, [], f"{path}{name}.")
+            return value
+        if _is_list(annotation):
+            if name == "reference":
+                # the reviser lists its sources at the end of the answer anyway
+                _, references = _split_answer(str(args.get("answer", "")))
+                return list(dict.fromkeys(_URL.findall(references or str(args.get("answer", "")))))
+            return []
+        # a missing critique can be empty; a missing answer can't be made up
+        return "" if annotation is str and path else None
+
+    def _truncate(self, args: dict, actions: List[str]) -> None:
+        answer = args.get("answer")
+        if not isinstance(answer, str):
+            return
+        body, references = _split_answer(answer)
+        words = body.split()
+        if len(words) <= self.max_answer_words:
+            return
+        # cut after the last full sentence within the limit
+        cut = " ".join(words[: self.max_answer_words])
+        ends = [match.start() + 1 for match in _SENTENCE_END.finditer(cut + " ")]
+        body = cut[: ends[-1]] if ends else cut
+        args["answer"] = body.rstrip() + ("\n\n" + references.strip() if references else "")
+        actions.append("truncated:answer")
+
+    @staticmethod
+    def _with_args(message: Any, call: dict, args: dict) -> AIMessage:
+        tool_call = {"name": call["name"], "args": args, "id": call.get("id") or "call_repaired"}
+        others = [c for c in getattr(message, "tool_calls", None) or [] if c is not call]
+        return AIMessage(
+            content=message.content if isinstance(message.content, str) else "",
+            tool_calls=[tool_call, *others],
+            id=getattr(message, "id", None),
+            usage_metadata=getattr(message, "usage_metadata", None),
+            response_metadata=getattr(message, "response_metadata", {}),
+        )
+
+    # ── targeted re-ask ───────────────────────────────────────────────────
+    def fix_schema(self, schema, repair: Repair):
+        """A schema with only the fields of `schema` that are still invalid."""
+        failing = {error["loc"][0] for error in repair.errors if error.get("loc")}
+        names = tuple(n for n in schema.model_fields if n in failing) or tuple(schema.model_fields)
+        key = (schema.__name__, names)
+        fields = schema.model_fields
+        with self._lock:
+            if key not in self._fix_schemas:
+                self._fix_schemas[key] = create_model(
+                    f"{schema.__name__}_fix_" + "_".join(names),
+                    __doc__=f"Fix the invalid fields of your {schema.__name__} call.",
+                    **{n: (fields[n].annotation, fields[n]) for n in names},
+                )
+            return self._fix_schemas[key]
+
+    def reask_prompt(self, prompt_value, repair: Repair, schema, fix) -> ChatPromptValue:
+        """The original prompt, the repaired call and what's still wrong with it."""
+        call_id = "call_repair"
+        problems = "\n".join(
+            f"- {'.'.join(map(str, error['loc'])) or 'arguments'}: {error['msg']}"
+            for error in repair.errors
+        )
+        return ChatPromptValue(
+            messages=[
+                *prompt_value.to_messages(),
+                AIMessage(
+                    content="",
+                    tool_calls=[
+                        {"name": schema.__name__, "args": repair.args or {}, "id": call_id}
+                    ],
+                ),
+                ToolMessage(
+                    tool_call_id=call_id,
+                    content=f"This {schema.__name__} call is invalid:\n{problems}\n"
+                    f"Call {fix.__name__} with only these fields, the rest of the call is kept.",
+                ),
+            ]
+        )
+
+    def merge(self, repair: Repair, answer: Any, schema) -> Repair:
+        """`repair` with the fields the model sent in answer to the re-ask."""
+        fix_call, _ = self._tool_call(answer, schema)
+        args = dict(repair.args or {})
+        if fix_call is not None:
+            args.update(fix_call["args"])
+        actions = [*repair.actions, "reasked"]
+        self._fix(args, schema, actions)
+        self._truncate(args, actions)
+        errors = _errors(schema, args)
+        message = repair.message
+        if not errors:
+            base = {"name": schema.__name__, "id": None}
+            calls = getattr(repair.message, "tool_calls", None) or []
+            message = self._with_args(repair.message, calls[0] if calls else base, args)
+        with self._lock:
+            self.counts["reasked"] += 1
+            self.counts["reask_fixed" if not errors else "unrepaired"] += 1
+        return Repair(message, args, actions, errors, reasked=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "actions": dict(self.actions)}
+
+
+def default_repairer():
+    """ToolCallRepairer per TOOL_CALL_REPAIR (1 = default, local = no re-ask, 0 = off)."""
+    load_dotenv()
+    mode = os.getenv("TOOL_CALL_REPAIR", "1")
+    if mode == "0":
+        return False
+    return ToolCallRepairer(reask=mode != "local")
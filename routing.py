@@ -0,0 +1,318 @@
+# this file holds the per-stage model routing of the draft / reviser chains
+# one ChatOpenAI(model="gpt-4.1-mini") used to answer every call, although the
+# stages don't need the same model. every call now goes through a ModelRouter:
+# 1. stages: "draft" (first answer), "revision" (intermediate revisions) and
+#    "final_revision" (the revision after the last search round, i.e. once
+#    more than max_iterations ToolMessages are in the prompt)
+# 2. each stage has a Route: model, max_tokens, temperature
+# 3. escalation: when the answer fails validation (no / malformed tool call,
+#    arguments that don't fit the schema) or a quality signal is low (answer
+#    shorter than min_answer_words, a revision without references), the call
+#    is repeated once with the route's escalate_to model
+#    before that, a call that doesn't fit the schema is repaired locally or
+#    with a targeted re-ask (repair.ToolCallRepairer), which is much cheaper
+# 4. per stage and model: calls, repairs, re-asks, escalations (and why),
+#    latency, tokens, the input tokens served from the provider's prompt
+#    cache and the estimated cost from PRICES, see report()
+# every schema is bound with its own prompt_cache_key, so OpenAI routes the
+# calls that share a prompt prefix to the same cache (PROMPT_CACHE_KEY, "" = off)
+# routes come from the environment, e.g. ROUTE_REVISION_MODEL=gpt-4.1-nano,
+# ROUTE_FINAL_REVISION_MODEL=gpt-4.1, ROUTE_DRAFT_TEMPERATURE=0.2,
+# ROUTE_ESCALATE_MODEL=gpt-4.1 (every stage escalates to it, "" = never)
+
+import os
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from pydantic import ValidationError
+
+from rate_limit import scheduled
+from repair import default_repairer
+
+DEFAULT_MODEL = "gpt-4.1-mini"
+DEFAULT_ESCALATION_MODEL = "gpt-4.1"
+STAGES = ("draft", "revision", "final_revision")
+# config["configurable"][STAGE_KEY] names the stage of a call whose prompt
+# doesn't carry the ToolMessage history (the compact graph, compact_graph.py)
+STAGE_KEY = "route_stage"
+
+DEFAULT_PROMPT_CACHE_KEY = "reflexion-agent"
+
+# USD per 1M tokens (input, cached input, output); unknown models are reported without cost
+PRICES = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+}
+
+
+@dataclass(frozen=True)
+class Route:
+    model: str = DEFAULT_MODEL
+    max_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    escalate_to: Optional[str] = DEFAULT_ESCALATION_MODEL
+    min_answer_words: int = 40  # shorter answers count as low quality
+
+
+def default_routes() -> Dict[str, Route]:
+    load_dotenv()
+    escalate_to = os.getenv("ROUTE_ESCALATE_MODEL", DEFAULT_ESCALATION_MODEL) or None
+    routes = {}
+    for stage in STAGES:
+        prefix = f"ROUTE_{stage.upper()}_"
+        max_tokens = os.getenv(prefix + "MAX_TOKENS")
+        temperature = os.getenv(prefix + "TEMPERATURE")
+        routes[stage] = Route(
+            model=os.getenv(prefix + "MODEL", DEFAULT_MODEL),
+            max_tokens=int(max_tokens) if max_tokens else None,
+            temperature=float(temperature) if temperature else None,
+            escalate_to=escalate_to,
+        )
+    return routes
+
+
+def cost(model: str, input_tokens: int, output_tokens: int, cached: int = 0) -> Optional[float]:
+    price = PRICES.get(model)
+    if price is None:
+        return None
+    uncached = input_tokens - cached
+    return (uncached * price[0] + cached * price[1] + output_tokens * price[2]) / 1_000_000
+
+
+def cached_tokens(usage: dict) -> int:
+    """Input tokens the provider read from its prompt cache."""
+    # langchain_openai: input_token_details.cache_read, with a tier prefix on
+    # the priority / flex service tiers ("priority_cache_read")
+    details = usage.get("input_token_details") or {}
+    return sum(value or 0 for key, value in details.items() if key.endswith("cache_read"))
+
+
+def check(message: Any, schema, route: Route) -> Optional[str]:
+    """Why the answer should be escalated, or None if it's good enough."""
+    tool_calls = getattr(message, "tool_calls", None)
+    if not tool_calls or getattr(message, "invalid_tool_calls", None):
+        return "no valid tool call"
+    args = tool_calls[0]["args"]
+    try:
+        schema.model_validate(args)
+    except ValidationError:
+        return "schema validation failed"
+    if len(str(args.get("answer", "")).split()) < route.min_answer_words:
+        return "answer too short"
+    if "reference" in schema.model_fields and not args.get("reference"):
+        return "no references"
+    return None
+
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    escalated: int = 0  # calls whose answer was redone by the escalation model
+    repaired: int = 0  # calls whose tool call was fixed locally
+    reasked: int = 0  # calls that needed a targeted re-ask for the invalid fields
+    reasons: Counter = field(default_factory=Counter)
+    seconds: deque = field(default_factory=lambda: deque(maxlen=10_000))  # latest calls
+    input_tokens: int = 0
+    cached_tokens: int = 0  # input tokens served from the provider's prompt cache
+    output_tokens: int = 0
+    cost: Optional[float] = 0.0
+
+    def summary(self) -> dict:
+        ordered = sorted(self.seconds)
+        pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+        return {
+            "calls": self.calls,
+            "escalated": self.escalated,
+            "repaired": self.repaired,
+            "reasked": self.reasked,
+            "reasons": dict(self.reasons),
+            "p50": pick(0.50) if ordered else 0.0,
+            "p95": pick(0.95) if ordered else 0.0,
+            "input_tokens": self.input_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cache_hit_rate": self.cached_tokens / self.input_tokens if self.input_tokens else 0.0,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost, 6) if self.cost is not None else None,
+        }
+
+
+class ModelRouter:
+    """Picks the model of every draft / reviser call by stage, escalates weak answers."""
+
+    def __init__(
+        self,
+        routes: Optional[Dict[str, Route]] = None,
+        llm_factory: Optional[Callable[[Route], Any]] = None,
+        max_iterations: int = 3,
+        repairer=None,
+        prompt_cache_key: Optional[str] = None,
+    ):
+        # llm_factory builds the chat model of a route (default: chains.get_llm),
+        # e.g. lambda route: StubChatModel() to route between stubs offline.
+        # repairer defaults to repair.default_repairer(), False turns repair off
+        self.routes = routes or default_routes()
+        self.repairer = default_repairer() if repairer is None else repairer
+        # only for models that take OpenAI's prompt_cache_key (see get_router)
+        self.prompt_cache_key = prompt_cache_key
+        self.llm_factory = llm_factory or _openai_llm
+        self.max_iterations = max_iterations
+        self._bound: Dict[Tuple[Route, type, int], Any] = {}
+        self._stats: Dict[Tuple[str, str], StageStats] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, schema, prompt_value) -> str:
+        if schema.__name__ == "AnswerQuestion":
+            return "draft"
+        iterations = sum(isinstance(m, ToolMessage) for m in prompt_value.to_messages())
+        # the stopping policy ends the loop once iterations > max_iterations
+        return "final_revision" if iterations > self.max_iterations else "revision"
+
+    def _model(self, route: Route, schema, scheduler, estimate):
+        # the schema itself: the speculative variants share the tool name
+        key = (route, schema, id(scheduler))
+        with self._lock:
+            if key not in self._bound:
+                options = {}
+                if self.prompt_cache_key:
+                    # in the request body: the pinned openai client (1.96) has
+                    # no prompt_cache_key argument and rejects unknown ones
+                    cache_key = f"{self.prompt_cache_key}:{schema.__name__}"
+                    options["extra_body"] = {"prompt_cache_key": cache_key}
+                bound = self.llm_factory(route).bind_tools(
+                    tools=[schema],
+                    tool_choice={"type": "function", "function": {"name": schema.__name__}},
+                    **options,
+                )
+                self._bound[key] = scheduled(
+                    bound, scheduler, cost=estimate, kind=f"{route.model}:{schema.__name__}"
+                )
+            return self._bound[key]
+
+    def _record(self, stage: str, model: str, seconds: float, message: Any) -> StageStats:
+        usage = getattr(message, "usage_metadata", None) or {}
+        input_tokens = usage.get("input_tokens", 0)
+        output_tokens = usage.get("output_tokens", 0)
+        cached = cached_tokens(usage)
+        price = cost(model, input_tokens, output_tokens, cached)
+        with self._lock:
+            stats = self._stats.setdefault((stage, model), StageStats())
+            stats.calls += 1
+            stats.seconds.append(seconds)
+            stats.input_tokens += input_tokens
+            stats.cached_tokens += cached
+            stats.output_tokens += output_tokens
+            stats.cost = None if price is None or stats.cost is None else stats.cost + price
+            return stats
+
+    def _repaired(self, stats: StageStats, repair) -> Any:
+        with self._lock:
+            stats.repaired += bool(repair.valid and repair.actions and not repair.reasked)
+            stats.reasked += repair.reasked
+        return repair.message
+
+    def _escalation(self, route: Route, stats: StageStats, message, schema):
+        """The route to redo the call with, or None to keep the answer."""
+        reason = check(message, schema, route)
+        if reason is None or not route.escalate_to or route.escalate_to == route.model:
+            return None
+        with self._lock:
+            stats.escalated += 1
+            stats.reasons[reason] += 1
+        return Route(
+            model=route.escalate_to,
+            max_tokens=route.max_tokens,
+            temperature=route.temperature,
+            escalate_to=None,
+            min_answer_words=route.min_answer_words,
+        )
+
+    def runnable(self, schema, scheduler, estimate=None):
+        """The tool-calling model step of a chain, routed per call."""
+
+        def call(prompt_value, config: RunnableConfig):
+            stage = (config.get("configurable") or {}).get(STAGE_KEY) or self.stage(
+                schema, prompt_value
+            )
+            route = self.routes[stage]
+            while route is not None:
+                start = time.perf_counter()
+                message = self._model(route, schema, scheduler, estimate).invoke(
+                    prompt_value, config
+                )
+                stats = self._record(stage, route.model, time.perf_counter() - start, message)
+                if self.repairer:
+                    repair = self.repairer.repair(message, schema)
+                    if not repair.valid and self.repairer.reask:
+                        fix = self.repairer.fix_schema(schema, repair)
+                        start = time.perf_counter()
+                        answer = self._model(route, fix, scheduler, estimate).invoke(
+                            self.repairer.reask_prompt(prompt_value, repair, schema, fix), config
+                        )
+                        self._record(stage, route.model, time.perf_counter() - start, answer)
+                        repair = self.repairer.merge(repair, answer, schema)
+                    message = self._repaired(stats, repair)
+                route = self._escalation(route, stats, message, schema)
+            return message
+
+        async def acall(prompt_value, config: RunnableConfig):
+            stage = (config.get("configurable") or {}).get(STAGE_KEY) or self.stage(
+                schema, prompt_value
+            )
+            route = self.routes[stage]
+            while route is not None:
+                start = time.perf_counter()
+                message = await self._model(route, schema, scheduler, estimate).ainvoke(
+                    prompt_value, config
+                )
+                stats = self._record(stage, route.model, time.perf_counter() - start, message)
+                if self.repairer:
+                    repair = self.repairer.repair(message, schema)
+                    if not repair.valid and self.repairer.reask:
+                        fix = self.repairer.fix_schema(schema, repair)
+                        start = time.perf_counter()
+                        answer = await self._model(route, fix, scheduler, estimate).ainvoke(
+                            self.repairer.reask_prompt(prompt_value, repair, schema, fix), config
+                        )
+                        self._record(stage, route.model, time.perf_counter() - start, answer)
+                        repair = self.repairer.merge(repair, answer, schema)
+                    message = self._repaired(stats, repair)
+                route = self._escalation(route, stats, message, schema)
+            return message
+
+        return RunnableLambda(call, afunc=acall, name=f"{schema.__name__}_router")
+
+    def report(self) -> Dict[str, Dict[str, dict]]:
+        """{stage: {model: calls, repairs, re-asks, escalations, latency, tokens, cache hits, cost}}"""
+        with self._lock:
+            report: Dict[str, Dict[str, dict]] = {}
+            keys = sorted(self._stats, key=lambda key: (STAGES.index(key[0]), key[1]))
+            for stage, model in keys:
+                stats = self._stats[(stage, model)]
+                report.setdefault(stage, {})[model] = stats.summary()
+            return report
+
+
+def _openai_llm(route: Route):
+    from chains import get_llm
+
+    return get_llm(route.model, route.max_tokens, route.temperature)
+
+
+@cache
+def get_router(max_iterations: int = 3) -> ModelRouter:
+    """The process-wide router of the OpenAI graph."""
+    load_dotenv()
+    return ModelRouter(
+        max_iterations=max_iterations,
+        prompt_cache_key=os.getenv("PROMPT_CACHE_KEY", DEFAULT_PROMPT_CACHE_KEY) or None,
+    )
@@ -8,7 +8,7 @@
 
 from typing import List
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, create_model
 
 
 class Reflection(BaseModel):
@@ -41,3 +41,46 @@ class ReviseAnswer(AnswerQuestion):
     reference: List[str] = Field(
         description="Citations motivating your updated answer."
     )
+
+
+# with speculative search (speculation.py) the model is bound to these
+# variants instead: the same tool name and fields, with search_queries first.
+# the model generates the fields in order, so the queries can be searched
+# while the answer is still being written; the price is that they are chosen
+# before the model has written the answer and its critique
+QUERIES_FIRST_DESCRIPTION = (
+    "1-3 search queries for researching the question and improvements that address "
+    "the critique of your previous answer, if any."
+)
+
+
+def queries_first(schema):
+    """`schema` under the same name, with search_queries as its first field."""
+    fields = schema.model_fields
+    return create_model(
+        schema.__name__,
+        __doc__=schema.__doc__,
+        search_queries=(List[str], Field(description=QUERIES_FIRST_DESCRIPTION)),
+        **{n: (f.annotation, f) for n, f in fields.items() if n != "search_queries"},
+    )
+
+
+SpeculativeAnswerQuestion = queries_first(AnswerQuestion)
+SpeculativeReviseAnswer = queries_first(ReviseAnswer)
+
+
+# the planner of the sectioned research mode (sections.py) splits a broad
+# question into sections, each of which gets its own draft/search/revise loop
+class Section(BaseModel):
+    title: str = Field(description="Short heading of the section.")
+    question: str = Field(
+        description="Self-contained research question this section answers."
+    )
+
+
+class SectionPlan(BaseModel):
+    """Split the question into sections that can be researched independently."""
+
+    sections: List[Section] = Field(
+        description="2-4 non-overlapping sections that together answer the question."
+    )
@@ -0,0 +1,190 @@
+# this file holds a two-tier cache for Tavily search results
+# 1. memory tier: a small LRU dict, so repeated queries within a run are free
+# 2. disk tier: a SQLite table, so repeated queries across runs are free too
+# both tiers share the same key (normalized query text + max_results),
+# expire entries after a TTL and are bounded in size.
+# the tiers themselves live in TieredCache, which llm_cache.py reuses.
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+DEFAULT_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", ".cache/search_cache.sqlite")
+DEFAULT_TTL_SECONDS = 24 * 60 * 60  # search results go stale, keep them for a day
+DEFAULT_MAX_MEMORY_ENTRIES = 256
+DEFAULT_MAX_DISK_ENTRIES = 10_000
+
+SQLITE_BUSY_TIMEOUT_SECONDS = 30.0
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+# every SQLite store opens its file the same way: in WAL mode readers don't
+# block the writer, so several worker processes (workers.py) can share one
+# file, and a concurrent write waits for the lock instead of failing
+def open_db(path: str) -> sqlite3.Connection:
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")  # durable enough in WAL mode, and much faster
+    return db
+
+
+def normalize_query(query: str) -> str:
+    """Collapse trivially re-worded queries onto the same cache key."""
+    # "AI-powered SOC startups?" and "ai powered  soc startups" hit the same key.
+    # the word order is kept: "X acquired Y" and "Y acquired X" are different searches
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return " ".join(text.split())
+
+
+class TieredCache:
+    """LRU memory tier in front of a SQLite disk tier, both with TTL expiry."""
+
+    table = "cache"  # subclasses get their own SQLite table
+
+    def __init__(
+        self,
+        path: Optional[str],
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+        max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+        # ToolNode runs tool calls in a thread pool, so guard both tiers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        # path=None keeps the cache in memory only
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = open_db(path)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_created_at "
+                f"ON {self.table} (created_at)"
+            )
+            self._db.commit()
+
+    def lookup(self, key: str) -> Optional[Any]:
+        """Return the cached value, or None on a miss / expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value_json, created_at = row
+                    if now - created_at <= self.ttl_seconds:
+                        value = json.loads(value_json)
+                        self._remember(key, created_at, value)  # promote to memory
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def store(self, key: str, value: Any) -> None:
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, value)
+            if self._db is not None:
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO {self.table} (key, value, created_at) "
+                    "VALUES (?, ?, ?)",
+                    (key, json.dumps(value), created_at),
+                )
+                self._evict_disk(created_at)
+                self._db.commit()
+
+    def _remember(self, key: str, created_at: float, value: Any) -> None:
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)  # drop the least recently used entry
+            self.evictions += 1
+
+    def _evict_disk(self, now: float) -> None:
+        # first drop everything past its TTL, then the oldest rows over the bound
+        self._db.execute(
+            f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl_seconds,)
+        )
+        (count,) = self._db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY created_at LIMIT ?)",
+                (overflow,),
+            )
+            self.evictions += overflow
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute(f"DELETE FROM {self.table}")
+                self._db.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SearchCache(TieredCache):
+    """Tavily results keyed by normalized query text + max_results."""
+
+    table = "search_cache"
+
+    def __init__(self, path: Optional[str] = DEFAULT_CACHE_PATH, **kwargs):
+        super().__init__(path, **kwargs)
+
+    @staticmethod
+    def make_key(query: str, max_results: int) -> str:
+        return f"{max_results}:{normalize_query(query)}"
+
+    def get(self, query: str, max_results: int) -> Optional[Any]:
+        """Return the cached result, or None on a miss / expired entry."""
+        return self.lookup(self.make_key(query, max_results))
+
+    def set(self, query: str, max_results: int, value: Any) -> None:
+        self.store(self.make_key(query, max_results), value)
@@ -0,0 +1,313 @@
+# this file holds a local document store + index over every Tavily result we fetched
+# tool_executor asks it before going to Tavily: when the local hits cover the
+# query well enough and are fresh enough, the search is answered locally
+# (no network, well under a millisecond for BM25), otherwise Tavily is called
+# and its results are ingested for next time.
+# 1. documents: one row per URL (title, content, fetched_at) in SQLite, so the
+#    index survives restarts; fetching a URL again refreshes it
+# 2. BM25 over title + content, as an in-memory inverted index
+# 3. optional embedding vectors (any langchain Embeddings), used to re-rank the
+#    BM25 candidates and as a second "good enough" signal
+# 4. bounded: every ingest drops the expired documents and the oldest ones past
+#    max_documents, popped from a heap ordered by fetch time (no full sort)
+#
+# usage: SearchIndex().search("ai soc startups", k=5) -> Tavily-shaped payload or None
+
+import heapq
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from search_cache import open_db
+
+DEFAULT_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", ".cache/search_index.sqlite")
+DEFAULT_MAX_AGE_SECONDS = 7 * 24 * 60 * 60  # older documents don't answer searches
+DEFAULT_MAX_DOCUMENTS = 50_000
+RERANK_CANDIDATES = 50  # BM25 hits that get an embedding similarity
+
+# BM25 parameters, the usual defaults
+K1 = 1.2
+B = 0.75
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have how in is it its of on or that "
+    "the this to was were what when where which who why will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return [
+        token
+        for token in _TOKEN.findall(text)
+        if len(token) > 1 and token not in STOPWORDS
+    ]
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class Document:
+    url: str
+    title: str
+    content: str
+    fetched_at: float
+    vector: Optional[List[float]] = None
+
+
+class SearchIndex:
+    """BM25 (+ optional embeddings) over previously fetched search results."""
+
+    def __init__(
+        self,
+        path: Optional[str] = DEFAULT_INDEX_PATH,
+        embeddings=None,
+        max_age_seconds: float = DEFAULT_MAX_AGE_SECONDS,
+        max_documents: int = DEFAULT_MAX_DOCUMENTS,
+        min_results: int = 3,
+        min_coverage: float = 0.75,
+        min_similarity: float = 0.8,
+    ):
+        # the thresholds decide when local recall is good enough:
+        # at least min_results fresh documents, and on average they contain
+        # min_coverage of the query terms (or, with embeddings, all of them
+        # are at least min_similarity close to the query)
+        self.embeddings = embeddings
+        self.max_age_seconds = max_age_seconds
+        self.max_documents = max_documents
+        self.min_results = min_results
+        self.min_coverage = min_coverage
+        self.min_similarity = min_similarity
+        self._documents: Dict[str, Document] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {url: term frequency}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+        # (fetched_at, url), oldest first, for eviction; a re-fetched URL leaves
+        # its old entry behind, it's skipped when it comes up
+        self._by_age: List[Tuple[float, str]] = []
+        # ToolNode runs tool calls in a thread pool
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.ingested = 0
+        self.lookup_seconds = 0.0
+
+        # path=None keeps the index in memory only
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            self._db = open_db(path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                "url TEXT PRIMARY KEY, title TEXT NOT NULL, content TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, vector TEXT)"
+            )
+            self._db.execute(
+                "DELETE FROM documents WHERE fetched_at < ?",
+                (time.time() - self.max_age_seconds,),
+            )
+            self._db.commit()
+            for url, title, content, fetched_at, vector in self._db.execute(
+                "SELECT url, title, content, fetched_at, vector FROM documents"
+            ):
+                self._add(
+                    Document(url, title, content, fetched_at, vector and json.loads(vector))
+                )
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    # ── ingestion ──────────────────────────────────────────────────────────
+    def _add(self, document: Document) -> None:
+        self._remove(document.url)
+        tokens = tokenize(f"{document.title} {document.content}")
+        for token in tokens:
+            postings = self._postings.setdefault(token, {})
+            postings[document.url] = postings.get(document.url, 0) + 1
+        self._documents[document.url] = document
+        self._lengths[document.url] = len(tokens)
+        self._total_length += len(tokens)
+        heapq.heappush(self._by_age, (document.fetched_at, document.url))
+        if len(self._by_age) > 2 * len(self._documents) + 64:
+            self._by_age = [(d.fetched_at, d.url) for d in self._documents.values()]
+            heapq.heapify(self._by_age)
+
+    def _remove(self, url: str) -> None:
+        document = self._documents.pop(url, None)
+        if document is None:
+            return
+        for token in set(tokenize(f"{document.title} {document.content}")):
+            postings = self._postings[token]
+            del postings[url]
+            if not postings:
+                del self._postings[token]
+        self._total_length -= self._lengths.pop(url)
+
+    def ingest(self, payload: dict) -> int:
+        """Add the results of one Tavily response; returns how many were added."""
+        results = [
+            result
+            for result in (payload or {}).get("results", [])
+            if result.get("url") and result.get("content")
+        ]
+        if not results:
+            return 0
+        vectors: List[Optional[List[float]]] = [None] * len(results)
+        if self.embeddings is not None:
+            vectors = self.embeddings.embed_documents(
+                [f"{result.get('title', '')}\n{result['content']}" for result in results]
+            )
+        fetched_at = time.time()
+        documents = [
+            Document(result["url"], result.get("title", ""), result["content"], fetched_at, vector)
+            for result, vector in zip(results, vectors)
+        ]
+        with self._lock:
+            for document in documents:
+                self._add(document)
+            self.ingested += len(documents)
+            self._evict()
+            if self._db is not None:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO documents "
+                    "(url, title, content, fetched_at, vector) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            d.url,
+                            d.title,
+                            d.content,
+                            d.fetched_at,
+                            json.dumps(d.vector) if d.vector is not None else None,
+                        )
+                        for d in documents
+                    ],
+                )
+                self._db.commit()
+        return len(documents)
+
+    def _evict(self) -> None:
+        """Drop the expired documents, then the oldest ones over max_documents."""
+        expired = time.time() - self.max_age_seconds
+        evicted = []
+        while self._by_age and (
+            len(self._documents) > self.max_documents or self._by_age[0][0] < expired
+        ):
+            fetched_at, url = heapq.heappop(self._by_age)
+            document = self._documents.get(url)
+            if document is None or document.fetched_at != fetched_at:
+                continue  # removed or re-fetched since
+            self._remove(url)
+            evicted.append(url)
+        if evicted and self._db is not None:
+            self._db.executemany("DELETE FROM documents WHERE url = ?", [(url,) for url in evicted])
+
+    # ── search ─────────────────────────────────────────────────────────────
+    def _bm25(self, terms: List[str], oldest: float) -> Dict[str, float]:
+        count = len(self._documents)
+        average_length = self._total_length / count
+        scores: Dict[str, float] = {}
+        for term in set(terms):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for url, frequency in postings.items():
+                if self._documents[url].fetched_at < oldest:
+                    continue  # too old to answer a search
+                length_norm = 1 - B + B * self._lengths[url] / average_length
+                scores[url] = scores.get(url, 0.0) + idf * frequency * (K1 + 1) / (
+                    frequency + K1 * length_norm
+                )
+        return scores
+
+    def _coverage(self, terms: set, url: str) -> float:
+        return sum(url in self._postings.get(term, ()) for term in terms) / len(terms)
+
+    def search(self, query: str, k: int = 5) -> Optional[dict]:
+        """Tavily-shaped results if the local index can answer `query`, else None."""
+        start = time.perf_counter()
+        terms = tokenize(query)
+        query_vector = None
+        if terms and self.embeddings is not None and self._documents:
+            query_vector = self.embeddings.embed_query(query)  # network call, not under the lock
+        with self._lock:
+            payload = None
+            if terms and self._documents:
+                payload = self._search(query, terms, k, query_vector)
+            if payload is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self.lookup_seconds += time.perf_counter() - start
+            return payload
+
+    def _search(
+        self, query: str, terms: List[str], k: int, query_vector: Optional[List[float]]
+    ) -> Optional[dict]:
+        scores = self._bm25(terms, oldest=time.time() - self.max_age_seconds)
+        if len(scores) < self.min_results:
+            return None
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        unique_terms = set(terms)
+
+        similar = False
+        if query_vector is not None:
+            # re-rank the best BM25 candidates by a blend of both scores
+            candidates = ranked[:RERANK_CANDIDATES]
+            similarity = {
+                url: _cosine(query_vector, self._documents[url].vector)
+                for url in candidates
+                if self._documents[url].vector is not None
+            }
+            top_score = scores[ranked[0]]
+            ranked = sorted(
+                candidates,
+                key=lambda url: 0.5 * scores[url] / top_score + 0.5 * similarity.get(url, 0.0),
+                reverse=True,
+            )
+            similar = all(
+                similarity.get(url, 0.0) >= self.min_similarity
+                for url in ranked[: self.min_results]
+            )
+
+        top = ranked[:k]
+        coverage = sum(self._coverage(unique_terms, url) for url in top) / len(top)
+        if len(top) < self.min_results or (coverage < self.min_coverage and not similar):
+            return None
+        top_score = scores[ranked[0]]
+        return {
+            "query": query,
+            "source": "local_index",
+            "results": [
+                {
+                    "url": url,
+                    "title": self._documents[url].title,
+                    "content": self._documents[url].content,
+                    "score": round(scores[url] / top_score, 3),
+                    "fetched_at": self._documents[url].fetched_at,
+                }
+                for url in top
+            ],
+        }
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "documents": len(self._documents),
+            "hits": self.hits,
+            "misses": self.misses,
+            "ingested": self.ingested,
+            "hit_rate": self.hits / total if total else 0.0,
+            "mean_lookup_ms": 1000 * self.lookup_seconds / total if total else 0.0,
+        }
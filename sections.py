@@ -0,0 +1,202 @@
+# this file holds the sectioned (map-reduce) research mode for long-form answers
+# the default graph runs one linear draft -> search -> revise loop on a ~250
+# word answer, so a broad topic is either shallow or needs many serial rounds.
+# here the question is split up first:
+# 1. plan:     one LLM call (chains.build_planner) splits the question into
+#              at most MAX_SECTIONS independent sections
+# 2. research: every section runs through the normal Reflexion graph
+#              (main.build_graph), all of them in parallel with abatch(), so
+#              the whole step takes about as long as the slowest section
+# 3. merge:    no LLM call, the section answers are joined under their
+#              headings, and their references are deduplicated (by normalized
+#              URL) and renumbered, with the inline [n] citations rewritten
+# the last message is a ReviseAnswer tool call like in the default graph, so
+# printing, streaming, batch.py and the answer cache work the same.
+#
+# usage: python main.py --sections "Write about the AI-powered SOC market"
+
+import re
+from functools import cache
+from typing import Any, Dict, List, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.constants import END
+
+from dedup import normalize_url
+
+MAX_SECTIONS = 4
+
+_REFERENCES_HEADING = re.compile(
+    r"\n[ \t>#*_-]*references?[ \t*_]*:?[ \t*_]*\n.*\Z", re.IGNORECASE | re.DOTALL
+)
+_NUMBERED_REFERENCE = re.compile(r"^\s*[-*]?\s*\[(\d+)\]\s*[:.-]?\s*(.*)$")
+_CITATION = re.compile(r"\[(\d+(?:\s*,\s*\d+)*)\]")
+_URL = re.compile(r"https?://\S+")
+
+
+def strip_references(answer: str) -> str:
+    """The answer without a trailing "References" list (the reviser is asked for one)."""
+    return _REFERENCES_HEADING.sub("", answer).rstrip()
+
+
+def _parse_reference(position: int, reference: str) -> Tuple[int, str]:
+    """(number the section cited it by, reference text without the number)."""
+    match = _NUMBERED_REFERENCE.match(reference)
+    if match:
+        return int(match.group(1)), match.group(2).strip()
+    return position, reference.strip()
+
+
+def _reference_key(text: str) -> str:
+    url = _URL.search(text)
+    return normalize_url(url.group(0).rstrip(".,;)")) if url else text.casefold()
+
+
+def merge_sections(sections: List[dict], answers: List[dict]) -> dict:
+    """Join section answers into one ReviseAnswer, with one renumbered reference list.
+
+    `sections` are the planner's {"title", "question"}, `answers` the final
+    ReviseAnswer arguments of every section, in the same order.
+    """
+    merged_references: List[str] = []
+    numbers: Dict[str, int] = {}  # reference key -> number in the merged answer
+    parts, queries = [], []
+    for section, args in zip(sections, answers):
+        renumber: Dict[int, int] = {}
+        for position, reference in enumerate(args.get("reference") or [], start=1):
+            cited_as, text = _parse_reference(position, reference)
+            key = _reference_key(text)
+            if key not in numbers:
+                merged_references.append(text)
+                numbers[key] = len(merged_references)
+            renumber[cited_as] = numbers[key]
+
+        def rewrite(match: re.Match) -> str:
+            cited = [int(number) for number in re.split(r"\s*,\s*", match.group(1))]
+            # a number without a reference would point at another section's source
+            resolved = [str(renumber[number]) for number in cited if number in renumber]
+            return "[" + ", ".join(resolved) + "]" if resolved else ""
+
+        body = _CITATION.sub(rewrite, strip_references(str(args.get("answer", ""))))
+        parts.append(f"## {section['title']}\n\n{body}")
+        queries.extend(args.get("search_queries") or [])
+
+    references = [f"[{i}] {text}" for i, text in enumerate(merged_references, start=1)]
+    answer = "\n\n".join(parts)
+    if references:
+        answer += "\n\n## References\n\n" + "\n".join(f"- {line}" for line in references)
+    return {
+        "answer": answer,
+        "reflection": {
+            kind: " ".join((args.get("reflection") or {}).get(kind, "") for args in answers).strip()
+            for kind in ("missing", "superfluous")
+        },
+        "search_queries": queries,
+        "reference": references,
+    }
+
+
+def _question(messages: List[BaseMessage]) -> str:
+    return next(message.content for message in messages if isinstance(message, HumanMessage))
+
+
+def _plan(message: AIMessage, max_sections: int) -> List[dict]:
+    sections = message.tool_calls[0]["args"].get("sections") or []
+    return [dict(section) for section in sections[:max_sections]]
+
+
+def _final_args(messages: List[BaseMessage]) -> dict:
+    return next(
+        message.tool_calls[0]["args"]
+        for message in reversed(messages)
+        if isinstance(message, AIMessage) and message.tool_calls
+    )
+
+
+def _merged_message(sections: List[dict], results: List[Any]) -> AIMessage:
+    # a failed section is left out of the answer rather than failing the question
+    done = [
+        (section, _final_args(result))
+        for section, result in zip(sections, results)
+        if not isinstance(result, Exception)
+    ]
+    if not done:
+        raise next(result for result in results if isinstance(result, Exception))
+    args = merge_sections([section for section, _ in done], [answer for _, answer in done])
+    return AIMessage(
+        content="",
+        tool_calls=[{"name": "ReviseAnswer", "args": args, "id": "merge_sections"}],
+    )
+
+
+# the graph takes the same keyword arguments as main.build_graph (llm,
+# search_tool, search_cache, schedulers, ...); they configure the planner and
+# every section's loop. the sections run without a checkpointer of their own
+# (the outer graph checkpoints after plan and after research) and without the
+# answer cache. pass an AnswerCache with its own path to reuse whole sectioned
+# answers: they are much longer than the ones the default graph stores.
+def build_sectioned_graph(
+    llm=None,
+    max_sections: int = MAX_SECTIONS,
+    answer_cache=None,
+    checkpointer=None,
+    **graph_kwargs,
+):
+    from langgraph.graph import MessageGraph  # heavy import, keep it off the startup path
+
+    from answer_cache import is_cached_answer
+    from chains import build_planner
+    from main import build_graph
+
+    planner = build_planner(llm, graph_kwargs.get("llm_scheduler"))
+    section_graph = build_graph(llm=llm, checkpointer=False, answer_cache=False, **graph_kwargs)
+
+    def planner_input(messages: List[BaseMessage]) -> dict:
+        return {"messages": [HumanMessage(_question(messages))], "max_sections": max_sections}
+
+    def plan(messages: List[BaseMessage], config: RunnableConfig) -> AIMessage:
+        return planner.invoke(planner_input(messages), config)
+
+    async def aplan(messages: List[BaseMessage], config: RunnableConfig) -> AIMessage:
+        return await planner.ainvoke(planner_input(messages), config)
+
+    def merge(messages: List[BaseMessage], sections: List[dict], results: List[Any]) -> AIMessage:
+        merged = _merged_message(sections, results)
+        if answer_cache:
+            answer_cache.remember(messages + [merged])
+        return merged
+
+    def research(messages: List[BaseMessage], config: RunnableConfig) -> AIMessage:
+        sections = _plan(messages[-1], max_sections)
+        results = section_graph.batch(
+            [section["question"] for section in sections], config, return_exceptions=True
+        )
+        return merge(messages, sections, results)
+
+    async def aresearch(messages: List[BaseMessage], config: RunnableConfig) -> AIMessage:
+        sections = _plan(messages[-1], max_sections)
+        results = await section_graph.abatch(
+            [section["question"] for section in sections], config, return_exceptions=True
+        )
+        return merge(messages, sections, results)
+
+    builder = MessageGraph()
+    builder.add_node("plan", RunnableLambda(plan, afunc=aplan, name="plan"))
+    builder.add_node("research", RunnableLambda(research, afunc=aresearch, name="research"))
+    builder.add_edge("plan", "research")
+    builder.add_edge("research", END)
+    if answer_cache:
+        builder.add_node("answer_cache", answer_cache.lookup_node)
+        builder.add_conditional_edges(
+            "answer_cache",
+            lambda state: END if is_cached_answer(state) else "plan",
+            {END: END, "plan": "plan"},
+        )
+    builder.set_entry_point("answer_cache" if answer_cache else "plan")
+    return builder.compile(checkpointer=checkpointer)
+
+
+@cache
+def get_sectioned_graph():
+    return build_sectioned_graph()
@@ -0,0 +1,297 @@
+# long-running HTTP service around the reflexion graph
+# the graph (and the OpenAI / Tavily clients behind it, with their pooled
+# HTTP connections) is built once at startup and shared by every request.
+#
+# endpoints:
+#   POST /questions              {"question": "..."} -> 202 {"id", "status", "coalesced"}
+#   GET  /questions/{id}         poll: status, partial_answer while running, answer/references once done
+#   GET  /questions/{id}/stream  NDJSON stream of the run's events (see streaming.py)
+#   GET  /health                 job counters
+#
+# identical questions that are still in flight are coalesced: the second
+# caller gets the id of the running job and shares its graph execution.
+# "identical" ignores case and punctuation, not word order: "Compare A to B"
+# and "Compare B to A" are different questions.
+# the stream's answer_delta events carry only the appended text (a job keeps
+# every event for late subscribers); the "final" event has the whole answer.
+# the server is plain asyncio (no web framework dependency), HTTP/1.1 with
+# one request per connection.
+#
+# usage: python server.py [--port 8000] [--concurrency 4] [--stub]
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from typing import Dict, List, Optional, Set
+
+from rich.console import Console
+
+from answer_cache import normalize_question
+from main import MAX_CONCURRENCY, build_graph, get_graph
+from streaming import astream_events
+
+MAX_FINISHED_JOBS = 1_000  # finished jobs kept around for polling
+MAX_BODY_BYTES = 64 * 1024
+
+console = Console()
+
+
+@dataclass
+class Job:
+    id: str
+    question: str
+    status: str = "queued"  # queued -> running -> done | failed
+    events: List[dict] = field(default_factory=list)
+    partial_answer: str = ""  # the answer so far, while the job is running
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    subscribers: int = 1  # callers sharing this job (coalesced duplicates)
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def add_event(self, event: dict) -> None:
+        if event["event"] == "answer_delta":
+            # the snapshot in every delta would make the stored events grow
+            # quadratically with the answer; keep the latest one only
+            event = dict(event)
+            self.partial_answer = event.pop("answer")
+        self.events.append(event)
+        # wake up every stream reader, then re-arm for the next event
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def view(self) -> dict:
+        view = {
+            "id": self.id,
+            "question": self.question,
+            "status": self.status,
+            "subscribers": self.subscribers,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+        if self.result is not None:
+            view.update(self.result)
+        elif self.partial_answer:
+            view["partial_answer"] = self.partial_answer
+        if self.error is not None:
+            view["error"] = self.error
+        return view
+
+
+class ReflexionService:
+    """Job registry + runner; the HTTP layer below only translates requests."""
+
+    def __init__(self, graph, concurrency: int = MAX_CONCURRENCY):
+        self.graph = graph
+        self.slots = asyncio.Semaphore(concurrency)
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self.in_flight: Dict[str, Job] = {}  # normalized question -> running job
+        self.coalesced = 0
+        # the event loop only keeps weak references to tasks, a running job
+        # must not be garbage-collected halfway
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, question: str) -> tuple[Job, bool]:
+        key = normalize_question(question)
+        job = self.in_flight.get(key)
+        if job is not None:
+            job.subscribers += 1
+            self.coalesced += 1
+            return job, True
+        job = Job(id=uuid.uuid4().hex, question=question)
+        self.jobs[job.id] = job
+        self.in_flight[key] = job
+        task = asyncio.create_task(self._run(job, key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job, False
+
+    async def _run(self, job: Job, key: str) -> None:
+        try:
+            async with self.slots:
+                job.status = "running"
+                async for event in astream_events(self.graph, job.question):
+                    job.add_event(event)
+                    if event["event"] == "final":
+                        job.result = {
+                            "answer": event["answer"],
+                            "references": event["references"],
+                        }
+            job.status = "done"
+        except Exception as error:
+            job.status = "failed"
+            job.error = repr(error)
+            job.add_event({"event": "error", "error": job.error})
+        finally:
+            job.finished_at = time.time()
+            self.in_flight.pop(key, None)
+            job.add_event({"event": "end", "status": job.status})
+            self._trim()
+
+    def _trim(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def health(self) -> dict:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "status": "ok",
+            "jobs": statuses,
+            "in_flight": len(self.in_flight),
+            "coalesced": self.coalesced,
+        }
+
+
+# ── minimal HTTP/1.1 layer ──────────────────────────────────────────────────
+async def _read_request(reader: asyncio.StreamReader):
+    request_line = (await reader.readline()).decode("latin-1").strip()
+    if not request_line:
+        return None
+    method, target, _ = request_line.split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        raise ValueError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return method, target.split("?", 1)[0], body
+
+
+def _response(status: HTTPStatus, payload: dict) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    head = (
+        f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode() + body
+
+
+async def _stream(writer: asyncio.StreamWriter, job: Job) -> None:
+    writer.write(
+        b"HTTP/1.1 200 OK\r\n"
+        b"Content-Type: application/x-ndjson\r\n"
+        b"Transfer-Encoding: chunked\r\n"
+        b"Connection: close\r\n\r\n"
+    )
+    sent = 0
+    while True:
+        changed = job.changed  # grab it before reading, so no event is missed
+        for event in job.events[sent:]:
+            line = (json.dumps(event, ensure_ascii=False) + "\n").encode()
+            writer.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+        sent = len(job.events)
+        await writer.drain()
+        if job.finished_at is not None and sent == len(job.events):
+            break
+        await changed.wait()
+    writer.write(b"0\r\n\r\n")
+
+
+def make_handler(service: ReflexionService):
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await _read_request(reader)
+            if request is None:
+                return
+            method, path, body = request
+            parts = [part for part in path.split("/") if part]
+
+            if method == "GET" and parts == ["health"]:
+                writer.write(_response(HTTPStatus.OK, service.health()))
+            elif method == "POST" and parts == ["questions"]:
+                try:
+                    question = json.loads(body or b"{}").get("question")
+                except (json.JSONDecodeError, AttributeError):
+                    question = None
+                if not isinstance(question, str) or not question.strip():
+                    writer.write(
+                        _response(HTTPStatus.BAD_REQUEST, {"error": "'question' is required"})
+                    )
+                else:
+                    job, coalesced = service.submit(question)
+                    writer.write(
+                        _response(
+                            HTTPStatus.ACCEPTED,
+                            {"id": job.id, "status": job.status, "coalesced": coalesced},
+                        )
+                    )
+            elif method == "GET" and len(parts) in (2, 3) and parts[0] == "questions":
+                job = service.jobs.get(parts[1])
+                if job is None:
+                    writer.write(_response(HTTPStatus.NOT_FOUND, {"error": "unknown id"}))
+                elif len(parts) == 3 and parts[2] == "stream":
+                    await _stream(writer, job)
+                else:
+                    writer.write(_response(HTTPStatus.OK, job.view()))
+            else:
+                writer.write(_response(HTTPStatus.NOT_FOUND, {"error": "not found"}))
+            await writer.drain()
+        except (ValueError, asyncio.IncompleteReadError) as error:
+            writer.write(_response(HTTPStatus.BAD_REQUEST, {"error": str(error)}))
+        except ConnectionError:
+            pass  # the client went away, the job keeps running
+        finally:
+            writer.close()
+
+    return handle
+
+
+async def serve(host: str, port: int, graph, concurrency: int) -> None:
+    service = ReflexionService(graph, concurrency)
+    server = await asyncio.start_server(make_handler(service), host, port)
+    console.log(f"reflexion service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Reflexion Agent HTTP service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--concurrency", type=int, default=MAX_CONCURRENCY)
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help="use the local stub LLM / search backends (load tests, no API keys)",
+    )
+    parser.add_argument("--stub-latency", type=float, default=0.2, help="seconds")
+    args = parser.parse_args()
+
+    if args.stub:
+        from rate_limit import Scheduler
+        from search_cache import SearchCache
+        from search_index import SearchIndex
+        from stubs import StubChatModel, StubSearch
+
+        graph = build_graph(
+            llm=StubChatModel(latency=args.stub_latency),
+            search_tool=StubSearch(latency=args.stub_latency / 2),
+            search_cache=SearchCache(path=None),
+            search_index=SearchIndex(path=None),
+            llm_scheduler=Scheduler("stub_llm"),
+            search_scheduler=Scheduler("stub_search"),
+            answer_cache=False,  # the load test repeats questions, measure the full loop
+        )
+    else:
+        graph = get_graph()  # compiled once, shared by every request
+    asyncio.run(serve(args.host, args.port, graph, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
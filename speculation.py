@@ -0,0 +1,260 @@
+# this file holds speculative search: queries start while the model is still writing
+# execute_tools used to wait for the complete AnswerQuestion / ReviseAnswer tool
+# call, answer included, before sending a single query to Tavily. now the draft
+# and reviser calls are streamed, and:
+# 1. PartialQueries decodes the `search_queries` array out of the streamed
+#    tool-call JSON, and hands over each query as soon as its string is closed
+# 2. SpeculativeSearch starts that query right away (through the same cache,
+#    local index, rate limiter and deadlines as execute_tools), per graph run
+# 3. execute_tools takes the speculative searches of its queries and only
+#    searches what wasn't started yet, so the results are (nearly) ready when
+#    the model finishes
+# search_queries is the first field of the schemas (schemas.py), so the
+# queries are complete before the ~250 word answer is generated.
+# a revision after which the loop ends anyway (max iterations reached, or the
+# stopping policy already says stop) is not speculated on: nobody would read
+# its searches. a revision that only turns out to be the last one by what it
+# says (converged answer, no new queries) still is; those searches show up as
+# "unused" in stats(). SPECULATIVE_SEARCH=0 turns it off.
+
+import asyncio
+import contextvars
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+from search_cache import normalize_query
+
+_QUERIES_KEY = re.compile(r'(?<!\\)"search_queries"\s*:\s*\[')
+
+
+def _string_end(buffer: str, start: int) -> Optional[int]:
+    """Index after the closing quote of the JSON string at `start`, None if still open."""
+    i = start + 1
+    while i < len(buffer):
+        if buffer[i] == "\\":
+            i += 2
+        elif buffer[i] == '"':
+            return i + 1
+        else:
+            i += 1
+    return None
+
+
+class PartialQueries:
+    """Incrementally decode the "search_queries" array out of streamed tool-call JSON."""
+
+    def __init__(self):
+        self.buffer = ""
+        self.queries: List[str] = []
+        self.done = False
+        self._pos: Optional[int] = None  # where the next undecoded array element starts
+
+    def feed(self, fragment: str) -> List[str]:
+        """Add a fragment of the arguments, return the queries completed by it."""
+        self.buffer += fragment
+        if self.done:
+            return []
+        if self._pos is None:
+            match = _QUERIES_KEY.search(self.buffer)
+            if match is None:
+                return []
+            self._pos = match.end()
+        new = []
+        pos, buffer = self._pos, self.buffer
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char in " \t\r\n,":
+                pos += 1
+            elif char == '"':
+                end = _string_end(buffer, pos)
+                if end is None:
+                    break  # the rest of this query is in a later chunk
+                new.append(json.loads(buffer[pos:end]))
+                pos = end
+            else:
+                self.done = True  # "]" (or anything unexpected) ends the array
+                break
+        self._pos = pos
+        self.queries.extend(new)
+        return new
+
+
+class QueryStreamHandler(BaseCallbackHandler):
+    """Feeds the streamed tool-call chunks of one model call into PartialQueries.
+
+    Having tap_output_iter/tap_output_aiter makes it a streaming handler for
+    langchain, so the model streams even when the chain is invoked.
+    """
+
+    run_inline = True  # keep chunks in order, and on the event loop for async runs
+
+    def __init__(self, on_query: Callable[[str], None]):
+        self.on_query = on_query
+        self.partial = PartialQueries()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs) -> None:
+        self.partial = PartialQueries()  # a retry starts the JSON from scratch
+
+    def on_llm_new_token(self, token: str, *, chunk=None, **kwargs) -> None:
+        message = getattr(chunk, "message", None)
+        fragment = "".join(
+            tool_call_chunk.get("args") or ""
+            for tool_call_chunk in getattr(message, "tool_call_chunks", None) or []
+        )
+        for query in self.partial.feed(fragment):
+            self.on_query(query)
+
+    def tap_output_iter(self, run_id, output: Iterator) -> Iterator:
+        return output
+
+    def tap_output_aiter(self, run_id, output):
+        return output
+
+
+def _run_key(messages: Sequence[BaseMessage]) -> str:
+    # keyed like stopping.ConvergenceTracker / dedup.DedupRegistry
+    return messages[0].id if messages and messages[0].id else str(id(messages))
+
+
+# threads for the blocking path; the searches themselves run with deadlines
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="speculative_search")
+
+
+class SpeculativeSearch:
+    """Searches started from the streamed tool call, waiting for execute_tools.
+
+    `run` / `arun` search a single query and return its payload; they are set
+    by tool_executor.build_execute_tools, so speculative searches go through
+    the same cache, index, scheduler and deadlines as the regular ones.
+    """
+
+    def __init__(self, max_runs: int = 1024):
+        self.max_runs = max_runs
+        self.run: Optional[Callable[[str], Any]] = None
+        self.arun: Optional[Callable[[str], Awaitable[Any]]] = None
+        self._pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "used": 0, "unused": 0, "failed": 0}
+
+    def start(self, key: str, query: str) -> None:
+        if self.run is None:
+            return  # not wired to an execute_tools node
+        normalized = normalize_query(query)
+        with self._lock:
+            pending = self._pending.setdefault(key, {})
+            self._pending.move_to_end(key)
+            if normalized in pending:
+                return
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if loop is not None and self.arun is not None:
+                pending[normalized] = loop.create_task(self.arun(query))
+            else:
+                context = contextvars.copy_context()
+                pending[normalized] = _executor.submit(context.run, self.run, query)
+            self.counters["started"] += 1
+            while len(self._pending) > self.max_runs:
+                # a finished run: its last revision's queries were never taken
+                _, dropped = self._pending.popitem(last=False)
+                self.counters["unused"] += len(dropped)
+
+    def take(self, messages: Sequence[BaseMessage], queries: List[str]) -> Dict[int, Any]:
+        """Hand the searches of `queries` over ({index: future or task}).
+
+        Whatever else was started for this run is dropped: the model didn't
+        ask for it in the end (its result still went to the search cache).
+        """
+        with self._lock:
+            pending = self._pending.pop(_run_key(messages), {})
+        taken = {}
+        for i, query in enumerate(queries):
+            search = pending.pop(normalize_query(query), None)
+            if search is not None:
+                taken[i] = search
+        with self._lock:
+            self.counters["used"] += len(taken)
+            self.counters["unused"] += len(pending)
+        return taken
+
+    def collect(self, taken: Dict[int, Future]) -> Dict[int, Any]:
+        """Wait for the speculative searches; failed ones are left out."""
+        results = {}
+        for i, future in taken.items():
+            try:
+                results[i] = future.result()
+            except Exception:
+                self._failed()
+        return results
+
+    async def acollect(self, taken: Dict[int, Any]) -> Dict[int, Any]:
+        results = {}
+        for i, search in taken.items():
+            try:
+                results[i] = await (
+                    asyncio.wrap_future(search) if isinstance(search, Future) else search
+                )
+            except Exception:
+                self._failed()
+        return results
+
+    def _failed(self) -> None:
+        with self._lock:
+            self.counters["failed"] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+
+def default_speculator():
+    """A SpeculativeSearch for a new graph, or False if SPECULATIVE_SEARCH=0."""
+    load_dotenv()
+    return SpeculativeSearch() if os.getenv("SPECULATIVE_SEARCH", "1") != "0" else False
+
+
+def _with_handler(config: RunnableConfig, handler: BaseCallbackHandler) -> RunnableConfig:
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    else:
+        callbacks = [*(callbacks or []), handler]
+    return {**config, "callbacks": callbacks}
+
+
+def speculative(
+    chain,
+    speculator: SpeculativeSearch,
+    final: Optional[Callable[[Sequence[BaseMessage]], bool]] = None,
+):
+    """Wrap the draft / reviser chain so its queries start while it streams.
+
+    `final(messages)` says whether the loop ends after this call anyway
+    (e.g. stopping.ConvergenceTracker.will_stop); then nothing is started.
+    """
+
+    def with_handler(messages: Sequence[BaseMessage], config: RunnableConfig) -> RunnableConfig:
+        if final is not None and final(messages):
+            return config
+        key = _run_key(messages)
+        return _with_handler(config, QueryStreamHandler(lambda query: speculator.start(key, query)))
+
+    def invoke(messages, config: RunnableConfig):
+        return chain.invoke(messages, with_handler(messages, config))
+
+    async def ainvoke(messages, config: RunnableConfig):
+        return await chain.ainvoke(messages, with_handler(messages, config))
+
+    return RunnableLambda(invoke, afunc=ainvoke, name="speculative_search")
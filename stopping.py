@@ -0,0 +1,198 @@
+# this file holds the stopping policies for the reviser ⇄ execute_tools loop
+# instead of always running MAX_ITERATIONS rounds, the loop stops as soon as
+# one of the signals says another round won't help:
+# 1. the answer stopped changing between two revisions
+# 2. the critique has nothing (new) to say about what is missing
+# 3. the reviser only asks for searches it has already run
+# 4. the run is over its wall-clock or token budget
+# MAX_ITERATIONS stays as the hard upper bound.
+
+import difflib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional, Protocol, Sequence, Set
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langgraph.constants import END
+
+from search_cache import normalize_query
+
+# critiques that mean "nothing is missing"
+_EMPTY_CRITIQUES = {"", "none", "nothing", "n/a", "na", "nothing is missing"}
+
+
+@dataclass
+class IterationState:
+    """What we know about one run, updated incrementally from new messages."""
+
+    started_at: float = field(default_factory=time.monotonic)
+    iterations: int = 0  # search rounds so far, i.e. ToolMessages seen
+    answers: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+    last_queries: List[str] = field(default_factory=list)
+    last_queries_new: bool = True  # did the latest tool call ask for any new query?
+    seen_queries: Set[str] = field(default_factory=set)
+    total_tokens: int = 0
+    processed: int = 0  # how many messages of the state we have already scanned
+
+    def observe(self, message: BaseMessage) -> None:
+        if isinstance(message, ToolMessage):
+            self.iterations += 1
+        elif isinstance(message, AIMessage) and message.tool_calls:
+            usage = message.usage_metadata or {}
+            self.total_tokens += usage.get("total_tokens", 0)
+            args = message.tool_calls[0]["args"]
+            self.answers.append(str(args.get("answer", "")))
+            reflection = args.get("reflection") or {}
+            if isinstance(reflection, dict):
+                self.missing.append(str(reflection.get("missing", "")))
+            queries = [normalize_query(q) for q in args.get("search_queries") or []]
+            self.last_queries = queries
+            self.last_queries_new = any(q not in self.seen_queries for q in queries)
+            self.seen_queries.update(queries)
+
+
+def answer_similarity(a: str, b: str) -> float:
+    """Normalized similarity (1.0 = identical) based on the edit operations between a and b."""
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+class StoppingPolicy(Protocol):
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        """Return a reason to stop, or None to keep iterating."""
+        ...
+
+
+class MaxIterations:
+    def __init__(self, max_iterations: int):
+        self.max_iterations = max_iterations
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        if state.iterations > self.max_iterations:
+            return f"reached {self.max_iterations} iterations"
+        return None
+
+
+class AnswerConverged:
+    """Stop once two consecutive answers are (almost) the same."""
+
+    def __init__(self, min_similarity: float = 0.97):
+        self.min_similarity = min_similarity
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        if len(state.answers) < 2:
+            return None
+        similarity = answer_similarity(state.answers[-2], state.answers[-1])
+        if similarity >= self.min_similarity:
+            return f"answer converged (similarity {similarity:.2f})"
+        return None
+
+
+class CritiqueExhausted:
+    """Stop when the reflection finds nothing missing, or repeats the last critique."""
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        if len(state.answers) < 2 or not state.missing:
+            return None  # the first draft always gets at least one revision
+        latest = normalize_query(state.missing[-1])
+        if latest in _EMPTY_CRITIQUES:
+            return "critique found nothing missing"
+        if len(state.missing) >= 2 and latest == normalize_query(state.missing[-2]):
+            return "critique repeated"
+        return None
+
+
+class QueriesExhausted:
+    """Stop when the reviser only asks for searches that already ran."""
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        if len(state.answers) >= 2 and not state.last_queries_new:
+            return "no new search queries"
+        return None
+
+
+class TimeBudget:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        if time.monotonic() - state.started_at >= self.seconds:
+            return f"over the {self.seconds:g}s time budget"
+        return None
+
+
+class TokenBudget:
+    def __init__(self, max_tokens: int):
+        self.max_tokens = max_tokens
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        if state.total_tokens >= self.max_tokens:
+            return f"over the {self.max_tokens} token budget"
+        return None
+
+
+class AnyOf:
+    """Stop as soon as any of the policies says so."""
+
+    def __init__(self, *policies: StoppingPolicy):
+        self.policies = policies
+
+    def should_stop(self, state: IterationState) -> Optional[str]:
+        for policy in self.policies:
+            reason = policy.should_stop(state)
+            if reason:
+                return reason
+        return None
+
+
+def _run_key(state: Sequence[BaseMessage]) -> str:
+    # the graph gives every message an id, the first one identifies the run
+    return state[0].id or str(id(state[0]))
+
+
+class ConvergenceTracker:
+    """Conditional edge for the reviser node, backed by a StoppingPolicy.
+
+    Keeps one IterationState per run (keyed by the id of the run's first
+    message) and only scans the messages appended since the previous call.
+    """
+
+    def __init__(self, policy: StoppingPolicy, max_runs: int = 1024):
+        self.policy = policy
+        self.max_runs = max_runs
+        self.stop_reasons: "OrderedDict[str, str]" = OrderedDict()
+        self._runs: "OrderedDict[str, IterationState]" = OrderedDict()
+
+    def update(self, state: Sequence[BaseMessage]) -> IterationState:
+        key = _run_key(state)
+        run = self._runs.get(key)
+        if run is None:
+            run = self._runs[key] = IterationState()
+            # runs that crash never reach END, don't let them pile up
+            while len(self._runs) > self.max_runs:
+                self._runs.popitem(last=False)
+        for message in state[run.processed :]:
+            run.observe(message)
+        run.processed = len(state)
+        return run
+
+    def will_stop(self, state: Sequence[BaseMessage]) -> bool:
+        """Whether the loop ends after the next revision, whatever it says.
+
+        Called before the revision: the iteration count, time and tokens only
+        grow, so a policy that already stops on them will stop after it too.
+        """
+        return bool(self.policy.should_stop(self.update(state)))
+
+    def __call__(self, state: Sequence[BaseMessage]) -> str:
+        run = self.update(state)
+        reason = self.policy.should_stop(run)
+        if reason:
+            key = _run_key(state)
+            self._runs.pop(key, None)
+            self.stop_reasons[key] = reason
+            while len(self.stop_reasons) > self.max_runs:
+                self.stop_reasons.popitem(last=False)
+            return END  # go to END node
+        return "execute_tools"  # go to "execute_tools" node
@@ -0,0 +1,228 @@
+# this file turns a graph run into a stream of small JSON-able events, so the
+# user sees progress (and the answer being written) instead of waiting for
+# graph.invoke() to return after the last iteration.
+# events:
+# 1. {"event": "node_start", "node": ...}         a node started running
+# 2. {"event": "answer_delta", "node": ..., "delta": ..., "answer": ...}
+#    the `answer` tool-call argument grew while the model is still generating
+#    (decoded incrementally from the partial JSON, see PartialAnswer)
+# 3. {"event": "node_end", "node": ..., ...}       a node finished
+# 4. {"event": "final", "answer": ..., "references": [...]}
+# they come from graph.stream(stream_mode=["debug", "messages"]): "debug" gives
+# node start/finish, "messages" gives the LLM token chunks.
+
+import json
+import re
+import sys
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, TextIO
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from rich.console import Console, Group
+from rich.live import Live
+from rich.markdown import Markdown
+from rich.panel import Panel
+from rich.text import Text
+
+STREAM_MODES = ["debug", "messages"]
+ANSWER_NODES = ("draft", "reviser")  # the nodes whose tool calls carry an answer
+
+
+_ANSWER_KEY = re.compile(r'(?<!\\)"answer"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class PartialAnswer:
+    """Incrementally decode the "answer" string out of streamed tool-call JSON.
+
+    Re-parsing the whole partial JSON on every chunk is quadratic in the
+    length of the arguments; this only looks at the characters that are new.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.answer = ""
+        self.done = False
+        self._pos: Optional[int] = None  # where the next undecoded answer char is
+
+    def feed(self, fragment: str) -> str:
+        """Add a fragment of the arguments, return the newly decoded answer text."""
+        self.buffer += fragment
+        if self.done:
+            return ""
+        if self._pos is None:
+            match = _ANSWER_KEY.search(self.buffer)
+            if match is None:
+                return ""
+            self._pos = match.end()
+        decoded = []
+        pos, buffer = self._pos, self.buffer
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                self.done = True
+                pos += 1
+                break
+            if char != "\\":
+                decoded.append(char)
+                pos += 1
+                continue
+            # an escape sequence, wait for more input if it's cut in half
+            if pos + 1 >= len(buffer):
+                break
+            code = buffer[pos + 1]
+            if code == "u":
+                if pos + 6 > len(buffer):
+                    break
+                decoded.append(chr(int(buffer[pos + 2 : pos + 6], 16)))
+                pos += 6
+            else:
+                decoded.append(_ESCAPES.get(code, code))
+                pos += 2
+        self._pos = pos
+        delta = "".join(decoded)
+        self.answer += delta
+        return delta
+
+
+class AnswerStreamer:
+    """Turns (mode, chunk) pairs from graph.stream() into events."""
+
+    def __init__(self):
+        self._partials: Dict[tuple, PartialAnswer] = {}  # one per node run
+        self.final_args: Dict[str, Any] = {}
+
+    def feed(self, mode: str, chunk: Any) -> Iterator[dict]:
+        if mode == "debug":
+            yield from self._on_debug(chunk)
+        elif mode == "messages":
+            yield from self._on_message(*chunk)
+
+    def final_event(self) -> dict:
+        return {
+            "event": "final",
+            "answer": self.final_args.get("answer", ""),
+            "references": self.final_args.get("reference", []),
+        }
+
+    def _on_debug(self, chunk: dict) -> Iterator[dict]:
+        payload = chunk["payload"]
+        if chunk["type"] == "task":
+            yield {"event": "node_start", "node": payload["name"], "step": chunk["step"]}
+        elif chunk["type"] == "task_result":
+            event = {"event": "node_end", "node": payload["name"], "step": chunk["step"]}
+            if payload.get("error"):
+                event["error"] = str(payload["error"])
+            result = _root_result(payload.get("result"))
+            if isinstance(result, AIMessage) and result.tool_calls:
+                args = result.tool_calls[0]["args"]
+                self.final_args = args
+                event["search_queries"] = args.get("search_queries", [])
+            elif isinstance(result, dict) and "answer" in result:
+                # a state update of the compact graph (compact_graph.py)
+                self.final_args = {
+                    "answer": result["answer"],
+                    "reference": result.get("references", self.final_args.get("reference", [])),
+                }
+                event["search_queries"] = result.get("queries", [])
+            elif isinstance(result, list):
+                event["tool_messages"] = len(result)
+            yield event
+
+    def _on_message(self, message: BaseMessage, metadata: dict) -> Iterator[dict]:
+        node = metadata.get("langgraph_node")
+        if node not in ANSWER_NODES:
+            return
+        partial = self._partials.setdefault(
+            (node, metadata.get("langgraph_step")), PartialAnswer()
+        )
+        if isinstance(message, AIMessageChunk):
+            # the tool-call arguments arrive as JSON fragments
+            delta = partial.feed(
+                "".join(
+                    tool_call_chunk.get("args") or ""
+                    for tool_call_chunk in message.tool_call_chunks
+                )
+            )
+        elif isinstance(message, AIMessage) and message.tool_calls:
+            # the model didn't stream, the whole answer arrives at once
+            answer = str(message.tool_calls[0]["args"].get("answer", ""))
+            delta = answer[len(partial.answer) :] if not partial.done else ""
+            partial.answer, partial.done = answer, True
+        else:
+            return
+        if delta:
+            yield {
+                "event": "answer_delta",
+                "node": node,
+                "delta": delta,
+                "answer": partial.answer,
+            }
+
+
+def _root_result(result: Any) -> Any:
+    # MessageGraph nodes write to the "__root__" channel
+    if isinstance(result, dict) and "__root__" in result:
+        return result["__root__"]
+    if isinstance(result, list) and len(result) == 1 and isinstance(result[0], tuple):
+        return result[0][1]  # older langgraph: [(channel, value)]
+    return result
+
+
+def stream_events(graph, question: str, config: Optional[dict] = None) -> Iterator[dict]:
+    """Run the graph on one question and yield progress/answer events."""
+    streamer = AnswerStreamer()
+    for mode, chunk in graph.stream(question, config, stream_mode=STREAM_MODES):
+        yield from streamer.feed(mode, chunk)
+    yield streamer.final_event()
+
+
+async def astream_events(
+    graph, question: str, config: Optional[dict] = None
+) -> AsyncIterator[dict]:
+    """Async version of stream_events()."""
+    streamer = AnswerStreamer()
+    async for mode, chunk in graph.astream(question, config, stream_mode=STREAM_MODES):
+        for event in streamer.feed(mode, chunk):
+            yield event
+    yield streamer.final_event()
+
+
+def write_ndjson(events: Iterator[dict], out: TextIO = sys.stdout) -> None:
+    """Plain NDJSON output: one event per line, flushed as soon as it happens."""
+    for event in events:
+        out.write(json.dumps(event, ensure_ascii=False) + "\n")
+        out.flush()
+
+
+def render_live(events: Iterator[dict], console: Optional[Console] = None) -> dict:
+    """Render the events live in the Rich console, return the final event."""
+    console = console or Console()
+    progress: List[str] = []
+    answer = ""
+    title = "💭 Thinking…"
+    final: dict = {}
+
+    def view():
+        status = Text("\n".join(progress[-6:]), style="dim")
+        body = Markdown(answer) if answer else Text("…")
+        border_style = "green" if final else "cyan"
+        return Group(
+            status, Panel(body, title=title, border_style=border_style, expand=True)
+        )
+
+    with Live(view(), console=console, refresh_per_second=8) as live:
+        for event in events:
+            if event["event"] == "node_start":
+                progress.append(f"▶ {event['node']} (step {event['step']})")
+                if event["node"] in ANSWER_NODES:
+                    title = f"✍️  {event['node']}"
+            elif event["event"] == "node_end":
+                progress.append(f"✔ {event['node']}")
+            elif event["event"] == "answer_delta":
+                answer = event["answer"]
+            elif event["event"] == "final":
+                final = event
+                answer = event["answer"]
+                title = "💡 Final Answer"
+            live.update(view())
+    return final
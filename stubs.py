@@ -0,0 +1,253 @@
+# this file holds deterministic local stand-ins for ChatOpenAI and TavilySearch
+# they let us run (and benchmark) the whole draft -> execute_tools -> reviser
+# loop without any API key or network:
+# 1. StubChatModel answers every call with a valid AnswerQuestion / ReviseAnswer
+#    tool call (whichever tool is bound), after a configurable latency
+# 2. StubSearch returns Tavily-shaped payloads, also after a configurable latency
+# the outputs only depend on the input, so two runs produce the same messages.
+#
+# usage: build_graph(llm=StubChatModel(), search_tool=StubSearch())
+
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Iterator, List, Optional, Tuple
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+
+from compaction import count_messages_tokens, count_tokens
+
+_WORDS = (
+    "research evidence analysis market security autonomous detection response "
+    "startup funding platform model agent data signal threat cloud network "
+    "report growth investor product customer"
+).split()
+
+
+def _digest(*parts: Any) -> int:
+    text = json.dumps(parts, default=str, sort_keys=True)
+    return int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+
+
+def _words(seed: int, count: int) -> str:
+    return " ".join(_WORDS[(seed + i * 7) % len(_WORDS)] for i in range(count))
+
+
+def tool_call_chunks(message: AIMessage, chunk_size: int) -> List[ChatGenerationChunk]:
+    """Split the tool-call arguments of `message` into chunks, like OpenAI streams them."""
+    # (name, raw JSON arguments, id); malformed arguments are streamed as they are
+    calls = [(call["name"], json.dumps(call["args"]), call["id"]) for call in message.tool_calls]
+    calls += [(call["name"], call["args"] or "", call["id"]) for call in message.invalid_tool_calls]
+    chunks = []
+    for index, (name, arguments, call_id) in enumerate(calls):
+        for i in range(0, len(arguments), chunk_size):
+            first = i == 0
+            chunks.append(
+                ChatGenerationChunk(
+                    message=AIMessageChunk(
+                        content="",
+                        tool_call_chunks=[
+                            {
+                                "name": name if first else None,
+                                "args": arguments[i : i + chunk_size],
+                                "id": call_id if first else None,
+                                "index": index,
+                            }
+                        ],
+                    )
+                )
+            )
+    chunks.append(
+        ChatGenerationChunk(
+            message=AIMessageChunk(
+                content=message.content,
+                usage_metadata=message.usage_metadata,
+                response_metadata=message.response_metadata,
+            )
+        )
+    )
+    return chunks
+
+
+class StubChatModel(BaseChatModel):
+    """A chat model that returns valid tool calls without calling OpenAI."""
+
+    latency: float = 0.0  # seconds per call
+    answer_words: int = 250
+    critique_words: int = 30
+    num_queries: int = 2
+    num_sections: int = 3  # sections in a SectionPlan (sections.py)
+    chunk_size: int = 16  # characters of tool-call arguments per streamed chunk
+    model_name: str = "stub"
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def bind_tools(self, tools, tool_choice=None, **kwargs):
+        # same shape as ChatOpenAI.bind_tools(tools=[AnswerQuestion], ...):
+        # we only need to know which schema the answer has to follow
+        tool = tools[0]
+        name = getattr(tool, "__name__", None) or tool.get("name")
+        fields = tuple(getattr(tool, "model_fields", ()))
+        return self.bind(tool_name=name, fields=fields, **kwargs)
+
+    def _make_message(
+        self, messages: List[BaseMessage], tool_name: str, fields: Tuple[str, ...] = ()
+    ) -> AIMessage:
+        # the round number makes every revision a little different
+        round_number = sum(isinstance(m, ToolMessage) for m in messages)
+        question = next((m.content for m in messages if m.type == "human"), "")
+        seed = _digest(question, round_number, tool_name)
+        if tool_name == "SectionPlan":
+            args = {
+                "sections": [
+                    {
+                        "title": _words(seed + i, 2).title(),
+                        "question": f"{question} ({_words(seed + i, 3)})",
+                    }
+                    for i in range(self.num_sections)
+                ]
+            }
+            return self._tool_call_message(messages, tool_name, args, seed)
+        # in the field order of the bound schema, like OpenAI generates them
+        args = {
+            "search_queries": [
+                f"{question[:40]} {_words(seed + 3 + i, 3)}"
+                for i in range(self.num_queries)
+            ],
+            "answer": f"Round {round_number}: " + _words(seed, self.answer_words),
+            "reflection": {
+                "missing": _words(seed + 1, self.critique_words),
+                "superfluous": _words(seed + 2, self.critique_words),
+            },
+        }
+        if tool_name == "ReviseAnswer":
+            args["reference"] = [
+                f"https://example.com/{(seed + i) % 1000}" for i in range(3)
+            ]
+        if fields:
+            args = {name: args[name] for name in fields if name in args}
+        return self._tool_call_message(messages, tool_name, args, seed)
+
+    def _tool_call_message(
+        self, messages: List[BaseMessage], tool_name: str, args: dict, seed: int
+    ) -> AIMessage:
+        prompt_tokens = count_messages_tokens(messages)
+        completion_tokens = count_tokens(json.dumps(args))
+        return AIMessage(
+            content="",
+            tool_calls=[
+                {"name": tool_name, "args": args, "id": f"call_{seed:016x}"[:29]}
+            ],
+            usage_metadata={
+                "input_tokens": prompt_tokens,
+                "output_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+            response_metadata={"model_name": self.model_name},
+        )
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: str = "AnswerQuestion",
+        fields: Tuple[str, ...] = (),
+        **kwargs,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        message = self._make_message(messages, tool_name, fields)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: str = "AnswerQuestion",
+        fields: Tuple[str, ...] = (),
+        **kwargs,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        message = self._make_message(messages, tool_name, fields)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _chunks(self, message: AIMessage) -> List[ChatGenerationChunk]:
+        return tool_call_chunks(message, self.chunk_size)
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: str = "AnswerQuestion",
+        fields: Tuple[str, ...] = (),
+        **kwargs,
+    ) -> Iterator[ChatGenerationChunk]:
+        chunks = self._chunks(self._make_message(messages, tool_name, fields))
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            if run_manager:
+                run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        tool_name: str = "AnswerQuestion",
+        fields: Tuple[str, ...] = (),
+        **kwargs,
+    ):
+        chunks = self._chunks(self._make_message(messages, tool_name, fields))
+        for chunk in chunks:
+            await asyncio.sleep(self.latency / len(chunks))
+            if run_manager:
+                await run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+
+
+class StubSearch(BaseTool):
+    """Tavily-shaped search results without calling Tavily.
+
+    A BaseTool named like TavilySearch, so batch()/abatch() run the queries
+    concurrently and callbacks (e.g. tracing.Tracer) see every query.
+    """
+
+    name: str = "tavily_search"
+    description: str = "Offline stand-in for Tavily search."
+    latency: float = 0.0  # seconds per query
+    max_results: int = 5
+    content_words: int = 120
+    calls: int = 0  # number of queries actually "sent"
+
+    def _result(self, query: str) -> dict:
+        self.calls += 1
+        seed = _digest(query)
+        return {
+            "query": query,
+            "results": [
+                {
+                    "url": f"https://example.com/{(seed + i) % 1000}",
+                    "title": _words(seed + i, 6),
+                    "content": _words(seed + i, self.content_words),
+                    "score": round(1.0 - i / (self.max_results + 1), 3),
+                }
+                for i in range(self.max_results)
+            ],
+        }
+
+    def _run(self, query: str, **kwargs) -> dict:
+        time.sleep(self.latency)
+        return self._result(query)
+
+    async def _arun(self, query: str, **kwargs) -> dict:
+        await asyncio.sleep(self.latency)
+        return self._result(query)
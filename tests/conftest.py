@@ -0,0 +1,27 @@
+import pytest
+
+from main import build_graph
+from rate_limit import Scheduler
+from search_cache import SearchCache
+from search_index import SearchIndex
+from stubs import StubChatModel, StubSearch
+
+
+@pytest.fixture
+def make_stub_graph():
+    """Build the graph on the offline stubs, in-memory stores only."""
+
+    def make(llm_latency: float = 0.0, search_latency: float = 0.0, **overrides):
+        options = dict(
+            llm=StubChatModel(latency=llm_latency),
+            search_tool=StubSearch(latency=search_latency),
+            search_cache=SearchCache(path=None),
+            search_index=SearchIndex(path=None),
+            llm_scheduler=Scheduler("test_llm"),
+            search_scheduler=Scheduler("test_search"),
+            answer_cache=False,
+        )
+        options.update(overrides)
+        return build_graph(**options)
+
+    return make
@@ -0,0 +1,75 @@
+import pytest
+
+from answer_cache import AnswerCache, get_answer_cache
+
+ANSWER = {"answer": "stored", "references": []}
+
+
+def _cache(*questions):
+    cache = AnswerCache(path=None)
+    for question in questions:
+        cache.store(question, ANSWER)
+    cache.store("How do ocean tides form?", {"answer": "unrelated"})
+    return cache
+
+
+@pytest.mark.parametrize(
+    "stored, asked",
+    [
+        ("Explain the group homology of finite groups", "Explain the group cohomology of finite groups"),
+        ("What is Galois cohomology?", "What is sheaf cohomology?"),
+        ("What is Galois cohomology?", "What is group cohomology?"),
+        (
+            "List AI-powered SIEM startups that raised capital",
+            "List AI-powered SOC startups that raised capital",
+        ),
+        (
+            "Which cybersecurity startups failed to raise a Series A?",
+            "Which cybersecurity startups successfully raised a Series A?",
+        ),
+        ("Top SOC startups of 2023", "Top SOC startups of 2024"),
+        # same words, different order
+        ("Did Microsoft acquire Nuance?", "Did Nuance acquire Microsoft?"),
+        ("Does aspirin reduce the risk of a stroke?", "Does aspirin not reduce the risk of a stroke?"),
+    ],
+)
+def test_different_questions_are_not_answered_from_the_cache(stored, asked):
+    cache = _cache(stored)
+    assert cache.lookup(asked) is None
+    assert cache.lookup(stored)["answer"] == ANSWER
+
+
+def test_the_same_question_typed_differently_is_a_hit():
+    cache = _cache("Which AI-powered SOC startups raised capital?")
+    hit = cache.lookup("which ai powered SOC startups raised capital")
+    assert hit["answer"] == ANSWER and hit["similarity"] == 1.0
+
+
+@pytest.mark.parametrize(
+    "asked",
+    [
+        "Which AI-powered SOC startups have raised capital?",
+        "Which AI-powered SOC startup raised capital?",
+        "Which AI powered SOC startups raised capital recently?",
+    ],
+)
+def test_a_slightly_reworded_question_is_a_hit(asked):
+    cache = _cache("Which AI-powered SOC startups raised capital?")
+    assert cache.lookup(asked)["answer"] == ANSWER
+
+
+def test_scores_survive_reweighting_as_the_cache_grows():
+    cache = _cache("Which AI-powered SOC startups raised capital?")
+    for i in range(40):
+        cache.store(f"Unrelated question number {i} about capital markets", {"answer": str(i)})
+    assert cache.lookup("which ai powered soc startups raised capital")["answer"] == ANSWER
+
+
+def test_the_cache_is_opt_in(monkeypatch):
+    monkeypatch.setenv("ANSWER_CACHE_PATH", ":memory:")
+    monkeypatch.delenv("ANSWER_CACHE", raising=False)
+    get_answer_cache.cache_clear()
+    try:
+        assert get_answer_cache() is None
+    finally:
+        get_answer_cache.cache_clear()
@@ -0,0 +1,34 @@
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from compaction import MessageCompactor
+
+
+def _history(rounds: int):
+    messages = [HumanMessage(content="question")]
+    for i in range(rounds):
+        messages.append(
+            AIMessage(
+                content="",
+                tool_calls=[{"name": "ReviseAnswer", "args": {"answer": "word " * 400}, "id": f"c{i}"}],
+            )
+        )
+        messages.append(ToolMessage(content="result " * 400, tool_call_id=f"c{i}"))
+    return messages
+
+
+def test_compaction_fits_the_budget_and_keeps_the_latest_round():
+    compactor = MessageCompactor(token_budget=1_500)
+    messages = _history(4)
+    compacted = compactor.compact(messages)
+    assert compactor.reports[-1].tokens_after < compactor.reports[-1].tokens_before
+    assert compacted[-2:] == messages[-2:]
+
+
+def test_reports_are_bounded_and_totals_kept():
+    compactor = MessageCompactor(token_budget=1_500, max_reports=3)
+    for _ in range(10):
+        compactor.compact(_history(4))
+    assert len(compactor.reports) == 3
+    stats = compactor.stats()
+    assert stats["passes"] == 10
+    assert stats["tokens_saved"] == 10 * compactor.reports[-1].tokens_saved
@@ -0,0 +1,74 @@
+import asyncio
+import itertools
+import threading
+import time
+
+from deadlines import Deadlines, arun_with_deadlines, run_with_deadlines
+from rate_limit import Scheduler
+
+
+def test_hedged_queries_release_every_scheduler_slot():
+    scheduler = Scheduler("test_search")
+    calls = itertools.count()
+
+    async def search(query):
+        # the first request of every query stalls, its hedge answers at once
+        await asyncio.sleep(10 if next(calls) < 4 else 0)
+        return {"query": query, "results": []}
+
+    async def run():
+        queries = [f"query {i}" for i in range(4)]
+        call = lambda query: scheduler.acall(search, query)  # noqa: E731
+        for _ in range(3):
+            results = await arun_with_deadlines(
+                call, queries, queries, Deadlines(timeout=5.0, hedge_after=0.05)
+            )
+            assert [result["query"] for result in results] == queries
+            assert scheduler.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+    assert scheduler.stats()["calls"] == 3 * 4
+
+
+def _flaky_search(query):
+    if query == "broken":
+        raise RuntimeError("tavily is down")
+    return {"query": query, "results": []}
+
+
+def test_a_failed_query_does_not_fail_the_others():
+    queries = ["first", "broken", "last"]
+    results = run_with_deadlines(_flaky_search, queries, queries, Deadlines(timeout=5.0))
+    assert [result["query"] for result in results] == queries
+    assert "error" not in results[0] and "error" not in results[2]
+    assert results[1]["error"].startswith("search failed: RuntimeError")
+
+    async def search(query):
+        return _flaky_search(query)
+
+    results = asyncio.run(
+        arun_with_deadlines(search, queries, queries, Deadlines(timeout=5.0, hedge_after=0.01))
+    )
+    assert "error" not in results[0] and "error" not in results[2]
+    assert results[1]["error"].startswith("search failed: RuntimeError")
+
+
+def test_abandoned_searches_do_not_hold_up_later_steps():
+    release = threading.Event()
+
+    def stalled(query):
+        release.wait(10)
+        return {"query": query, "results": []}
+
+    try:
+        # more abandoned attempts than a shared pool of 32 threads could hold
+        for _ in range(3):
+            queries = [f"stalled {i}" for i in range(16)]
+            results = run_with_deadlines(stalled, queries, queries, Deadlines(timeout=0.05))
+            assert all(result.get("timed_out") for result in results)
+        start = time.monotonic()
+        results = run_with_deadlines(_flaky_search, ["fresh"], ["fresh"], Deadlines(timeout=5.0))
+        assert results == [{"query": "fresh", "results": []}]
+        assert time.monotonic() - start < 1.0
+    finally:
+        release.set()
@@ -0,0 +1,69 @@
+from langchain_core.messages import HumanMessage
+
+from dedup import DedupRegistry
+from passages import PassageExtractor
+
+URL = "https://www.example.com/review/"
+
+
+def _topic(word: str) -> str:
+    return " ".join(f"The {word} figure {i} is covered in this part." for i in range(5))
+
+
+PAGE = " ".join(_topic(word) for word in ("battery", "pricing", "camera", "warranty"))
+
+
+def _step(registry, messages, call_id, queries, pages, budget=80):
+    results = [
+        {"query": query, "results": [{"url": url, "title": "t", "content": content}]}
+        for query, (url, content) in zip(queries, pages)
+    ]
+    extractor = PassageExtractor(token_budget=budget)
+    return registry.process(
+        messages, results, call_id, lambda fresh: extractor.extract(fresh, queries)
+    )
+
+
+def test_seen_url_is_collapsed_when_its_passages_cover_the_query():
+    registry, messages = DedupRegistry(), [HumanMessage(content="q", id="run-1")]
+    _step(registry, messages, "call-1", ["battery"], [(URL, PAGE)])
+    tracked = URL + "?utm_source=x"
+    output = _step(registry, messages, "call-2", ["battery life"], [(tracked, PAGE)])
+    assert output[0]["results"] == [
+        {"url": tracked, "duplicate_of": {"tool_call_id": "call-1", "query": "battery"}}
+    ]
+    assert registry.stats(messages)["url_duplicates"] == 1
+
+
+def test_seen_url_goes_through_again_for_a_query_it_did_not_cover():
+    registry, messages = DedupRegistry(), [HumanMessage(content="q", id="run-1")]
+    first = _step(registry, messages, "call-1", ["battery"], [(URL, PAGE)])
+    assert "warranty" not in first[0]["results"][0]["content"]
+    output = _step(registry, messages, "call-2", ["warranty"], [(URL, PAGE)])
+    (item,) = output[0]["results"]
+    assert "duplicate_of" not in item and "warranty" in item["content"]
+    assert registry.stats(messages)["url_duplicates"] == 0
+    # both extractions are remembered now: the warranty passages are covered
+    again = _step(registry, messages, "call-3", ["warranty"], [(URL, PAGE)])
+    assert again[0]["results"][0]["duplicate_of"]["tool_call_id"] == "call-1"
+
+
+def test_same_page_for_another_query_of_the_same_call_is_extracted_for_it():
+    registry, messages = DedupRegistry(), [HumanMessage(content="q", id="run-1")]
+    output = _step(registry, messages, "call-1", ["battery", "camera"], [(URL, PAGE), (URL, PAGE)])
+    assert "battery" in output[0]["results"][0]["content"]
+    assert "camera" in output[1]["results"][0]["content"]
+
+
+def test_same_content_under_another_url_is_collapsed():
+    registry, messages = DedupRegistry(), [HumanMessage(content="q", id="run-1")]
+    text = _topic("battery")
+    _step(registry, messages, "call-1", ["battery"], [(URL, text)], budget=1_000)
+    exact = _step(registry, messages, "call-2", ["camera"], [("https://mirror.example/a", text)])
+    edited = text.replace("figure 4", "figure four")
+    near = _step(registry, messages, "call-3", ["camera"], [("https://other.example/b", edited)])
+    assert exact[0]["results"][0]["duplicate_of"]["tool_call_id"] == "call-1"
+    assert near[0]["results"][0]["duplicate_of"]["tool_call_id"] == "call-1"
+    stats = registry.stats(messages)
+    assert stats["exact_duplicates"] == stats["near_duplicates"] == 1
+    assert stats["tokens_saved"] > 0
@@ -0,0 +1,19 @@
+from passages import PassageExtractor
+
+
+def _payload(query: str):
+    content = " ".join(f"Sentence {i} about {query} and other things." for i in range(40))
+    return {"query": query, "results": [{"url": "https://a.example", "title": "A", "content": content}]}
+
+
+def test_reports_are_bounded_and_stats_keep_the_totals():
+    extractor = PassageExtractor(token_budget=100, max_reports=3)
+    for i in range(5):
+        query = f"topic {i}"
+        output = extractor.extract([_payload(query)], [query])
+        assert output[0]["results"][0]["url"] == "https://a.example"
+    assert len(extractor.reports) == 3
+    stats = extractor.stats()
+    assert stats["extractions"] == 5
+    assert stats["tokens_before"] > sum(report.tokens_before for report in extractor.reports)
+    assert 0 < stats["tokens_saved"] < stats["tokens_before"]
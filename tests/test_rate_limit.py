@@ -0,0 +1,63 @@
+import asyncio
+
+from rate_limit import AdaptiveConcurrency, Scheduler
+
+
+def test_cancelled_calls_release_their_slot_and_leave_the_window_alone():
+    scheduler = Scheduler("test")
+    limit = scheduler.concurrency.limit
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    async def run():
+        tasks = [asyncio.create_task(scheduler.acall(slow)) for _ in range(5)]
+        await asyncio.sleep(0.05)
+        assert scheduler.stats()["in_flight"] == 5
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(run())
+    stats = scheduler.stats()
+    assert stats["in_flight"] == 0
+    assert stats["calls"] == stats["failed"] == stats["retries"] == 0
+    assert scheduler.concurrency.limit == limit
+
+
+def test_failed_calls_release_their_slot():
+    scheduler = Scheduler("test")
+
+    async def broken():
+        raise ValueError("bad request")
+
+    async def run():
+        for _ in range(3):
+            try:
+                await scheduler.acall(broken)
+            except ValueError:
+                pass
+
+    asyncio.run(run())
+    assert scheduler.stats()["in_flight"] == 0
+    assert scheduler.stats()["failed"] == 3
+
+
+def test_mixed_length_calls_are_not_taken_for_congestion():
+    concurrency = AdaptiveConcurrency(initial=8)
+    now = 0.0
+    for _ in range(50):
+        # a short re-ask and a long draft, each at its usual latency
+        for kind, latency in (("gpt-4.1-mini:ReviseAnswer_fix_answer", 0.4), ("gpt-4.1:AnswerQuestion", 6.0)):
+            now += 1.0
+            concurrency.on_success(latency, now, kind)
+    assert concurrency.limit > 8
+
+
+def test_a_latency_spike_of_one_kind_is_congestion():
+    concurrency = AdaptiveConcurrency(initial=8)
+    for i in range(20):
+        concurrency.on_success(1.0, float(i), "gpt-4.1:ReviseAnswer")
+    limit = concurrency.limit
+    concurrency.on_success(5.0, 100.0, "gpt-4.1:ReviseAnswer")
+    assert concurrency.limit == limit / 2
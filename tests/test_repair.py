@@ -0,0 +1,128 @@
+from langchain_core.messages import AIMessage
+from langchain_core.prompt_values import ChatPromptValue
+
+from rate_limit import Scheduler
+from repair import ToolCallRepairer
+from routing import ModelRouter
+from schemas import AnswerQuestion, ReviseAnswer
+from stopping import MaxIterations
+from stubs import StubChatModel, StubSearch
+
+ANSWER = "Some answer text. " * 30 + "\n\nReferences:\n- [1] https://a.com/x\n- [2] https://b.org/y"
+CRITIQUE = {"missing": "m", "superfluous": "s"}
+
+
+def _call(args: dict, name: str = "ReviseAnswer") -> AIMessage:
+    return AIMessage(content="", tool_calls=[{"name": name, "args": args, "id": "c1"}])
+
+
+def test_misplaced_fields_are_moved_locally():
+    reflection = {**CRITIQUE, "reference": ["https://a.com"]}
+    repair = ToolCallRepairer().repair(
+        _call({"search_queries": ["q"], "answer": ANSWER, "reflection": reflection}), ReviseAnswer
+    )
+    args = repair.message.tool_calls[0]["args"]
+    assert repair.valid and repair.actions == ["moved:reference"]
+    assert args["reference"] == ["https://a.com"] and args["reflection"] == CRITIQUE
+
+
+def test_renamed_and_mistyped_fields_are_coerced():
+    repairer = ToolCallRepairer()
+    args = {
+        "Search Queries": "q1\n- q2",
+        "answer": ANSWER,
+        "reflection": "too short",
+        "references": "https://a.com",
+    }
+    repair = repairer.repair(_call(args), ReviseAnswer)
+    args = repair.message.tool_calls[0]["args"]
+    assert repair.valid
+    assert args["search_queries"] == ["q1", "q2"] and args["reference"] == ["https://a.com"]
+    assert args["reflection"]["missing"] == "too short"
+    assert repairer.stats()["repaired"] == 1
+
+
+def test_missing_references_default_to_the_urls_in_the_answer():
+    args = {"search_queries": ["q"], "answer": ANSWER, "missing": "m", "superfluous": "s"}
+    repair = ToolCallRepairer().repair(_call(args), ReviseAnswer)
+    args = repair.message.tool_calls[0]["args"]
+    assert repair.valid and args["reflection"] == CRITIQUE
+    assert args["reference"] == ["https://a.com/x", "https://b.org/y"]
+
+
+def test_cut_off_json_and_long_answers_are_repaired():
+    repairer = ToolCallRepairer(max_answer_words=50)
+    arguments = '{"search_queries": ["a"], "answer": "cut off'
+    cut_off = AIMessage(
+        content="",
+        invalid_tool_calls=[
+            {"name": "AnswerQuestion", "args": arguments, "id": "c2", "error": None}
+        ],
+    )
+    repair = repairer.repair(cut_off, AnswerQuestion)
+    assert "parsed_json" in repair.actions
+    assert repair.message.tool_calls[0]["args"]["answer"] == "cut off"
+    args = {"search_queries": ["q"], "answer": "Word word word. " * 100, "reflection": CRITIQUE}
+    long = repairer.repair(_call(args, "AnswerQuestion"), AnswerQuestion)
+    assert "truncated:answer" in long.actions
+    assert len(long.message.tool_calls[0]["args"]["answer"].split()) <= 50
+
+
+def test_what_is_still_invalid_is_reasked_with_a_smaller_schema():
+    repairer = ToolCallRepairer()
+    repair = repairer.repair(_call({"search_queries": ["q"], "reflection": CRITIQUE}), ReviseAnswer)
+    assert not repair.valid
+    fix = repairer.fix_schema(ReviseAnswer, repair)
+    assert list(fix.model_fields) == ["answer"]
+    assert repairer.fix_schema(ReviseAnswer, repair) is fix  # built once per field set
+    prompt = repairer.reask_prompt(ChatPromptValue(messages=[]), repair, ReviseAnswer, fix)
+    assert "answer: Field required" in prompt.messages[-1].content
+    merged = repairer.merge(repair, _call({"answer": ANSWER}, fix.__name__), ReviseAnswer)
+    args = merged.message.tool_calls[0]["args"]
+    assert merged.valid and merged.reasked
+    assert args["answer"] == ANSWER and args["search_queries"] == ["q"]
+    assert repairer.stats()["reask_fixed"] == 1
+
+
+class DriftingModel(StubChatModel):
+    """Nests `reference` under the reflection, and leaves the answer out of one revision."""
+
+    def _make_message(self, messages, tool_name, fields=()):
+        message = super()._make_message(messages, tool_name, fields)
+        args = dict(message.tool_calls[0]["args"])
+        if tool_name == "ReviseAnswer":
+            args["reflection"] = {**args["reflection"], "reference": args.pop("reference")}
+            if sum(m.type == "tool" for m in messages) == 2:
+                args.pop("answer")
+        return message.model_copy(update={"tool_calls": [{**message.tool_calls[0], "args": args}]})
+
+
+def _router_graph(make_stub_graph, repairer):
+    llm = DriftingModel(latency=0.0)
+    router = ModelRouter(llm_factory=lambda route: llm, max_iterations=2, repairer=repairer)
+    graph = make_stub_graph(
+        llm=llm,
+        search_tool=StubSearch(latency=0.0),
+        stopping_policy=MaxIterations(2),
+        llm_scheduler=Scheduler("test_llm"),
+        router=router,
+        speculator=False,
+    )
+    return graph, router
+
+
+def test_the_router_repairs_and_reasks_instead_of_escalating(make_stub_graph):
+    graph, router = _router_graph(make_stub_graph, repairer=None)
+    final = graph.invoke("What is growth?")[-1].tool_calls[0]["args"]
+    assert final["reference"] and final["answer"]
+    stats = router.repairer.stats()
+    assert stats["reasked"] == stats["reask_fixed"] == 1 and stats["repaired"] >= 2
+    rows = [row for models in router.report().values() for row in models.values()]
+    assert sum(row["escalated"] for row in rows) == 0
+
+
+def test_without_the_repairer_the_router_escalates(make_stub_graph):
+    graph, router = _router_graph(make_stub_graph, repairer=False)
+    graph.invoke("What is growth?")
+    rows = [row for models in router.report().values() for row in models.values()]
+    assert sum(row["escalated"] for row in rows) > 0
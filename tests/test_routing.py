@@ -0,0 +1,24 @@
+from rate_limit import Scheduler
+from routing import ModelRouter
+from schemas import ReviseAnswer
+from stubs import StubChatModel
+
+
+class RecordingModel(StubChatModel):
+    """Remembers the keyword arguments every bind_tools call got."""
+
+    bound: list = []
+
+    def bind_tools(self, tools, **kwargs):
+        self.bound.append(kwargs)
+        return super().bind_tools(tools, **kwargs)
+
+
+def test_the_prompt_cache_key_goes_in_the_request_body():
+    llm = RecordingModel(latency=0.0, bound=[])
+    router = ModelRouter(llm_factory=lambda route: llm, prompt_cache_key="reflexion-agent")
+    router._model(router.routes["revision"], ReviseAnswer, Scheduler("test_llm"), None)
+    (kwargs,) = llm.bound
+    # openai 1.96 (uv.lock) has no prompt_cache_key argument, extra_body passes it through
+    assert "prompt_cache_key" not in kwargs
+    assert kwargs["extra_body"] == {"prompt_cache_key": "reflexion-agent:ReviseAnswer"}
@@ -0,0 +1,16 @@
+from search_cache import SearchCache, normalize_query
+
+
+def test_normalize_query_ignores_case_and_punctuation():
+    assert normalize_query("AI-powered SOC startups?") == normalize_query("ai powered  soc startups")
+
+
+def test_normalize_query_keeps_word_order():
+    assert normalize_query("Microsoft acquired Nuance") != normalize_query("Nuance acquired Microsoft")
+
+
+def test_order_sensitive_queries_get_their_own_entries():
+    cache = SearchCache(path=None)
+    cache.set("X acquired Y", 5, {"query": "X acquired Y", "results": ["x"]})
+    assert cache.get("x acquired y!", 5) is not None
+    assert cache.get("Y acquired X", 5) is None
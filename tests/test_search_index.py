@@ -0,0 +1,29 @@
+import itertools
+
+from search_index import SearchIndex
+
+
+def _payload(*urls):
+    return {"results": [{"url": url, "title": url, "content": f"text about {url}"} for url in urls]}
+
+
+def test_the_oldest_documents_are_evicted_and_a_refetch_counts_as_new(monkeypatch):
+    clock = itertools.count(1_000_000)
+    monkeypatch.setattr("search_index.time.time", lambda: float(next(clock)))
+    index = SearchIndex(path=None, max_documents=3)
+    index.ingest(_payload("a", "b", "c"))
+    index.ingest(_payload("a"))  # fetched again: now the newest
+    index.ingest(_payload("d", "e"))
+    assert sorted(index._documents) == ["a", "d", "e"]
+    assert sorted(index._lengths) == ["a", "d", "e"]
+
+
+def test_expired_documents_are_dropped_on_ingest(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr("search_index.time.time", lambda: now[0])
+    index = SearchIndex(path=None, max_age_seconds=60)
+    index.ingest(_payload("old"))
+    now[0] += 120
+    index.ingest(_payload("new"))
+    assert list(index._documents) == ["new"]
+    assert all("old" not in postings for postings in index._postings.values())
@@ -0,0 +1,57 @@
+import asyncio
+import gc
+
+from server import ReflexionService
+
+
+async def _wait(service: ReflexionService, *jobs) -> None:
+    while any(job.finished_at is None for job in jobs):
+        await asyncio.sleep(0.01)
+
+
+def test_coalescing_ignores_case_and_punctuation_but_not_word_order(make_stub_graph):
+    async def run():
+        service = ReflexionService(make_stub_graph(llm_latency=0.05))
+        first, _ = service.submit("Compare Rust to Go")
+        same, coalesced = service.submit("compare rust to go?")
+        other, other_coalesced = service.submit("Compare Go to Rust")
+        await _wait(service, first, other)
+        return first, same, coalesced, other, other_coalesced
+
+    first, same, coalesced, other, other_coalesced = asyncio.run(run())
+    assert coalesced and same is first
+    assert not other_coalesced and other is not first
+    assert first.status == other.status == "done"
+
+
+def test_running_jobs_survive_garbage_collection(make_stub_graph):
+    async def run():
+        service = ReflexionService(make_stub_graph(llm_latency=0.05))
+        job, _ = service.submit("What is BM25?")
+        await asyncio.sleep(0)
+        gc.collect()
+        assert service._tasks  # held until the job is done
+        await _wait(service, job)
+        await asyncio.sleep(0)
+        return service, job
+
+    service, job = asyncio.run(run())
+    assert job.status == "done" and not service._tasks
+
+
+def test_answer_deltas_are_stored_without_the_snapshot(make_stub_graph):
+    async def run():
+        service = ReflexionService(make_stub_graph())
+        job, _ = service.submit("What is BM25?")
+        await _wait(service, job)
+        return job
+
+    job = asyncio.run(run())
+    deltas = [event for event in job.events if event["event"] == "answer_delta"]
+    assert deltas and all("answer" not in event for event in deltas)
+    final = next(event for event in job.events if event["event"] == "final")
+    # the deltas of the last reviser call add up to the final answer
+    last_start = max(i for i, e in enumerate(job.events) if e["event"] == "node_start")
+    tail = [e["delta"] for e in job.events[last_start:] if e["event"] == "answer_delta"]
+    assert "".join(tail) == final["answer"]
+    assert job.view()["answer"] == final["answer"]
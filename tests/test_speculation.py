@@ -0,0 +1,51 @@
+from compact_graph import build_compact_graph
+from rate_limit import Scheduler
+from schemas import ReviseAnswer, SpeculativeReviseAnswer
+from search_cache import SearchCache
+from search_index import SearchIndex
+from speculation import SpeculativeSearch
+from stopping import MaxIterations
+from stubs import StubChatModel, StubSearch
+
+
+def test_the_last_revision_starts_no_speculative_search(make_stub_graph):
+    speculator = SpeculativeSearch()
+    graph = make_stub_graph(speculator=speculator, stopping_policy=MaxIterations(2))
+    state = graph.invoke("What is reflexion?")
+    stats = speculator.stats()
+    assert stats["started"] > 0
+    # every search that was started went into a ToolMessage
+    assert stats["unused"] == 0 and stats["used"] == stats["started"]
+    assert state[-1].tool_calls[0]["name"] == "ReviseAnswer"
+
+
+def test_the_compact_graph_skips_it_too():
+    speculator = SpeculativeSearch()
+    graph = build_compact_graph(
+        llm=StubChatModel(latency=0.0),
+        search_tool=StubSearch(latency=0.0),
+        search_cache=SearchCache(path=None),
+        search_index=SearchIndex(path=None),
+        llm_scheduler=Scheduler("test_llm"),
+        search_scheduler=Scheduler("test_search"),
+        answer_cache=False,
+        speculator=speculator,
+        stopping_policy=MaxIterations(2),
+    )
+    graph.invoke({"question": "What is reflexion?"})
+    stats = speculator.stats()
+    assert stats["started"] > 0 and stats["used"] == stats["started"]
+
+
+def test_only_speculation_moves_the_search_queries_first(make_stub_graph):
+    assert list(ReviseAnswer.model_fields)[-2:] == ["search_queries", "reference"]
+    assert SpeculativeReviseAnswer.__name__ == "ReviseAnswer"  # the same tool
+    assert list(SpeculativeReviseAnswer.model_fields)[0] == "search_queries"
+    assert set(SpeculativeReviseAnswer.model_fields) == set(ReviseAnswer.model_fields)
+
+    def field_order(speculator):
+        state = make_stub_graph(speculator=speculator).invoke("What is reflexion?")
+        return list(state[-1].tool_calls[0]["args"])
+
+    assert field_order(False) == list(ReviseAnswer.model_fields)
+    assert field_order(SpeculativeSearch()) == list(SpeculativeReviseAnswer.model_fields)
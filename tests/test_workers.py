@@ -0,0 +1,80 @@
+import json
+import sqlite3
+from functools import partial
+
+from rate_limit import get_scheduler
+from workers import WorkQueue, _worker_main, run_pool, stub_graph
+
+
+def test_every_result_is_written_once_across_a_parent_restart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the stub graph keeps its search cache under .cache/
+    questions, output = tmp_path / "questions.jsonl", tmp_path / "answers.jsonl"
+    queue_path = str(tmp_path / "queue.sqlite")
+    records = [{"id": job_id, "question": f"What is {job_id}?"} for job_id in "abc"]
+    questions.write_text("".join(json.dumps(record) + "\n" for record in records))
+
+    # an earlier pool run: "a" made it into the output, then the parent died;
+    # a worker still finished "b", and "c" was in flight when it crashed too
+    queue = WorkQueue(queue_path)
+    queue.put(records)
+    for record in records:
+        queue.claim("worker-0")
+    queue.finish("a", {**records[0], "answer": "A"})
+    output.write_text(json.dumps(queue.results()[0]) + "\n")
+    queue.mark_written(["a"])
+    queue.finish("b", {**records[1], "answer": "B"})
+
+    counts = run_pool(
+        str(questions),
+        str(output),
+        workers=1,
+        queue_path=queue_path,
+        graph_factory=partial(stub_graph, llm_latency=0.0, search_latency=0.0),
+        report_interval=0.2,
+    )
+
+    lines = [json.loads(line) for line in output.read_text().splitlines()]
+    assert sorted(line["id"] for line in lines) == ["a", "b", "c"]
+    assert all("answer" in line for line in lines)
+    assert counts["answered"] == 2 and counts["crashed_workers"] == 0
+    assert WorkQueue(queue_path).results() == []
+
+
+def test_a_queue_from_before_the_written_flag_is_migrated(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE jobs (id TEXT PRIMARY KEY, question TEXT NOT NULL, status TEXT NOT NULL, "
+        "worker TEXT, result TEXT, enqueued_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+    )
+    db.execute("INSERT INTO jobs VALUES ('a', 'q', 'done', 'w', '{\"id\": \"a\"}', 0, 0, 1)")
+    db.commit()
+    db.close()
+
+    queue = WorkQueue(path)
+    assert queue.results() == []  # already written by the run that finished it
+    queue.put([{"id": "b", "question": "q"}])
+    queue.claim("worker-0")
+    queue.finish("b", {"id": "b", "answer": "B"})
+    assert queue.results() == [{"id": "b", "answer": "B"}]
+
+
+def test_each_worker_gets_its_share_of_the_rate_limits(tmp_path, monkeypatch):
+    monkeypatch.setenv("OPENAI_RPM", "400")
+    monkeypatch.setenv("OPENAI_TPM", "200000")
+    monkeypatch.setenv("TAVILY_RPM", "100")
+    monkeypatch.setenv("RATE_LIMIT_SHARE", "1")
+    limits = {}
+
+    def graph_factory():
+        limits.update({backend: get_scheduler(backend).limits for backend in ("openai", "tavily")})
+
+    get_scheduler.cache_clear()
+    try:
+        # an empty queue: the worker builds its graph and stops
+        _worker_main("worker-0", str(tmp_path / "queue.sqlite"), 1, graph_factory, share=1 / 4)
+    finally:
+        get_scheduler.cache_clear()
+    assert limits["openai"].requests_per_minute == 100
+    assert limits["openai"].tokens_per_minute == 50_000
+    assert limits["tavily"].requests_per_minute == 25
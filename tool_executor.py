@@ -1,14 +1,19 @@
-from dotenv import load_dotenv
-
-load_dotenv()
+import os
+from functools import cache
+from typing import Annotated, Any, Optional
 
+from dotenv import load_dotenv
 from langchain_core.tools import (
     StructuredTool,
 )  # allow us to convert a Python function into a tool that can be used by LLM
-from langchain_tavily import TavilySearch
-from langgraph.prebuilt import ToolNode  # a node in LAngGraph we can invoke
 
+from deadlines import arun_with_deadlines, get_search_deadlines, run_with_deadlines
+from dedup import DedupRegistry
+from passages import PassageExtractor
+from rate_limit import get_scheduler, scheduled
 from schemas import AnswerQuestion, ReviseAnswer
+from search_cache import SearchCache
+from search_index import SearchIndex
 
 # it takes a function and provides to LLM a structured schema for the function,
 # which helps LLM understand how to use the tool
@@ -20,7 +25,19 @@ from schemas import AnswerQuestion, ReviseAnswer
 
 
 # a langchain tool with the function of the search engine
-tavily_tool = TavilySearch(max_results=5)
+# built on first use (like the LLM in chains.py), so importing this module
+# neither constructs the client nor needs TAVILY_API_KEY / the network
+MAX_RESULTS = 5
+
+
+@cache
+def get_tavily_tool():
+    load_dotenv()
+    from langchain_tavily import TavilySearch  # heavy import, keep it off the startup path
+
+    return TavilySearch(max_results=MAX_RESULTS)
+
+
 # but we don't want to use it as it is, like we usually do
 # we want to do a cool trick here
 # we'll take the original Tavily tool and its functionality and create from
@@ -36,16 +53,308 @@ tavily_tool = TavilySearch(max_results=5)
 # it's going to help us in debugging and evaluating the response
 
 
-def run_queries(search_queries: list[str], **kwargs):
+# the same (or trivially re-worded) queries come back in every iteration and
+# every run, so we keep their results around and only pay Tavily for misses
+# (the SQLite file is opened on first use as well)
+@cache
+def get_search_cache() -> SearchCache:
+    return SearchCache()
+
+
+# every result we pay Tavily for is also ingested into a local BM25 index
+# (search_index.py); a query the cache doesn't know exactly is first tried
+# there, and only goes to Tavily when the local hits don't cover it well
+# enough or are too old. set SEARCH_INDEX=0 to always ask Tavily, and
+# SEARCH_INDEX_EMBEDDINGS=<openai embedding model> to add embedding re-ranking
+@cache
+def get_search_index() -> Optional[SearchIndex]:
+    load_dotenv()
+    if os.getenv("SEARCH_INDEX", "1") == "0":
+        return None
+    embeddings = None
+    if os.getenv("SEARCH_INDEX_EMBEDDINGS"):
+        from langchain_openai import OpenAIEmbeddings
+
+        embeddings = OpenAIEmbeddings(model=os.environ["SEARCH_INDEX_EMBEDDINGS"])
+    return SearchIndex(embeddings=embeddings)
+
+
+def _lookup_cached(search_cache, search_queries: list[str]) -> tuple[list, list[int]]:
+    """Return cached results (None for misses) and the indices of the misses"""
+    results = [search_cache.get(query, MAX_RESULTS) for query in search_queries]
+    misses = [i for i, result in enumerate(results) if result is None]
+    return results, misses
+
+
+def _lookup_local(search_index, search_queries, results, misses) -> list[int]:
+    """Answer what the local index can, return the indices still missing"""
+    if search_index is None:
+        return misses
+    remaining = []
+    for i in misses:
+        results[i] = search_index.search(search_queries[i], MAX_RESULTS)
+        if results[i] is None:
+            remaining.append(i)
+    return remaining
+
+
+def _store(search_cache, search_index, query: str, result) -> None:
+    # don't cache Tavily errors (or timeouts), the next run should retry them
+    if isinstance(result, dict) and "error" in result:
+        return
+    search_cache.set(query, MAX_RESULTS, result)
+    if search_index is not None:
+        search_index.ingest(result)
+
+
+def _fill_misses(search_cache, search_queries, results, misses, fetched, search_index=None):
+    for i, result in zip(misses, fetched):
+        results[i] = result
+        _store(search_cache, search_index, search_queries[i], result)
+    return results
+
+
+# the misses go out through the shared Tavily scheduler (rate_limit.py), so
+# concurrent runs share one requests-per-minute budget and back off together.
+# each miss runs on its own clock (deadlines.py): a slow query can be hedged
+# and is given up on after its timeout, the step goes on with partial results
+def search(
+    search_tool,
+    search_queries: list[str],
+    search_cache=None,
+    scheduler=None,
+    search_index=None,
+    deadlines=None,
+) -> list:
+    search_cache = search_cache or get_search_cache()
+    if search_index is None:  # an empty index is falsy, don't use `or`
+        search_index = get_search_index()
+    results, misses = _lookup_cached(search_cache, search_queries)
+    misses = _lookup_local(search_index, search_queries, results, misses)
+    if not misses:
+        return results
+    search_tool = scheduled(search_tool, scheduler or get_scheduler("tavily"))
+    queries = [search_queries[i] for i in misses]
+    fetched = run_with_deadlines(
+        search_tool.invoke,
+        [{"query": query} for query in queries],
+        queries,
+        deadlines or get_search_deadlines(),
+        on_late=lambda j, result: _store(search_cache, search_index, queries[j], result),
+    )
+    return _fill_misses(search_cache, search_queries, results, misses, fetched, search_index)
+
+
+async def asearch(
+    search_tool,
+    search_queries: list[str],
+    search_cache=None,
+    scheduler=None,
+    search_index=None,
+    deadlines=None,
+) -> list:
+    search_cache = search_cache or get_search_cache()
+    if search_index is None:  # an empty index is falsy, don't use `or`
+        search_index = get_search_index()
+    results, misses = _lookup_cached(search_cache, search_queries)
+    misses = _lookup_local(search_index, search_queries, results, misses)
+    if not misses:
+        return results
+    search_tool = scheduled(search_tool, scheduler or get_scheduler("tavily"))
+    queries = [search_queries[i] for i in misses]
+    # awaits all the misses concurrently instead of blocking a thread
+    fetched = await arun_with_deadlines(
+        search_tool.ainvoke,
+        [{"query": query} for query in queries],
+        queries,
+        deadlines or get_search_deadlines(),
+        on_late=lambda j, result: _store(search_cache, search_index, queries[j], result),
+    )
+    return _fill_misses(search_cache, search_queries, results, misses, fetched, search_index)
+
+
+# the raw payloads (five long results per query) are cut down to the passages
+# that match the query and the critique's `missing` part before they become
+# the ToolMessage the reviser reads; the cache and the index keep them whole.
+# passage_extractor.reports holds the latest savings, .stats() the totals
+PASSAGE_TOKEN_BUDGET = 1_200
+passage_extractor = PassageExtractor(token_budget=PASSAGE_TOKEN_BUDGET)
+
+
+def _missing(reflection: Optional[dict]) -> str:
+    return str((reflection or {}).get("missing") or "")
+
+
+# the tool call arguments carry the whole answer; besides search_queries we
+# also take the reflection, so the passages can be ranked against the critique
+def run_queries(search_queries: list[str], reflection: Optional[dict] = None, **kwargs):
     """Run the generated queries"""
-    return tavily_tool.batch([{"query": query} for query in search_queries])
-    # iterate over the queries and run concurrently with batch() function
+    results = search(get_tavily_tool(), search_queries)
+    return passage_extractor.extract(results, search_queries, _missing(reflection))
+
+
+async def arun_queries(
+    search_queries: list[str], reflection: Optional[dict] = None, **kwargs
+):
+    """Run the generated queries (async version, used by graph.ainvoke)"""
+    results = await asearch(get_tavily_tool(), search_queries)
+    return passage_extractor.extract(results, search_queries, _missing(reflection))
+
+
+# documents a run has already seen (same URL, same or nearly the same content)
+# come back as compact references to the earlier ToolMessage, see dedup.py;
+# dedup_registry.stats() has the bytes / tokens saved
+dedup_registry = DedupRegistry()
+
+
+# the search part of execute_tools, also used by the compact graph
+# (compact_graph.py). run(search_queries, messages) / arun(...) return the raw
+# payloads of a step's queries: through search_cache, search_index, scheduler
+# and deadlines, taking over what the speculator (speculation.SpeculativeSearch)
+# already started for the run of `messages`
+def build_search_step(
+    search_tool=None,
+    search_cache=None,
+    scheduler=None,
+    search_index=None,
+    deadlines=None,
+    speculator=None,
+):
+    def search_args(search_queries):
+        return (
+            search_tool or get_tavily_tool(),
+            search_queries,
+            search_cache,
+            scheduler,
+            search_index,
+            deadlines,
+        )
+
+    if speculator is not None:
+        speculator.run = lambda query: search(*search_args([query]))[0]
+
+        async def speculate(query):
+            return (await asearch(*search_args([query])))[0]
+
+        speculator.arun = speculate
+
+    def speculated(search_queries, messages):
+        if speculator is None or not messages:
+            return {}
+        return speculator.take(messages, search_queries)
+
+    def combine(search_queries, ready, fetched):
+        fetched = iter(fetched)
+        return [ready[i] if i in ready else next(fetched) for i in range(len(search_queries))]
+
+    def run(search_queries: list[str], messages=None) -> list:
+        ready = speculator.collect(speculated(search_queries, messages)) if speculator else {}
+        remaining = [query for i, query in enumerate(search_queries) if i not in ready]
+        fetched = search(*search_args(remaining)) if remaining else []
+        return combine(search_queries, ready, fetched)
+
+    async def arun(search_queries: list[str], messages=None) -> list:
+        ready = await speculator.acollect(speculated(search_queries, messages)) if speculator else {}
+        remaining = [query for i, query in enumerate(search_queries) if i not in ready]
+        fetched = await asearch(*search_args(remaining)) if remaining else []
+        return combine(search_queries, ready, fetched)
+
+    return run, arun
 
 
 # create a ToolNode object
-execute_tools = ToolNode(
-    [
-        StructuredTool.from_function(run_queries, name=AnswerQuestion.__name__),
-        StructuredTool.from_function(run_queries, name=ReviseAnswer.__name__),
-    ]
-)
+# each tool gets both a sync and an async implementation, the ToolNode picks
+# the right one depending on whether the graph is run with invoke() or ainvoke()
+# search_tool can be swapped for anything with batch()/abatch(), e.g. a stub,
+# and search_cache for another SearchCache (e.g. an in-memory one),
+# scheduler for another rate_limit.Scheduler, search_index for another SearchIndex,
+# extractor for another PassageExtractor, registry for another DedupRegistry
+# and deadlines for other deadlines.Deadlines (per-query timeout / hedging).
+# with a speculator (speculation.SpeculativeSearch), the queries the draft /
+# reviser already started while streaming are taken over instead of searched again
+def build_execute_tools(
+    search_tool=None,
+    search_cache=None,
+    scheduler=None,
+    search_index=None,
+    extractor=None,
+    registry=None,
+    deadlines=None,
+    speculator=None,
+):
+    from langchain_core.tools import InjectedToolCallId
+    from langgraph.prebuilt import InjectedState, ToolNode  # a node in LAngGraph we can invoke
+
+    extractor = extractor or passage_extractor
+    registry = registry or dedup_registry
+    run, arun = build_search_step(
+        search_tool, search_cache, scheduler, search_index, deadlines, speculator
+    )
+
+    def messages_of(state):
+        # the ToolNode hands a MessageGraph state over as {"messages": [...]}
+        return state.get("messages") if isinstance(state, dict) else state
+
+    def postprocess(results, search_queries, reflection, messages, tool_call_id):
+        def extract(fresh):
+            return extractor.extract(fresh, search_queries, _missing(reflection))
+
+        if not messages:
+            return extract(results)
+        return registry.process(messages, results, tool_call_id, extract)
+
+    # state and tool_call_id are injected by the ToolNode, the model never sees them
+    def func(
+        search_queries: list[str],
+        reflection: Optional[dict] = None,
+        state: Annotated[Any, InjectedState] = None,
+        tool_call_id: Annotated[Optional[str], InjectedToolCallId] = None,
+        **kwargs,
+    ):
+        """Run the generated queries"""
+        messages = messages_of(state)
+        results = run(search_queries, messages)
+        return postprocess(results, search_queries, reflection, messages, tool_call_id)
+
+    async def coroutine(
+        search_queries: list[str],
+        reflection: Optional[dict] = None,
+        state: Annotated[Any, InjectedState] = None,
+        tool_call_id: Annotated[Optional[str], InjectedToolCallId] = None,
+        **kwargs,
+    ):
+        """Run the generated queries"""
+        messages = messages_of(state)
+        results = await arun(search_queries, messages)
+        return postprocess(results, search_queries, reflection, messages, tool_call_id)
+
+    return ToolNode(
+        [
+            StructuredTool.from_function(
+                func, coroutine=coroutine, name=AnswerQuestion.__name__
+            ),
+            StructuredTool.from_function(
+                func, coroutine=coroutine, name=ReviseAnswer.__name__
+            ),
+        ]
+    )
+
+
+@cache
+def get_execute_tools():
+    return build_execute_tools()
+
+
+_LAZY_ATTRIBUTES = {
+    "tavily_tool": get_tavily_tool,
+    "search_cache": get_search_cache,
+    "search_index": get_search_index,
+    "execute_tools": get_execute_tools,
+}
+
+
+def __getattr__(name):
+    # PEP 562: `tool_executor.execute_tools` etc. are built on first access
+    if name in _LAZY_ATTRIBUTES:
+        return _LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
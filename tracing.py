@@ -0,0 +1,210 @@
+# this file holds the per-run instrumentation of the reflexion graph
+# Tracer is a langchain callback handler, so it sees every run inside the graph
+# without touching the nodes themselves:
+# 1. "node" spans: draft / execute_tools / reviser
+# 2. "llm" spans: every chat model call (prompt + completion tokens, and the
+#    prompt tokens the provider served from its prompt cache)
+# 3. "search" spans: every Tavily query that actually went out (cache misses)
+# each span records latency, tokens, retry count, payload size and the
+# iteration it belongs to, and is handed to pluggable exporters:
+# JsonLinesExporter (one span per line) and AggregateExporter (p50/p95/p99).
+#
+# usage: graph.invoke(question, config={"callbacks": [Tracer([JsonLinesExporter("spans.jsonl")])]})
+
+import json
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Protocol, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import BaseMessage
+
+NODE_NAMES = ("answer_cache", "draft", "execute_tools", "reviser")
+
+
+class SpanExporter(Protocol):
+    def export(self, span: dict) -> None: ...
+
+
+class JsonLinesExporter:
+    """Append every finished span to a JSON-lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: dict) -> None:
+        line = json.dumps(span, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class AggregateExporter:
+    """Keep in-process aggregates per span (kind, name): count, p50/p95/p99, tokens."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[tuple, List[float]] = defaultdict(list)
+        self._totals: Dict[tuple, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def export(self, span: dict) -> None:
+        key = (span["kind"], span["name"])
+        with self._lock:
+            self._latencies[key].append(span["latency"])
+            totals = self._totals[key]
+            for field in (
+                "prompt_tokens",
+                "cached_tokens",
+                "completion_tokens",
+                "retries",
+                "payload_bytes",
+            ):
+                totals[field] += span.get(field) or 0
+            totals["errors"] += 1 if span.get("error") else 0
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            summary = {}
+            for (kind, name), latencies in sorted(self._latencies.items()):
+                ordered = sorted(latencies)
+                summary[f"{kind}:{name}"] = {
+                    "count": len(ordered),
+                    "total_seconds": sum(ordered),
+                    "p50": _percentile(ordered, 0.50),
+                    "p95": _percentile(ordered, 0.95),
+                    "p99": _percentile(ordered, 0.99),
+                    **self._totals[(kind, name)],
+                }
+            return summary
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, BaseMessage):
+        return {"content": value.content, "tool_calls": getattr(value, "tool_calls", None)}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    return value
+
+
+def _payload_bytes(value: Any) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode())
+    return len(json.dumps(_jsonable(value), default=str).encode())
+
+
+def _iteration(metadata: Optional[dict]) -> Optional[int]:
+    # steps go draft(1) -> execute_tools(2) -> reviser(3) -> execute_tools(4) ...,
+    # so iteration 0 is the draft and iteration n is the n-th search + revision
+    step = (metadata or {}).get("langgraph_step")
+    return step // 2 if isinstance(step, int) else None
+
+
+class Tracer(BaseCallbackHandler):
+    """Callback handler that turns graph / LLM / search runs into spans."""
+
+    def __init__(self, exporters: Sequence[SpanExporter] = ()):
+        self.exporters = list(exporters)
+        self._open: Dict[UUID, dict] = {}
+        self._lock = threading.Lock()
+
+    # ── span bookkeeping ───────────────────────────────────────────────────
+    def _start(self, run_id: UUID, kind: str, name: str, metadata, payload) -> None:
+        with self._lock:
+            self._open[run_id] = {
+                "kind": kind,
+                "name": name,
+                "run_id": str(run_id),
+                "iteration": _iteration(metadata),
+                "started_at": time.time(),
+                "_start": time.perf_counter(),
+                "retries": 0,
+                "payload_bytes": _payload_bytes(payload),
+            }
+
+    def _end(self, run_id: UUID, output: Any = None, error: Any = None, **fields) -> None:
+        with self._lock:
+            span = self._open.pop(run_id, None)
+        if span is None:
+            return  # not a run we trace
+        span["latency"] = time.perf_counter() - span.pop("_start")
+        span["payload_bytes"] += _payload_bytes(output)
+        if error is not None:
+            span["error"] = repr(error)
+        span.update(fields)
+        for exporter in self.exporters:
+            exporter.export(span)
+
+    # ── graph nodes ────────────────────────────────────────────────────────
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        name = kwargs.get("name")
+        # nested chains inside a node carry the same metadata, only the node run
+        # itself is named after the node
+        if name in NODE_NAMES and (metadata or {}).get("langgraph_node") == name:
+            self._start(run_id, "node", name, metadata, inputs)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id, outputs)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # ── LLM calls ──────────────────────────────────────────────────────────
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        name = (metadata or {}).get("ls_model_name") or kwargs.get("name") or "chat_model"
+        self._start(run_id, "llm", name, metadata, messages)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        from routing import cached_tokens
+
+        prompt_tokens = cached = completion_tokens = 0
+        outputs = []
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or {}
+                prompt_tokens += usage.get("input_tokens", 0)
+                cached += cached_tokens(usage)
+                completion_tokens += usage.get("output_tokens", 0)
+                outputs.append(
+                    getattr(message, "tool_calls", None) or generation.text
+                )
+        self._end(
+            run_id,
+            outputs,
+            prompt_tokens=prompt_tokens,
+            cached_tokens=cached,
+            completion_tokens=completion_tokens,
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # ── search queries ─────────────────────────────────────────────────────
+    def on_tool_start(self, serialized, input_str, *, run_id, metadata=None, inputs=None, **kwargs):
+        # the AnswerQuestion / ReviseAnswer StructuredTools wrap the whole batch,
+        # the individual Tavily queries show up as nested tavily_search runs
+        name = kwargs.get("name") or (serialized or {}).get("name") or "tool"
+        kind = "search" if "tavily" in name.lower() or "search" in name.lower() else "tool"
+        self._start(run_id, kind, name, metadata, inputs or input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, output)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # ── retries (Runnable.with_retry) ──────────────────────────────────────
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            if run_id in self._open:
+                self._open[run_id]["retries"] += 1
@@ -0,0 +1,409 @@
+# this file holds the multi-process worker pool for large batches
+# batch.py runs every question on one event loop in one process; past a few
+# dozen questions in flight the GIL and the CPU time spent on JSON, pydantic
+# validation and prompt rendering are the limit, not OpenAI or Tavily. here:
+# 1. work queue: a SQLite table in WAL mode (WorkQueue). the questions are
+#    enqueued once, workers claim the next queued one in a write transaction,
+#    so no question is handed out twice
+# 2. workers: N processes, each with its own compiled graph (graph_factory),
+#    running up to `concurrency` questions at a time like batch.py
+# 3. shared caches: the search cache and the LLM response cache are SQLite
+#    files in WAL mode as well (search_cache.open_db) and read through to the
+#    file on a miss, so what one worker fetched is a hit for all of them. the
+#    local search index and the answer cache live in the same kind of file but
+#    are loaded into memory when a worker starts: a worker sees what the
+#    others added to them only in the next pool run
+# 4. rate limits: each worker has its own schedulers (rate_limit.py), so
+#    every one of N workers gets 1/N of OPENAI_RPM / OPENAI_TPM / TAVILY_RPM
+#    (RATE_LIMIT_SHARE) and the pool as a whole stays within the limits
+# 5. reporting: every worker writes its busy time and job counts to the queue
+#    file; the pool logs queue depth and per-worker utilization every
+#    report_interval seconds and prints a summary table at the end
+#    (the queue calls run in a thread: a busy SQLite file must not stall the
+#    questions in flight on the worker's event loop)
+# the output is batch.py's JSONL: every finished job has a `written` flag,
+# set once its line is in the output file, so results that finished while the
+# parent was down are written by the next run. the queue outlives the pool:
+# run it again and finished questions are kept, running (crashed) and failed
+# ones retried.
+#
+# usage: python workers.py questions.jsonl answers.jsonl [--workers 4] [--concurrency 4]
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional
+
+from rich.console import Console
+from rich.table import Table
+
+from batch import final_answer, read_questions
+from main import MAX_CONCURRENCY
+from search_cache import open_db
+
+DEFAULT_QUEUE_PATH = ".cache/work_queue.sqlite"
+DEFAULT_REPORT_INTERVAL = 5.0  # seconds between two progress lines
+HEARTBEAT_SECONDS = 1.0  # how often a worker publishes its numbers
+
+console = Console(stderr=True)
+
+
+class WorkQueue:
+    """Questions, their results and the worker stats, in one SQLite file."""
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH):
+        self.path = path
+        self._db = open_db(path)
+        self._db.isolation_level = None  # explicit transactions, see claim()
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, question TEXT NOT NULL, status TEXT NOT NULL, "
+            "worker TEXT, result TEXT, enqueued_at REAL NOT NULL, "
+            "started_at REAL, finished_at REAL, written INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        if "written" not in columns:
+            # a queue from before the flag: its finished jobs were written out
+            # by the run that saw them finish
+            self._db.execute("BEGIN IMMEDIATE")
+            self._db.execute("ALTER TABLE jobs ADD COLUMN written INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("UPDATE jobs SET written = 1 WHERE status IN ('done', 'failed')")
+            self._db.execute("COMMIT")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, enqueued_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_unwritten ON jobs (written, status)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS workers ("
+            "worker TEXT PRIMARY KEY, pid INTEGER, concurrency INTEGER, started_at REAL, "
+            "seen_at REAL, busy_seconds REAL, in_flight INTEGER, done INTEGER, failed INTEGER)"
+        )
+
+    def put(self, records: Iterable[dict]) -> int:
+        """Enqueue {"id", "question"} records; ids already in the queue are skipped."""
+        now = time.time()
+        with self._lock:
+            before = self._db.total_changes
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR IGNORE INTO jobs (id, question, status, enqueued_at) "
+                "VALUES (?, ?, 'queued', ?)",
+                ((record["id"], record["question"], now) for record in records),
+            )
+            self._db.execute("COMMIT")
+            return self._db.total_changes - before
+
+    def requeue(self, statuses=("running", "failed")) -> int:
+        """Hand jobs of a previous (crashed / failed) pool run out again."""
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'queued', worker = NULL, result = NULL, "
+                f"written = 0 WHERE status IN ({placeholders})",
+                tuple(statuses),
+            )
+            return cursor.rowcount
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """The oldest queued job, marked as running for `worker`, or None."""
+        with self._lock:
+            # IMMEDIATE takes the write lock up front: two workers can't both
+            # read the same queued row before one of them marks it
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT id, question FROM jobs WHERE status = 'queued' "
+                    "ORDER BY enqueued_at, rowid LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'running', worker = ?, started_at = ? "
+                        "WHERE id = ?",
+                        (worker, time.time(), row[0]),
+                    )
+            finally:
+                self._db.execute("COMMIT")
+        return {"id": row[0], "question": row[1]} if row else None
+
+    def finish(self, job_id: str, result: dict) -> None:
+        status = "done" if "answer" in result else "failed"
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                (status, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+            )
+
+    def depth(self) -> Dict[str, int]:
+        """Number of jobs per status (queued / running / done / failed)."""
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            counts.update(dict(rows.fetchall()))
+            return counts
+
+    def results(self) -> List[dict]:
+        """Results of the finished jobs that aren't in the output yet, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT result FROM jobs WHERE written = 0 AND status IN ('done', 'failed') "
+                "ORDER BY finished_at, rowid"
+            ).fetchall()
+        return [json.loads(result) for (result,) in rows]
+
+    def mark_written(self, job_ids: Iterable[str]) -> None:
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "UPDATE jobs SET written = 1 WHERE id = ?", ((job_id,) for job_id in job_ids)
+            )
+            self._db.execute("COMMIT")
+
+    def heartbeat(self, worker: str, stats: dict) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO workers (worker, pid, concurrency, started_at, "
+                "seen_at, busy_seconds, in_flight, done, failed) "
+                "VALUES (:worker, :pid, :concurrency, :started_at, :seen_at, "
+                ":busy_seconds, :in_flight, :done, :failed)",
+                {"worker": worker, "seen_at": time.time(), **stats},
+            )
+
+    def workers(self, since: float = 0.0) -> List[dict]:
+        """Stats of the workers started after `since`, with their utilization.
+
+        utilization = busy slot-seconds / (concurrency × seconds alive): 100%
+        means every slot of the worker had a question in flight all the time.
+        """
+        with self._lock:
+            cursor = self._db.execute(
+                "SELECT * FROM workers WHERE started_at >= ? ORDER BY worker", (since,)
+            )
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        for row in rows:
+            alive = max(row["seen_at"] - row["started_at"], 1e-9)
+            row["utilization"] = row["busy_seconds"] / (alive * row["concurrency"])
+        return rows
+
+
+# ── worker process ────────────────────────────────────────────────────────
+def default_graph():
+    from main import get_graph
+
+    return get_graph()
+
+
+# offline workers for trying the pool out / measuring its scaling. the stub
+# searches go to their own shared cache file, not to the real search cache
+def stub_graph(llm_latency: float = 0.05, search_latency: float = 0.02):
+    from main import build_graph
+    from rate_limit import Scheduler
+    from search_cache import SearchCache
+    from search_index import SearchIndex
+    from stubs import StubChatModel, StubSearch
+
+    return build_graph(
+        llm=StubChatModel(latency=llm_latency),
+        search_tool=StubSearch(latency=search_latency),
+        search_cache=SearchCache(path=".cache/stub_search_cache.sqlite"),
+        search_index=SearchIndex(path=None),
+        # no provider limits to respect, the real ones would throttle the stubs
+        llm_scheduler=Scheduler("stub_llm"),
+        search_scheduler=Scheduler("stub_search"),
+        answer_cache=False,
+    )
+
+
+async def _work(worker: str, queue_path: str, concurrency: int, graph_factory: Callable) -> None:
+    queue = WorkQueue(queue_path)
+    graph = graph_factory()
+    stats = {
+        "pid": os.getpid(),
+        "concurrency": concurrency,
+        "started_at": time.time(),
+        "busy_seconds": 0.0,
+        "in_flight": 0,
+        "done": 0,
+        "failed": 0,
+    }
+    running: Dict[asyncio.Task, float] = {}  # task -> start time
+
+    def snapshot() -> dict:
+        now = time.time()
+        busy = stats["busy_seconds"] + sum(now - start for start in running.values())
+        return {**stats, "busy_seconds": busy, "in_flight": len(running)}
+
+    async def heartbeat() -> None:
+        while True:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            await asyncio.to_thread(queue.heartbeat, worker, snapshot())
+
+    async def run(job: dict) -> None:
+        try:
+            result = {**job, **final_answer(await graph.ainvoke(job["question"]))}
+            stats["done"] += 1
+        except Exception as error:  # keep going, the error is recorded
+            result = {**job, "error": repr(error)}
+            stats["failed"] += 1
+        await asyncio.to_thread(queue.finish, job["id"], result)
+
+    def finished(task: asyncio.Task) -> None:
+        stats["busy_seconds"] += time.time() - running.pop(task)
+
+    queue.heartbeat(worker, snapshot())
+    beat = asyncio.create_task(heartbeat())
+    try:
+        while True:
+            if len(running) >= concurrency:
+                await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            job = await asyncio.to_thread(queue.claim, worker)
+            if job is None:
+                if not running:
+                    break  # nothing queued and nothing left in flight here
+                await asyncio.wait(list(running), return_when=asyncio.FIRST_COMPLETED)
+                continue
+            task = asyncio.create_task(run(job))
+            running[task] = time.time()
+            task.add_done_callback(finished)
+    finally:
+        beat.cancel()
+        queue.heartbeat(worker, snapshot())
+
+
+def _worker_main(
+    worker: str, queue_path: str, concurrency: int, graph_factory: Callable, share: float = 1.0
+) -> None:
+    # before the graph (and its schedulers) are built: this worker's part of
+    # the provider limits, see rate_limit.get_scheduler
+    os.environ["RATE_LIMIT_SHARE"] = str(share * float(os.getenv("RATE_LIMIT_SHARE", 1)))
+    asyncio.run(_work(worker, queue_path, concurrency, graph_factory))
+
+
+# ── pool ──────────────────────────────────────────────────────────────────
+def _report(queue: WorkQueue, since: float) -> None:
+    depth = queue.depth()
+    workers = " ".join(
+        f"{row['worker']} {row['utilization']:.0%} ({row['in_flight']} in flight)"
+        for row in queue.workers(since)
+    )
+    console.log(
+        f"queue: {depth['queued']} queued, {depth['running']} running, "
+        f"{depth['done']} done, {depth['failed']} failed | {workers}"
+    )
+
+
+def print_worker_table(queue: WorkQueue, since: float) -> None:
+    table = Table(title="⚙️  Workers")
+    for column in ("worker", "pid", "done", "failed", "busy (s)", "alive (s)", "utilization"):
+        table.add_column(column)
+    for row in queue.workers(since):
+        table.add_row(
+            row["worker"],
+            str(row["pid"]),
+            str(row["done"]),
+            str(row["failed"]),
+            f"{row['busy_seconds']:.1f}",
+            f"{row['seen_at'] - row['started_at']:.1f}",
+            f"{row['utilization']:.0%}",
+        )
+    console.print(table)
+
+
+def run_pool(
+    input_path: str,
+    output_path: str,
+    workers: Optional[int] = None,
+    concurrency: int = MAX_CONCURRENCY,
+    queue_path: str = DEFAULT_QUEUE_PATH,
+    graph_factory: Callable = default_graph,
+    report_interval: float = DEFAULT_REPORT_INTERVAL,
+) -> dict:
+    """Run a JSONL file of questions on `workers` processes, append the answers to output_path.
+
+    graph_factory builds a worker's graph inside the worker process, so it
+    has to be picklable (a module-level function, or a functools.partial of one).
+    """
+    workers = workers or os.cpu_count() or 1
+    started = time.time()
+    queue = WorkQueue(queue_path)
+    requeued = queue.requeue()
+    enqueued = queue.put(read_questions(input_path))
+    console.log(f"enqueued {enqueued} questions, {requeued} requeued from an earlier run")
+
+    # spawn, not fork: the parent may already hold threads and SQLite connections
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_worker_main,
+            args=(f"worker-{i}", queue_path, concurrency, graph_factory, 1 / workers),
+            name=f"worker-{i}",
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    counts = {"answered": 0, "failed": 0}
+    with open(output_path, "a", encoding="utf-8") as out:
+
+        def flush() -> None:
+            # flagged only once the lines are on disk: a crash in between
+            # writes them twice rather than never
+            results = queue.results()
+            for result in results:
+                counts["answered" if "answer" in result else "failed"] += 1
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            os.fsync(out.fileno())
+            queue.mark_written(result["id"] for result in results)
+
+        while any(process.is_alive() for process in processes):
+            for process in processes:
+                process.join(timeout=report_interval / len(processes))
+            flush()
+            _report(queue, started)
+        flush()
+
+    crashed = [process.name for process in processes if process.exitcode]
+    if crashed:
+        console.log(f"[red]workers exited with an error: {', '.join(crashed)}")
+    print_worker_table(queue, started)
+    return {**counts, "queue": queue.depth(), "crashed_workers": len(crashed)}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions on a worker pool")
+    parser.add_argument("input", help="JSONL file, one {'id', 'question'} per line")
+    parser.add_argument("output", help="JSONL file the answers are appended to")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: CPUs)")
+    parser.add_argument(
+        "--concurrency", type=int, default=MAX_CONCURRENCY, help="questions in flight per worker"
+    )
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="SQLite work queue file")
+    parser.add_argument("--report-interval", type=float, default=DEFAULT_REPORT_INTERVAL)
+    parser.add_argument(
+        "--stubs", action="store_true", help="offline: stub model and search (stubs.py)"
+    )
+    args = parser.parse_args()
+
+    counts = run_pool(
+        args.input,
+        args.output,
+        workers=args.workers,
+        concurrency=args.concurrency,
+        queue_path=args.queue,
+        graph_factory=partial(stub_graph) if args.stubs else default_graph,
+        report_interval=args.report_interval,
+    )
+    console.print(counts)
+    return 1 if counts["failed"] or counts["crashed_workers"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())